@@ -167,52 +167,40 @@ def get_w_potential(thickness):
 
     return pot_w_descr
 
-def charge_collected(t_e_trapping, t_h_trapping,
-                     t_e_t1, t_h_t1, thickness,
-                     pot_descr):
-    potw_descr = get_w_potential(thickness) 
-    return analysis.get_charge_planar(WIDTH, thickness, pot_descr, pot_w_descr=potw_descr,
-                                      t_e_trapping=t_e_trapping, t_h_trapping=t_h_trapping,
-                                      t_e_t1=t_e_t1, t_h_t1=t_h_t1, t_r=None,
-                                      grid_x=5, grid_y=25, n_pairs=10, dt=0.001,
-                                      n_steps=20000, temperature=TEMP, multicore=False)
-
-def ccs(t_trappings, t_t1, n_eff, thickness, biases):
-    cc = []
-    for v in biases:
-        pot_descr=get_potential(V_bias=v,
-                                n_eff=n_eff,
-                                thickness=thickness)
-        _, _, charge = charge_collected(t_e_trapping=t_trappings,
-                                        t_h_trapping=t_trappings,
-                                        t_e_t1=t_t1,
-                                        t_h_t1=t_t1,
-                                        thickness=thickness,
-                                        pot_descr=pot_descr)
-        cc.append(charge)
+def ccs(points, n_eff, sensors):
+    ''' Collected charge maps for all trapping time points (t_trapping, t_t1)
+        and sensors (thickness, biases). Everything is simulated in one batch
+        to keep all cores busy.
+
+        Returns per point a list with the charge maps (bias, y, x) per sensor.
+    '''
+    def descriptions(bias, thickness):
+        return (get_potential(V_bias=bias, n_eff=n_eff, thickness=thickness),
+                get_w_potential(thickness))
+
+    parameters = [(t_trappings, t_t1, v, thickness)
+                  for t_trappings, t_t1 in points
+                  for thickness, biases in sensors
+                  for v in biases]
+    results = analysis.get_charge_planar_batch(
+        WIDTH, parameters, descriptions, t_r=None, grid_x=5, grid_y=25,
+        n_pairs=10, dt=0.001, n_steps=20000, temperature=TEMP)
 #         objgraph.show_growth()
 
-    return np.array(cc)
+    # Split into points and sensors
+    charges = iter([charge for _, _, charge in results])
+    return [[np.array([next(charges) for _ in biases])
+             for _, biases in sensors] for _ in points]
 
 
 def find_trappig():
     # Calculated unirradiated case
-    _, _, cc_0_1 = charge_collected(t_e_trapping=300000,
-                                    t_h_trapping=300000,
-                                    t_e_t1=0.,
-                                    t_h_t1=0.,
-                                    thickness=THICKNESS_1,
-                                    pot_descr=get_potential(V_bias=-80,
-                                                            n_eff=NEFF0,
-                                                            thickness=THICKNESS_1))
-#     _, _, cc_0_2 = charge_collected(t_e_trapping=300000,
-#                                     t_h_trapping=300000,
-#                                     t_e_t1=0.,
-#                                     t_h_t1=0.,
-#                                     thickness=THICKNESS_2,
-#                                     pot_descr=get_potential(V_bias=-80,
-#                                                             n_eff=NEFF0,
-#                                                             thickness=THICKNESS_2))
+    [cc_0_1], = ccs(points=[(300000, 0.)], n_eff=NEFF0,
+                    sensors=[(THICKNESS_1, [-80])])
+    cc_0_1 = cc_0_1[0]
+#     [cc_0_2], = ccs(points=[(300000, 0.)], n_eff=NEFF0,
+#                     sensors=[(THICKNESS_2, [-80])])
+#     cc_0_2 = cc_0_2[0]
 
     with open(RESULT, "a+") as myfile:
         myfile.write('Biases 1 %s\n' % str(BIASES_1))
@@ -224,51 +212,57 @@ def find_trappig():
         myfile.write(
             'Fluence\tN_eff\tt_e\tt_h\tt1_e\tt1_h\tCCE12\tChi2\n')
 
+    bounds = [(2., 6.), (0., 0.5)]
+    eps = 0.01  # Finite difference step
+
+    def chi2s(points):
+        # Chi2 of all trapping time points (tr, tr1), simulated in one batch
+        values = []
+        cc = ccs(points, n_eff=NEFF2, sensors=[(THICKNESS_1, BIASES_1_2)])
+        for (tr, tr1), (cc_1_2, ) in zip(points, cc):
+#             # Sensor 1 1e15, see find_trapping_grid.py
+            # Sensor 1 7e15
+            cce_1_2 = cc_1_2.sum(axis=(1, 2)) / cc_0_1.sum() * 100.
+            chi2 = chi2_to_spline(SPLINE_1_2, np.abs(BIASES_1_2), cce_1_2)
+#             # Sensor 2, see find_trapping_grid.py
+            try:
+                with open(RESULT, "a+") as myfile:
+                    myfile.write('%d\t%d\t%1.6e\t%1.6e\t%1.6e\t%1.6e\t%s\t%1.3f\n' % (
+                        FLUENCE_1, NEFF, tr, tr, tr1, tr1, str(cce_1_2), chi2))
+            except:
+                print 'FAILED WRITING'
+            print 'chi2', chi2
+            values.append(chi2)
+
+        return np.array(values)
+
     def minimize_me(args):
-        tr = args[0]
-        tr1 = args[1]
-#         # Sensor 1 1e15
-#         cc_1 = ccs(t_trappings=tr, t_t1=tr1, n_eff=NEFF,
-#                    thickness=THICKNESS_1, biases=BIASES_1)
-#         cce_1 = cc_1.sum(axis=(1, 2)) / cc_0_1.sum() * 100.
-#         chi2 = chi2_to_spline(SPLINE_1, np.abs(BIASES_1), cce_1)
-        # Sensor 1 7e15
-        cc_1_2 = ccs(t_trappings=tr, t_t1=tr1, n_eff=NEFF2, thickness=THICKNESS_1, biases=BIASES_1_2)
-        cce_1_2 = cc_1_2.sum(axis=(1, 2)) / cc_0_1.sum() * 100.
-        chi2 = chi2_to_spline(SPLINE_1_2, np.abs(BIASES_1_2), cce_1_2)
-#         # Sensor 2
-#         cc_2 = ccs(t_trappings=tr, t_t1=tr1, n_eff=NEFF,
-#                    thickness=THICKNESS_2, biases=BIASES_2)
-#         cce_2 = cc_2.sum(axis=(1, 2)) / cc_0_2.sum() * 100.
-#         chi2 = np.sqrt(
-#             chi2**2 + chi2_to_spline(SPLINE_2, np.abs(BIASES_2), cce_2)**2)
-        try:
-            with open(RESULT, "a+") as myfile:
-                myfile.write('%d\t%d\t%1.6e\t%1.6e\t%1.6e\t%1.6e\t%s\t%1.3f\n' % (
-                    FLUENCE_1, NEFF, tr, tr, tr1, tr1, str(cce_1_2), chi2))
-        except:
-            print 'FAILED WRITING'
-        print 'chi2', chi2
-                
-        return chi2
+        # Chi2 and its forward difference gradient, the whole stencil is
+        # simulated in one batch. The steps point into the bounds.
+        args = np.asarray(args, dtype=float)
+        steps = np.array([eps if x + eps <= high else -eps
+                          for x, (_, high) in zip(args, bounds)])
+        points = [args] + [args + step * unit
+                           for step, unit in zip(steps, np.eye(args.shape[0]))]
+        values = chi2s([tuple(point) for point in points])
+        return values[0], (values[1:] - values[0]) / steps
 
     if FIT:
         optimize.minimize(fun=minimize_me,
                           x0=[TR0, TR1],
                           args=(),
                           method='SLSQP',
-                          jac=None,
-                          bounds=[(2., 6.), (0., 0.5)],
+                          jac=True,
+                          bounds=bounds,
                           constraints=(),
                           tol=None,
                           callback=None,
                           options={'disp': False,
                                    'iprint': 1,
-                                   'eps': 0.01,
                                    'maxiter': 5,
                                    'ftol': 1e-04})
     else:
-        minimize_me(args=[TR0, TR1])
+        chi2s([(TR0, TR1)])
 
 #     optimize.basinhopping(func=minimize_me,
 #                           x0=[5., 0.],
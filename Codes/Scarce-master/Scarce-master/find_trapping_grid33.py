@@ -178,100 +178,108 @@ def get_w_potential():
     return pot_w_descr
 
 
-def charge_collected(t_e_trapping, t_h_trapping,
-                     t_e_t1, t_h_t1, pot_descr):
-    potw_descr = get_w_potential()
-    return analysis.get_charge_3D(GEOM_DESCR, pot_descr, potw_descr,
-                                  t_e_trapping=t_e_trapping, t_h_trapping=t_h_trapping,
-                                  t_e_t1=t_e_t1, t_h_t1=t_h_t1,
-                                  grid_x=5, grid_y=5, n_pairs=10, dt=0.001,
-                                  n_steps=20000, temperature=TEMP, multicore=False)
-
-
-def ccs(t_trappings, t_t1, n_eff, biases, cc_0_1):
-    cc = []
-    for v in biases:
-        pot_descr = get_potential(V_bias=v,
-                                  n_eff=n_eff)
-        edge_x, edge_y, charge = charge_collected(t_e_trapping=t_trappings,
-                                        t_h_trapping=t_trappings,
-                                        t_e_t1=t_t1,
-                                        t_h_t1=t_t1,
-                                        pot_descr=pot_descr)
-        cc.append(charge)
-
-        # Plot collected charge map
-        plt.clf()
-        plt.gca().set_aspect('equal')
-        plt.gca().invert_yaxis()
-        cmap = cm.get_cmap('inferno')
-        cmap.set_bad('white')
-
-        cmesh = plt.pcolormesh(edge_x, edge_y, charge / cc_0_1,
-                               cmap=cmap, vmin=0, vmax=1.05)
-        plt.title('Charge collection, fluence %1.2f neq_cm2' % 0)
-        plt.grid()
-        cax = plt.gcf().add_axes([plt.gca().get_position().xmax, 0.1, 0.05,
-                                  plt.gca().get_position().ymax - plt.gca().get_position().ymin])
-        plt.colorbar(cmesh, cax=cax, orientation='vertical')
-        plt.grid()
-        plt.savefig('CCE_%d_%d_3D.pdf' % (NEFF, v), layout='tight')
+def ccs(points, n_eff, biases, cc_0_1=None):
+    ''' Collected charge maps for all trapping time points (t_trapping, t_t1)
+        and biases. Everything is simulated in one batch to keep all cores
+        busy. The maps of the first point are plotted relative to cc_0_1.
+
+        Returns per point the charge maps (bias, y, x).
+    '''
+    def descriptions(bias):
+        return get_potential(V_bias=bias, n_eff=n_eff), get_w_potential()
+
+    parameters = [(t_trappings, t_t1, v)
+                  for t_trappings, t_t1 in points for v in biases]
+    results = analysis.get_charge_3D_batch(
+        GEOM_DESCR, parameters, descriptions, grid_x=5, grid_y=5, n_pairs=10,
+        dt=0.001, n_steps=20000, temperature=TEMP)
 #         objgraph.show_growth()
 
-    return np.array(cc)
+    if cc_0_1 is not None:
+        for v, (edge_x, edge_y, charge) in zip(biases, results):
+            # Plot collected charge map
+            plt.clf()
+            plt.gca().set_aspect('equal')
+            plt.gca().invert_yaxis()
+            cmap = cm.get_cmap('inferno')
+            cmap.set_bad('white')
+
+            cmesh = plt.pcolormesh(edge_x, edge_y, charge / cc_0_1,
+                                   cmap=cmap, vmin=0, vmax=1.05)
+            plt.title('Charge collection, fluence %1.2f neq_cm2' % 0)
+            plt.grid()
+            cax = plt.gcf().add_axes([plt.gca().get_position().xmax, 0.1, 0.05,
+                                      plt.gca().get_position().ymax - plt.gca().get_position().ymin])
+            plt.colorbar(cmesh, cax=cax, orientation='vertical')
+            plt.grid()
+            plt.savefig('CCE_%d_%d_3D.pdf' % (NEFF, v), layout='tight')
+
+    # Split into points
+    charges = iter([charge for _, _, charge in results])
+    return [np.array([next(charges) for _ in biases]) for _ in points]
 
 
 def find_trappig():
     # Calculated unirradiated case
-    _, _, cc_0_1 = charge_collected(t_e_trapping=300000,
-                                    t_h_trapping=300000,
-                                    t_e_t1=0.,
-                                    t_h_t1=0.,
-                                    pot_descr=get_potential(V_bias=-20,
-                                                            n_eff=NEFF0))
+    cc_0_1, = ccs(points=[(300000, 0.)], n_eff=NEFF0, biases=[-20])
+    cc_0_1 = cc_0_1[0]
 
     with open(RESULT, "a+") as myfile:
         myfile.write('Biases 1 %s\n' % str(BIASES))
         myfile.write('Data 1 %s\n' % str(SPLINE_1(np.abs(BIASES))))
         myfile.write('Fluence\tN_eff\tt_e\tt_h\tt1_e\tt1_h\tCCE1\tChi2\n')
 
-    def minimize_me(args):
-        tr = args[0]
-        tr1 = args[1]
-        # Sensor 1 1e15
-        cc_1 = ccs(t_trappings=tr, t_t1=tr1, n_eff=NEFF, biases=BIASES, cc_0_1=cc_0_1)
-
-        cce_1 = cc_1.sum(axis=(1, 2)) / cc_0_1.sum() * 100.
-        chi2 = chi2_to_spline(SPLINE_1, np.abs(BIASES), cce_1)
-        try:
-            with open(RESULT, "a+") as myfile:
-                myfile.write('%d\t%d\t%1.6e\t%1.6e\t%1.6e\t%1.6e\t%s\t%1.3f\n' % (
-                    FLUENCE, NEFF, tr, tr, tr1, tr1, str(cce_1), chi2))
-        except:
-            print 'FAILED WRITING'
-        print 'chi2', chi2
+    bounds = [(2., 6.), (0., 0.5)]
+    eps = 0.01  # Finite difference step
+
+    def chi2s(points):
+        # Chi2 of all trapping time points (tr, tr1), simulated in one batch
+        values = []
+        cc = ccs(points, n_eff=NEFF, biases=BIASES, cc_0_1=cc_0_1)
+        for (tr, tr1), cc_1 in zip(points, cc):
+            # Sensor 1 1e15
+            cce_1 = cc_1.sum(axis=(1, 2)) / cc_0_1.sum() * 100.
+            chi2 = chi2_to_spline(SPLINE_1, np.abs(BIASES), cce_1)
+            try:
+                with open(RESULT, "a+") as myfile:
+                    myfile.write('%d\t%d\t%1.6e\t%1.6e\t%1.6e\t%1.6e\t%s\t%1.3f\n' % (
+                        FLUENCE, NEFF, tr, tr, tr1, tr1, str(cce_1), chi2))
+            except:
+                print 'FAILED WRITING'
+            print 'chi2', chi2
+            values.append(chi2)
 
 #         objgraph.show_most_common_types()
 
-        return chi2
+        return np.array(values)
+
+    def minimize_me(args):
+        # Chi2 and its forward difference gradient, the whole stencil is
+        # simulated in one batch. The steps point into the bounds.
+        args = np.asarray(args, dtype=float)
+        steps = np.array([eps if x + eps <= high else -eps
+                          for x, (_, high) in zip(args, bounds)])
+        points = [args] + [args + step * unit
+                           for step, unit in zip(steps, np.eye(args.shape[0]))]
+        values = chi2s([tuple(point) for point in points])
+        return values[0], (values[1:] - values[0]) / steps
 
     if FIT:
         optimize.minimize(fun=minimize_me,
                           x0=[TR0, TR1],
                           args=(),
                           method='SLSQP',
-                          jac=None,
-                          bounds=[(2., 6.), (0., 0.5)],
+                          jac=True,
+                          bounds=bounds,
                           constraints=(),
                           tol=None,
                           callback=None,
                           options={'disp': False,
                                    'iprint': 1,
-                                   'eps': 0.01,
                                    'maxiter': 5,
                                    'ftol': 1e-04})
     else:
-        minimize_me(args=[TR0, TR1])
+        chi2s([(TR0, TR1)])
 
 #     optimize.basinhopping(func=minimize_me,
 #                           x0=[5., 0.],
@@ -5,8 +5,11 @@ from scipy import integrate
 
 from scarce import solver
 
+# Initial charge of the e-h pairs
+_Q_START = 1.
 
-def get_charge_planar(width, thickness, pot_descr, pot_w_descr, t_e_trapping=0., t_h_trapping=0., t_e_t1=0., t_h_t1=0., t_r=0., grid_x=5, grid_y=5, n_pairs=10, dt=0.001, n_steps=25000, temperature=300, multicore=True):
+
+def get_charge_planar(width, thickness, pot_descr, pot_w_descr, t_e_trapping=0., t_h_trapping=0., t_e_t1=0., t_h_t1=0., t_r=0., grid_x=5, grid_y=5, n_pairs=10, dt=0.001, n_steps=25000, temperature=300, multicore=True, adaptive=False):
     ''' Calculate the collected charge in one planar pixel
 
         Charge is given as a 2d map depending on the start postitions of the e-h pairs.
@@ -27,14 +30,193 @@ def get_charge_planar(width, thickness, pot_descr, pot_w_descr, t_e_trapping=0.,
             Time step in simulation in ns. Should be 1 ps to give reasonable diffusion
         n_steps: int
             Time steps to simulate
+        adaptive: boolean
+            Use adaptive time steps (see solver.DriftDiffusionSolver). Then
+            n_steps * dt is the maximum time to simulate.
+    '''
+
+    range_x, range_y = _planar_ranges(width, thickness)
+    p0, q0 = _start_positions(range_x, range_y, grid_x, grid_y, n_pairs)
+
+    dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                     T=temperature, diffusion=True,
+                                     t_e_trapping=t_e_trapping, t_h_trapping=t_h_trapping,
+                                     t_e_t1=t_e_t1, t_h_t1=t_h_t1, t_r=t_r,
+                                     save_frac=50, adaptive=adaptive,
+                                     outputs=('q_tot', ))
+    # Only the total induced charge is needed, thus no trajectories are stored
+    _, _, _, _, _, _, Q_ind_e_tot, Q_ind_h_tot = dd.solve(p0, q0, dt, n_steps,
+                                                          multicore=multicore)
+
+    # Interpolate data to fixed time points for easier plotting
+#     I_ind_e = tools.time_data_interpolate(T, I_ind_e, t, axis=0, fill_value=0.)
+#     I_ind_h = tools.time_data_interpolate(T, I_ind_h, t, axis=0, fill_value=0.)
+#         I_ind_e[np.isnan(I_ind_e)] = 0.
+#         I_ind_h[np.isnan(I_ind_h)] = 0.
+#         Q_ind_e = integrate.cumtrapz(I_ind_e, T, axis=0, initial=0)
+#         Q_ind_h = integrate.cumtrapz(I_ind_h, T, axis=0, initial=0)
+
+    del dd
+
+    return _charge_map(range_x, range_y, grid_x, grid_y, p0,
+                       Q_ind_e_tot + Q_ind_h_tot)
+
+
+def get_charge_planar_batch(width, parameters, descriptions, t_r=0., grid_x=5, grid_y=5, n_pairs=10, dt=0.001, n_steps=25000, temperature=300, multicore=True, adaptive=False):
+    ''' Calculate the collected charge in one planar pixel for many
+        parameter sets at once.
+
+        Simulations with the same bias and thickness share one solver and
+        thus the drift and weighting fields. All simulations are queued in
+        the worker pool at once, thus all cores are busy until the end.
+
+        Parameters
+        ----------
+        width: number
+            Pixel width in um
+        parameters: iterable
+            (t_trapping, t_t1, bias, thickness) tuples. The trapping times
+            are used for electrons and holes.
+        descriptions: function
+            Returns the drift/weightning potential solution
+            (pot_descr, pot_w_descr) for the arguments bias, thickness.
+            Called once per bias and thickness.
+        multicore: boolean
+            Use the worker pool. Otherwise the simulations run one after
+            another in this process.
+
+        For the other parameters see get_charge_planar().
+
+        Returns
+        -------
+        List with the result of get_charge_planar() (edges_x, edges_y,
+        charge map) for each parameter set. The sum of a charge map is the
+        total collected charge.
     '''
 
+    def create_solver(bias, thickness):
+        pot_descr, pot_w_descr = descriptions(bias, thickness)
+        return solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                           T=temperature, diffusion=True,
+                                           t_r=t_r, save_frac=50,
+                                           adaptive=adaptive,
+                                           outputs=('q_tot', ))
+
+    # The start positions only depend on the thickness
+    settings = [(t_trapping, t_t1, (bias, thickness), thickness)
+                for t_trapping, t_t1, bias, thickness in parameters]
+    return _get_charge_batch(settings, create_solver,
+                             lambda thickness: _planar_ranges(width,
+                                                              thickness),
+                             grid_x, grid_y, n_pairs, dt, n_steps, multicore)
+
+
+def get_charge_3D_batch(geom_descr, parameters, descriptions, t_r=0., grid_x=5, grid_y=5, n_pairs=10, dt=0.001, n_steps=25000, temperature=300, multicore=True, adaptive=False):
+    ''' Calculate the collected charge in one 3D pixel for many parameter
+        sets at once.
+
+        Same as get_charge_planar_batch() for 3D sensors.
+
+        Parameters
+        ----------
+        geom_descr: scarce.geometry.SensorDescription3D
+            Object to describe the 3D pixel geometry
+        parameters: iterable
+            (t_trapping, t_t1, bias) tuples. The trapping times are used for
+            electrons and holes.
+        descriptions: function
+            Returns the drift/weightning potential solution
+            (pot_descr, pot_w_descr) for the argument bias.
+            Called once per bias.
+
+        For the other parameters see get_charge_3D().
+
+        Returns
+        -------
+        List with the result of get_charge_3D() (edges_x, edges_y,
+        charge map) for each parameter set.
+    '''
+
+    def create_solver(bias):
+        pot_descr, pot_w_descr = descriptions(bias)
+        return solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                           geom_descr=geom_descr,
+                                           T=temperature, diffusion=True,
+                                           t_r=t_r, save_frac=50,
+                                           adaptive=adaptive,
+                                           outputs=('q_tot', ))
+
+    settings = [(t_trapping, t_t1, (bias, ), None)
+                for t_trapping, t_t1, bias in parameters]
+    return _get_charge_batch(settings, create_solver,
+                             lambda _: _3D_ranges(geom_descr),
+                             grid_x, grid_y, n_pairs, dt, n_steps, multicore,
+                             geom_descr=geom_descr)
+
+
+def _get_charge_batch(settings, create_solver, get_ranges, grid_x, grid_y, n_pairs, dt, n_steps, multicore, geom_descr=None):
+    ''' Charge maps with edges for (t_trapping, t_t1, solver key, pixel key)
+        settings.
+
+        One solver is created per solver key with create_solver(*key) and
+        used for all its settings. The pixel ranges (range_x, range_y) are
+        given by get_ranges(pixel key).
+    '''
+
+    solvers = {}
+    positions = {}
+    results = []
+    for t_trapping, t_t1, solver_key, pixel_key in settings:
+        if solver_key not in solvers:
+            solvers[solver_key] = create_solver(*solver_key)
+        if pixel_key not in positions:
+            range_x, range_y = get_ranges(pixel_key)
+            positions[pixel_key] = _start_positions(range_x, range_y,
+                                                    grid_x, grid_y, n_pairs)
+        p0, q0 = positions[pixel_key]
+
+        dd = solvers[solver_key]
+        dd.t_e_trapping = dd.t_h_trapping = t_trapping
+        dd.t_e_t1 = dd.t_h_t1 = t_t1
+        if multicore:
+            results.append(dd.solve_async(p0, q0, dt, n_steps))
+        else:
+            results.append(dd.solve(p0, q0, dt, n_steps, multicore=False))
+
+    charges = []
+    for (_, _, _, pixel_key), result in zip(settings, results):
+        if multicore:
+            result = result.get()
+        _, _, _, _, _, _, Q_ind_e_tot, Q_ind_h_tot = result
+        range_x, range_y = get_ranges(pixel_key)
+        charges.append(_charge_map(range_x, range_y, grid_x, grid_y,
+                                   positions[pixel_key][0],
+                                   Q_ind_e_tot + Q_ind_h_tot,
+                                   geom_descr=geom_descr))
+
+    for dd in solvers.values():
+        dd.close()
+
+    return charges
+
+
+def _planar_ranges(width, thickness):
+    ''' x and y range of one planar pixel '''
+    return (-width / 2., width / 2.), (0, thickness)
+
+
+def _3D_ranges(geom_descr):
+    ''' x and y range of one 3D pixel '''
+    return ((-geom_descr.width_x / 2., geom_descr.width_x / 2.),
+            (-geom_descr.width_y / 2., geom_descr.width_y / 2.))
+
+
+def _start_positions(range_x, range_y, grid_x, grid_y, n_pairs):
+    ''' Start positions and charges of the e-h pairs in one pixel '''
+
     # Number of x/y bins
-    x_bins = int(width / grid_x)
-    y_bins = int(thickness / grid_y)
-    # Bin positions
-    range_x = (-width / 2., width / 2.)
-    range_y = (0, thickness)
+    x_bins = int((range_x[1] - range_x[0]) / grid_x)
+    y_bins = int((range_y[1] - range_y[0]) / grid_y)
     # Create e-h pairs in the pixel, avoid charge carriers on boundaries
     # e.g. x = -width / 2 or y = 0
     xx, yy = np.meshgrid(np.linspace(range_x[0] + grid_x / 2.,
@@ -47,33 +229,26 @@ def get_charge_planar(width, thickness, pot_descr, pot_w_descr, t_e_trapping=0.,
     p0 = np.array([xx.ravel(), yy.ravel()])  # Position [um]
 
     # Initial charge set to 1
-    q_start = 1.
-    q0 = np.ones(p0.shape[1]) * q_start
-    # Needed for histograming, numerical accuracy demands > 1
-    q_max = q_start * 1.05
+    q0 = np.ones(p0.shape[1]) * _Q_START
 
-    dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
-                                     T=temperature, diffusion=True,
-                                     t_e_trapping=t_e_trapping, t_h_trapping=t_h_trapping,
-                                     t_e_t1=t_e_t1, t_h_t1=t_h_t1, t_r=t_r,
-                                     save_frac=50)
-    traj_e, traj_h, I_ind_e, I_ind_h, T, _, Q_ind_e_tot, Q_ind_h_tot = dd.solve(p0, q0, dt, n_steps,
-                                                                                multicore=multicore)
+    return p0, q0
 
-    # Trajectory at t=0 is start position
-    pos_0 = traj_e[0]
 
-    # Interpolate data to fixed time points for easier plotting
-#     I_ind_e = tools.time_data_interpolate(T, I_ind_e, t, axis=0, fill_value=0.)
-#     I_ind_h = tools.time_data_interpolate(T, I_ind_h, t, axis=0, fill_value=0.)
-#         I_ind_e[np.isnan(I_ind_e)] = 0.
-#         I_ind_h[np.isnan(I_ind_h)] = 0.
-#         Q_ind_e = integrate.cumtrapz(I_ind_e, T, axis=0, initial=0)
-#         Q_ind_h = integrate.cumtrapz(I_ind_h, T, axis=0, initial=0)
+def _charge_map(range_x, range_y, grid_x, grid_y, pos_0, q_ind, geom_descr=None):
+    ''' Histogram the induced charge per start position '''
 
-    q_ind = Q_ind_e_tot + Q_ind_h_tot
+    # Number of x/y bins
+    x_bins = int((range_x[1] - range_x[0]) / grid_x)
+    y_bins = int((range_y[1] - range_y[0]) / grid_y)
+    # Needed for histograming, numerical accuracy demands > 1
+    q_max = _Q_START * 1.05
+
+    if geom_descr is not None:
+        # E-h pairs created in a column are not propagated
+        pos_0 = pos_0.copy()
+        pos_0[:, geom_descr.position_in_column(pos_0[0], pos_0[1],
+                                               incl_sides=True)] = np.nan
 
-    # Histogram charge per start position
     data = np.vstack((pos_0[0], pos_0[1], q_ind)).T
     n_bins_c = 200  # Number of charge bins
     H, edges = np.histogramdd(sample=data,
@@ -116,12 +291,11 @@ def get_charge_planar(width, thickness, pot_descr, pot_w_descr, t_e_trapping=0.,
 #             plt.legend(loc=2)
 #             plt.show()
 #             break
-    del dd
 
     return edges[0], edges[1], charge_pos.T
 
 
-def get_charge_3D(geom_descr, pot_descr, pot_w_descr, t_e_trapping=0., t_h_trapping=0., t_e_t1=0., t_h_t1=0., t_r=0., grid_x=5, grid_y=5, n_pairs=10, dt=0.001, n_steps=25000, temperature=300, multicore=True):
+def get_charge_3D(geom_descr, pot_descr, pot_w_descr, t_e_trapping=0., t_h_trapping=0., t_e_t1=0., t_h_t1=0., t_r=0., grid_x=5, grid_y=5, n_pairs=10, dt=0.001, n_steps=25000, temperature=300, multicore=True, adaptive=False):
     ''' Calculate the collected charge in one 3D pixel
 
         Charge is given as a 2d map depending on the start postitions of the e-h pairs.
@@ -140,88 +314,26 @@ def get_charge_3D(geom_descr, pot_descr, pot_w_descr, t_e_trapping=0., t_h_trapp
             Time step in simulation in ns. Should be 1 ps to give reasonable diffusion
         n_steps: int
             Time steps to simulate
+        adaptive: boolean
+            Use adaptive time steps (see solver.DriftDiffusionSolver). Then
+            n_steps * dt is the maximum time to simulate.
     '''    
 
-    # Number of x/y bins
-    x_bins = int(geom_descr.width_x / grid_x)
-    y_bins = int(geom_descr.width_y / grid_y)
-    # Bin positions
-    range_x = (-geom_descr.width_x / 2., geom_descr.width_x / 2.)
-    range_y = (-geom_descr.width_y / 2., geom_descr.width_y / 2.)
-    # Create e-h pairs in the pixel, avoid charge carriers on boundaries
-    # e.g. x = -width / 2 or y = 0
-    xx, yy = np.meshgrid(np.linspace(range_x[0] + grid_x / 2.,
-                                     range_x[1] - grid_x / 2., x_bins),
-                         np.repeat(np.linspace(range_y[0] + grid_y / 2.,
-                                               range_y[1] - grid_y / 2., y_bins),
-                                   n_pairs),  # n_pairs e-h per position
-                         sparse=False)  # All combinations of x / y
-    # Start positions
-    p0 = np.array([xx.ravel(), yy.ravel()])  # Position [um]
-
-    # Initial charge set to 1
-    q_start = 1.
-    q0 = np.ones(p0.shape[1]) * q_start
-    # Needed for histograming, numerical accuracy demands > 1
-    q_max = q_start * 1.05
+    range_x, range_y = _3D_ranges(geom_descr)
+    p0, q0 = _start_positions(range_x, range_y, grid_x, grid_y, n_pairs)
 
     dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
                                      geom_descr=geom_descr,
                                      T=temperature, diffusion=True,
                                      t_e_trapping=t_e_trapping, t_h_trapping=t_h_trapping,
                                      t_e_t1=t_e_t1, t_h_t1=t_h_t1, t_r=t_r,
-                                     save_frac=50)
-    traj_e, traj_h, I_ind_e, I_ind_h, T, _, Q_ind_e_tot, Q_ind_h_tot = dd.solve(p0, q0, dt, n_steps,
-                                                                                multicore=multicore)
-
-    # Trajectory at t=0 is start position
-    pos_0 = traj_e[0]
-
-    q_ind = Q_ind_e_tot + Q_ind_h_tot
-
-    # Histogram charge per start position
-    data = np.vstack((pos_0[0], pos_0[1], q_ind)).T
-    n_bins_c = 200  # Number of charge bins
-    H, edges = np.histogramdd(sample=data,
-                              bins=(x_bins, y_bins, n_bins_c),
-                              range=((range_x[0], range_x[1]),
-                                     (range_y[0], range_y[1]),
-                                     (0., q_max)))
-    # Result hist
-    charge_pos = np.zeros(shape=(x_bins, y_bins))
-    sel = (np.sum(H, axis=2) != 0)
-    weights = (edges[2][:-1] + edges[2][1:]) / 2.
-    charge_pos[sel] = np.average(H, axis=2,
-                                 weights=weights)[sel] * weights.sum() / np.sum(H, axis=2)[sel]
-#     edges_x = (edges[0][:-1] + edges[0][1:]) / 2.
-#     edges_y = (edges[1][:-1] + edges[1][1:]) / 2.
+                                     save_frac=50, adaptive=adaptive,
+                                     outputs=('q_tot', ))
+    # Only the total induced charge is needed, thus no trajectories are stored
+    _, _, _, _, _, _, Q_ind_e_tot, Q_ind_h_tot = dd.solve(p0, q0, dt, n_steps,
+                                                          multicore=multicore)
 
-#         for xi, yi in zip(*np.where(np.logical_and(charge_pos > 0.1,
-#                                                    charge_pos < 0.9))
-#                           ):
-#             print edges_x[xi], edges_y[yi], charge_pos[xi, yi]
-#             plt.clf()
-#             plt.bar(weights, H[xi, yi], width=np.diff(weights)[0])
-#             plt.show()
-#             plt.clf()
-#             sel = np.logical_and(pos_0[0] == edges_x[xi],
-#                                  pos_0[1] == edges_y[yi])
-#             plt.plot(T[:, sel], Q_ind_e[:, sel] + Q_ind_h[:, sel])
-#             for c in weights[H[xi, yi].astype(np.bool)]:
-#                 plt.plot(plt.xlim(), [c, c])
-#             plt.show()
-#             plt.clf()
-#             plt.plot(
-#                 T[:, sel], traj_e[:, 0, sel], '-.', linewidth=1, label='e_x')
-#             plt.plot(
-#                 T[:, sel], traj_e[:, 1, sel], '--', linewidth=1, label='e_y')
-#             plt.plot(
-#                 T[:, sel], traj_h[:, 0, sel], '-.', linewidth=1, label='h_x')
-#             plt.plot(
-#                 T[:, sel], traj_h[:, 1, sel], '--', linewidth=1, label='h_y')
-#             plt.legend(loc=2)
-#             plt.show()
-#             break
     del dd
 
-    return edges[0], edges[1], charge_pos.T
+    return _charge_map(range_x, range_y, grid_x, grid_y, p0,
+                       Q_ind_e_tot + Q_ind_h_tot, geom_descr=geom_descr)
@@ -0,0 +1,80 @@
+''' Benchmark of the smoothed potential evaluation of a planar sensor.
+
+    Compares calling get_potential_smooth in a loop with the spline
+    refitted on every call (as done before the fit was cached) and with
+    the cached spline fit of the description.
+'''
+
+import time
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+
+from scarce import sensor
+
+
+def refit_potential_smooth(pot_descr, x, y):
+    ''' Smoothed potential with the spline fitted on every call '''
+    v_min = np.nanmin(pot_descr.potential_grid)
+    v_max = np.nanmax(pot_descr.potential_grid)
+    potential_scaled = (pot_descr.potential_grid - v_min) / (v_max - v_min)
+    func = RectBivariateSpline(pot_descr._x, pot_descr._y,
+                               potential_scaled.T,
+                               s=pot_descr.smoothing, kx=3, ky=3)
+    return func(x, y, grid=False) * (v_max - v_min) + v_min
+
+
+def benchmark_potential_smooth(n_calls=20):
+    # Sensor parameters
+    n_eff = 1.45e12
+    n_pixel = 9
+    width = 50.
+    pitch = 30.
+    thickness = 200.
+    smoothing = 0.05
+    resolution = 251
+    temperature = 300.
+    V_bias = -80.
+    V_readout = 0.
+
+    pot_descr = sensor.planar_sensor(n_eff=n_eff,
+                                     V_bias=V_bias,
+                                     V_readout=V_readout,
+                                     temperature=temperature,
+                                     n_pixel=n_pixel,
+                                     width=width,
+                                     pitch=pitch,
+                                     thickness=thickness,
+                                     selection='drift',
+                                     resolution=resolution,
+                                     smoothing=smoothing)
+
+    # Random positions within the sensor
+    x = np.random.uniform(-width / 2., width / 2., 1000)
+    y = np.random.uniform(0., thickness, 1000)
+
+    start = time.time()
+    for _ in range(n_calls):
+        pot_refit = refit_potential_smooth(pot_descr, x, y)
+    t_refit = time.time() - start
+
+    start = time.time()
+    for _ in range(n_calls):
+        pot_cached = pot_descr.get_potential_smooth(x, y)
+    t_cached = time.time() - start
+
+    print('Grid %d x %d, %d calls' % (pot_descr._x.shape[0],
+                                      pot_descr._y.shape[0], n_calls))
+    print('Refit every call: %1.3f s' % t_refit)
+    print('Cached spline:    %1.3f s (speedup %1.1f)' %
+          (t_cached, t_refit / t_cached))
+    print('Max. difference:  %1.2e V' % np.max(np.abs(pot_refit -
+                                                     pot_cached)))
+
+    return t_refit, t_cached
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    benchmark_potential_smooth()
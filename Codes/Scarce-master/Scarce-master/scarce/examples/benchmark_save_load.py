@@ -0,0 +1,72 @@
+''' Benchmark of saving and loading a planar sensor description.
+
+    Compares the dill format (protocol 0, gzip) with the binary format
+    of tools.save, compressed and uncompressed (memory mapped on load).
+'''
+
+import os
+import time
+import numpy as np
+
+from scarce import sensor, tools
+
+
+def benchmark_save_load(filename='benchmark_descr.sc'):
+    # Sensor parameters
+    n_eff = 1.45e12
+    n_pixel = 9
+    width = 50.
+    pitch = 30.
+    thickness = 200.
+    smoothing = 0.05
+    resolution = 251
+    temperature = 300.
+    V_bias = -80.
+    V_readout = 0.
+
+    pot_descr = sensor.planar_sensor(n_eff=n_eff,
+                                     V_bias=V_bias,
+                                     V_readout=V_readout,
+                                     temperature=temperature,
+                                     n_pixel=n_pixel,
+                                     width=width,
+                                     pitch=pitch,
+                                     thickness=thickness,
+                                     selection='drift',
+                                     resolution=resolution,
+                                     smoothing=smoothing,
+                                     cache=False)
+    # Store the field splines and lookup table too
+    pot_descr.get_field(0., 0.)
+    pot_descr.get_field_fast(0., 0.)
+
+    # Random positions within the sensor
+    x = np.random.uniform(-width / 2., width / 2., 1000)
+    y = np.random.uniform(0., thickness, 1000)
+    field = pot_descr.get_field(x, y)
+
+    settings = [('dill, gzip', {'binary': False}),
+                ('binary, compressed', {}),
+                ('binary', {'compress': False})]
+
+    for name, kwargs in settings:
+        start = time.time()
+        tools.save(pot_descr, filename, **kwargs)
+        t_save = time.time() - start
+        start = time.time()
+        pot_descr_loaded = tools.load(filename)
+        t_load = time.time() - start
+        size = os.path.getsize(filename) / 1e6
+        print('%-20s save %6.3f s, load %6.3f s, %6.1f MB, same field %s' %
+              (name, t_save, t_load, size,
+               np.array_equal(field, pot_descr_loaded.get_field(x, y))))
+        del pot_descr_loaded  # Releases the memory mapped file
+
+    os.remove(filename)
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    benchmark_save_load()
@@ -0,0 +1,76 @@
+''' Benchmark of the drift diffusion solver backends.
+
+    Propagates the e-h pairs of the transient_planar example with the
+    numpy solver (spline and lookup table fields) and the compiled numba
+    solver and compares the run time and the total induced charge.
+'''
+
+import time
+import numpy as np
+
+from scarce import solver, sensor
+
+
+def benchmark_solver_backends():
+    # Sensor parameters as in transient_planar
+    n_eff = 1.45e12
+    n_pixel = 9
+    width = 50.
+    pitch = 30.
+    thickness = 200.
+    smoothing = 0.05
+    resolution = 251
+    temperature = 300.
+    V_bias = -80.
+    V_readout = 0.
+
+    pot_w_descr, pot_descr = sensor.planar_sensor(n_eff=n_eff,
+                                                  V_bias=V_bias,
+                                                  V_readout=V_readout,
+                                                  temperature=temperature,
+                                                  n_pixel=n_pixel,
+                                                  width=width,
+                                                  pitch=pitch,
+                                                  thickness=thickness,
+                                                  resolution=resolution,
+                                                  smoothing=smoothing)
+
+    # 10 e-h pairs along y for 10 positions in x
+    xx, yy = np.meshgrid(np.linspace(0, width, 10),
+                         np.linspace(0., thickness - 10, 10),
+                         sparse=False)
+    p0 = np.array([xx.ravel(), yy.ravel()])
+    q0 = np.ones(p0.shape[1])
+
+    dt = 0.001  # [ns]
+    n_steps = 20000
+
+    settings = [('numpy', {}),
+                ('numpy, fast field', {'fast_field': True})]
+    if solver.numba is not None:
+        settings.append(('numba', {'backend': 'numba'}))
+
+    for name, kwargs in settings:
+        dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                         T=temperature, diffusion=True,
+                                         save_frac=50, **kwargs)
+        if name == 'numba':  # Do not count the compilation time
+            dd.solve(p0[:, :1].copy(), q0[:1], dt, n_steps=10,
+                     multicore=False)
+        start = time.time()
+        results = dd.solve(p0.copy(), q0, dt, n_steps, multicore=False)
+        run_time = time.time() - start
+        Q_ind_tot = results[6] + results[7]
+        print('%-20s %7.2f s, mean total induced charge %1.3f +- %1.3f' %
+              (name, run_time, Q_ind_tot.mean(),
+               Q_ind_tot.std() / np.sqrt(Q_ind_tot.shape[0])))
+
+    if solver.numba is None:
+        print('Install numba to benchmark the numba backend')
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+    benchmark_solver_backends()
@@ -49,8 +49,10 @@ The field is then derived via:
 import fipy
 import numpy as np
 import logging
+import weakref
 
-from scipy.interpolate import interp1d, RectBivariateSpline, griddata, interp2d, SmoothBivariateSpline
+from scipy.interpolate import interp1d, RectBivariateSpline, LinearNDInterpolator, interp2d, SmoothBivariateSpline
+from scipy.spatial import Delaunay
 from scipy import constants
 
 from scarce import silicon
@@ -60,6 +62,130 @@ from scarce import solver
 
 _LOGGER = logging.getLogger(__name__)
 
+# Delaunay triangulations of the mesh face centers, shared by all potentials
+# on the same mesh
+_triangulations = weakref.WeakKeyDictionary()
+
+
+class ScaledSpline(object):
+
+    ''' Spline interpolation of a potential that was scaled to 0 .. 1 before
+        fitting. Evaluation scales the result back. Contrary to a closure
+        this can be pickled, thus the fit is stored with the description.
+    '''
+
+    def __init__(self, spline, scale, offset, key=None):
+        self.spline = spline
+        self.scale = scale
+        self.offset = offset
+        # Parameters the spline was fitted with
+        self.key = key
+
+    def __call__(self, x, y, **kwarg):
+        return self.spline(x, y, **kwarg) * self.scale + self.offset
+
+
+class FieldGrid(object):
+
+    ''' Field lookup table on a regular grid.
+
+        The field components are stored interleaved in one contiguous float32
+        array and evaluated with bilinear interpolation by index arithmetic,
+        which is much faster than evaluating two bicubic splines.
+
+        The interpolation error of a bilinear interpolation is bounded by
+        :math:`\frac{h_x^2}{8} \max|\partial_x^2 E| +
+        \frac{h_y^2}{8} \max|\partial_y^2 E|` with the grid spacings
+        :math:`h_x, h_y`. The maximum deviation from the field it was created
+        from is measured at the cell centres (where the error is largest) and
+        given in max_error.
+    '''
+
+    def __init__(self, x, y, field_x, field_y):
+        '''
+        Parameters
+        ----------
+        x, y : array_like
+            Equidistant grid positions in x, y
+
+        field_x, field_y : array_like, shape = (len(x), len(y))
+            Field components at the grid positions
+        '''
+        self.min_x, self.min_y = float(x[0]), float(y[0])
+        self.nx, self.ny = x.shape[0], y.shape[0]
+        self.dx = (float(x[-1]) - self.min_x) / (self.nx - 1)
+        self.dy = (float(y[-1]) - self.min_y) / (self.ny - 1)
+        self.table = np.ascontiguousarray(
+            np.stack([field_x, field_y], axis=-1).reshape(-1, 2),
+            dtype=np.float32)
+        self.max_error = None
+
+    def __call__(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if x.shape != y.shape:
+            x, y = np.broadcast_arrays(x, y)
+        shape = x.shape
+
+        # Cell index and position within the cell. Positions outside the grid
+        # get the field at the closest boundary
+        f_x = np.minimum(np.maximum((x.ravel() - self.min_x) / self.dx, 0.),
+                         self.nx - 1)
+        f_y = np.minimum(np.maximum((y.ravel() - self.min_y) / self.dy, 0.),
+                         self.ny - 1)
+        # NaN positions give a NaN field, as Description.get_field
+        is_nan = np.isnan(f_x) | np.isnan(f_y)
+        if np.any(is_nan):
+            f_x[is_nan] = 0.
+            f_y[is_nan] = 0.
+        i_x = np.minimum(f_x.astype(np.intp), self.nx - 2)
+        i_y = np.minimum(f_y.astype(np.intp), self.ny - 2)
+        t_x = (f_x - i_x)[:, np.newaxis]
+        t_y = (f_y - i_y)[:, np.newaxis]
+
+        index = i_x * self.ny + i_y
+        f_0 = self.table[index]
+        f_0 += (self.table[index + 1] - f_0) * t_y
+        f_1 = self.table[index + self.ny]
+        f_1 += (self.table[index + self.ny + 1] - f_1) * t_y
+        field = f_0 + (f_1 - f_0) * t_x
+        if np.any(is_nan):
+            field[is_nan] = np.nan
+
+        return field.T.reshape((2, ) + shape)
+
+
+class MeshInterpolation(object):
+
+    ''' Linear interpolation of a potential given at the mesh face centers.
+
+        Same as scipy.interpolate.griddata(method='linear'), but the Delaunay
+        triangulation is created only once per mesh and on first use.
+        Contrary to a closure this can be pickled, the triangulation is
+        created again after loading.
+    '''
+
+    def __init__(self, potential):
+        self.mesh = potential.mesh
+        self.points = np.array(potential.mesh.getFaceCenters()).T
+        self.values = np.array(np.array(potential.arithmeticFaceValue()))
+        self._interpolator = None
+
+    def __call__(self, x, y):
+        if self._interpolator is None:
+            if self.mesh not in _triangulations:
+                _LOGGER.debug('Triangulate mesh')
+                _triangulations[self.mesh] = Delaunay(self.points)
+            self._interpolator = LinearNDInterpolator(
+                _triangulations[self.mesh], self.values, fill_value=np.nan,
+                rescale=False)
+        return self._interpolator(x, y)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_interpolator'] = None
+        return state
+
 
 class Description(object):
 
@@ -96,6 +222,7 @@ class Description(object):
         self.pot_smooth = None
         self.field_x = None
         self.field_y = None
+        self.field_grid = None
 
         # Do not calculate depletion boundaries on init
         # since it is time consuming and maybe not needed
@@ -148,23 +275,15 @@ class Description(object):
 
     def interpolate_potential(self, potential=None):
         ''' Interpolates the potential on a grid.
+
+            The returned MeshInterpolation reuses the triangulation of the
+            mesh for all evaluations.
         '''
         _LOGGER.debug('Interpolate potential')
         if potential is None:
             potential = self.pot_data
 
-        points = np.array(potential.mesh.getFaceCenters()).T
-        values = np.array(np.array(potential.arithmeticFaceValue()))
-
-        def grid_interpolator(grid_x, grid_y):
-            return griddata(points=points,
-                            values=values,
-                            xi=(grid_x, grid_y),
-                            method='linear',
-                            rescale=False,
-                            fill_value=np.nan)  # values.max())
-
-        return grid_interpolator
+        return MeshInterpolation(potential)
 
     def get_potential_minimum(self, axis=None):
         ''' Returns the minimum potential value
@@ -210,7 +329,7 @@ class Description(object):
         return self.potential_grid_inter(x, y)
 
     def get_potential_smooth(self, x, y):
-        if self.pot_smooth is None:
+        if not self._is_smooth_potential_valid():
             self._smooth_potential()
         return self.pot_smooth(x, y, grid=False)
 
@@ -223,11 +342,73 @@ class Description(object):
             Particle x, y positions
         '''
 
-        if self.field_x is None or self.field_y is None:
+        if self.field_x is None or self.field_y is None or \
+                not self._is_smooth_potential_valid():
             self._derive_field()
         return np.array([self.field_x(x, y, grid=False),
                          self.field_y(x, y, grid=False)])
 
+    def get_field_fast(self, x, y):
+        ''' Returns the field in V/um at different positions from the
+            regular grid lookup table (see get_field_grid).
+
+            Much faster than get_field but with a bilinear instead of a
+            bicubic interpolation. The deviation is given in
+            field_grid.max_error.
+
+        Parameters
+        ----------
+        x, y : array_like
+            Particle x, y positions
+        '''
+
+        if self.field_grid is None or \
+                not self._is_smooth_potential_valid():
+            self.get_field_grid()
+        return self.field_grid(x, y)
+
+    def get_field_grid(self, oversampling=4):
+        ''' Creates the regular grid field lookup table used by
+            get_field_fast.
+
+            The field splines are evaluated on a grid with oversampling
+            times the points of the potential grid in x and y. For the
+            default 1 um grid and oversampling = 4 the bilinear
+            interpolation error is below 1 % of the maximum field
+            except for sharp field peaks at electrodes.
+
+        Parameters
+        ----------
+        oversampling : int
+            Grid points per potential grid point in x and y
+        '''
+
+        _LOGGER.debug('Calculate field lookup table')
+
+        if self.field_x is None or self.field_y is None or \
+                not self._is_smooth_potential_valid():
+            self._derive_field()
+
+        x = np.linspace(self.min_x, self.max_x,
+                        (self._x.shape[0] - 1) * oversampling + 1)
+        y = np.linspace(self.min_y, self.max_y,
+                        (self._y.shape[0] - 1) * oversampling + 1)
+        self.field_grid = FieldGrid(x, y,
+                                    self.field_x(x, y, grid=True),
+                                    self.field_y(x, y, grid=True))
+
+        # Measure the interpolation error at the cell centers
+        x_c, y_c = (x[:-1] + x[1:]) / 2., (y[:-1] + y[1:]) / 2.
+        xx_c, yy_c = np.meshgrid(x_c, y_c, sparse=True, indexing='ij')
+        field_c = np.array([self.field_x(x_c, y_c, grid=True),
+                            self.field_y(x_c, y_c, grid=True)])
+        self.field_grid.max_error = float(
+            np.max(np.abs(self.field_grid(xx_c, yy_c) - field_c)))
+        _LOGGER.debug('Field lookup table max. error %1.2e V/um',
+                      self.field_grid.max_error)
+
+        return self.field_grid
+
     def _smooth_potential(self, smoothing=None):
         ''' This function takes the potential grid interpolation
             and smooths the data points.
@@ -248,15 +429,37 @@ class Description(object):
         # Scale potential to be within 0 .. 1
         potential_scaled = (self.potential_grid - v_min) / (v_max - v_min)
 
-        def interpolator(x, y, **kwarg):
-            func = RectBivariateSpline(self._x, self._y, potential_scaled.T,
-                                       s=smoothing, kx=3, ky=3)
-#             func = interp2d(self._x, self._y, potential_scaled, kind='cubic')
-#             return func(x, y) * (v_max - v_min) + v_min
-            return func(x, y, **kwarg) * (v_max - v_min) + v_min
+        # Smooth on the interpolated grid. The spline is fitted only once
+        # here and reused for all evaluations
+        spline = RectBivariateSpline(self._x, self._y, potential_scaled.T,
+                                     s=smoothing, kx=3, ky=3)
+        self.pot_smooth = ScaledSpline(spline, scale=v_max - v_min,
+                                       offset=v_min,
+                                       key=self._smoothing_key(smoothing))
+        # A field derived from a previous smoothing is outdated
+        self.field_x = None
+        self.field_y = None
+        self.field_grid = None
 
-        # Smooth on the interpolated grid
-        self.pot_smooth = interpolator
+    def _smoothing_key(self, smoothing=None):
+        ''' Parameters the smoothed potential depends on. If they change
+            the cached smoothed potential has to be recalculated.
+        '''
+        if not smoothing:
+            smoothing = self.smoothing
+        return (float(smoothing),
+                float(self._x[0]), float(self._x[-1]), self._x.shape[0],
+                float(self._y[0]), float(self._y[-1]), self._y.shape[0])
+
+    def _is_smooth_potential_valid(self):
+        ''' Checks if the cached smoothed potential exists and fits
+            the actual grid and smoothing.
+        '''
+        # Descriptions stored with older versions have no key and
+        # are recalculated
+        return (self.pot_smooth is not None and
+                getattr(self.pot_smooth, 'key', None) ==
+                self._smoothing_key())
 
     def _derive_field(self):
         ''' Takes the potential to calculate the field in x, y
@@ -265,7 +468,7 @@ class Description(object):
         '''
         _LOGGER.debug('Calculate field from potential')
 
-        if not self.pot_smooth:
+        if not self._is_smooth_potential_valid():
             self._smooth_potential()
 
         E_x, E_y = np.gradient(-self.pot_smooth(self._x,
@@ -289,6 +492,132 @@ class Description(object):
         return a
 
 
+class AnalyticDescription(object):
+
+    ''' Potential and field described by analytic functions with the
+        interface of Description.
+
+        No mesh and no numerical solution is needed, the functions are
+        evaluated on demand.
+    '''
+
+    def __init__(self, potential, field, min_x, max_x, min_y, max_y,
+                 nx, ny, depletion=None):
+        '''
+        Parameters
+        ----------
+        potential : function
+            potential(x, y) in V at the positions x, y in um
+        field : function
+            field(x, y) returns the field E_x, E_y in V/um
+        min_x, max_x, min_y, max_y : number
+            Boundaries of the description in um
+        nx, ny : int
+            Grid points in x, y of the field lookup table (get_field_grid)
+        depletion : number
+            Depletion depth in um (planar sensor only)
+        '''
+        self.potential = potential
+        self.field = field
+        self.depletion = depletion
+
+        self.min_x = min_x
+        self.min_y = min_y
+        self.max_x = max_x
+        self.max_y = max_y
+        self._x = np.linspace(self.min_x, self.max_x, nx)
+        self._y = np.linspace(self.min_y, self.max_y, ny)
+
+        # Field components with the call signature of the splines of
+        # Description, used by the drift diffusion solver
+        self.field_x = _AnalyticFieldComponent(field, 0)
+        self.field_y = _AnalyticFieldComponent(field, 1)
+        self.field_grid = None
+
+    def get_potential(self, x, y):
+        return self.potential(x, y)
+
+    def get_potential_smooth(self, x, y):
+        return self.potential(x, y)
+
+    def get_field(self, x, y):
+        ''' Returns the field in V/um at different positions.
+
+        Parameters
+        ----------
+        x, y : array_like
+            Particle x, y positions
+        '''
+        return np.array(self.field(x, y))
+
+    def get_field_fast(self, x, y):
+        ''' Returns the field in V/um at different positions from the
+            regular grid lookup table (see Description.get_field_fast).
+        '''
+        if self.field_grid is None:
+            self.get_field_grid()
+        return self.field_grid(x, y)
+
+    def get_field_grid(self, oversampling=4):
+        ''' Creates the regular grid field lookup table used by
+            get_field_fast, see Description.get_field_grid.
+
+            The field is not defined at the electrode edges, there the
+            table is zero.
+        '''
+
+        _LOGGER.debug('Calculate field lookup table')
+
+        x = np.linspace(self.min_x, self.max_x,
+                        (self._x.shape[0] - 1) * oversampling + 1)
+        y = np.linspace(self.min_y, self.max_y,
+                        (self._y.shape[0] - 1) * oversampling + 1)
+        xx, yy = np.meshgrid(x, y, sparse=True, indexing='ij')
+        field = np.array(self.field(xx, yy))
+        field[~np.isfinite(field)] = 0.
+        self.field_grid = FieldGrid(x, y, field[0], field[1])
+
+        # Measure the interpolation error at the cell centers
+        x_c, y_c = (x[:-1] + x[1:]) / 2., (y[:-1] + y[1:]) / 2.
+        xx_c, yy_c = np.meshgrid(x_c, y_c, sparse=True, indexing='ij')
+        field_c = np.array(self.field(xx_c, yy_c))
+        with np.errstate(invalid='ignore'):
+            self.field_grid.max_error = float(
+                np.nanmax(np.abs(self.field_grid(xx_c, yy_c) - field_c)))
+
+        return self.field_grid
+
+    def get_depletion(self, x):
+        ''' Returns the depletion boundary at x.
+            For planar sensors only!
+        '''
+        if self.depletion is None:
+            raise RuntimeError(
+                'The data does not have depletion information.')
+        return np.full(np.shape(x), float(self.depletion))
+
+    def get_depl_mask(self, x, y):
+        ''' Returns true for all points outside of the depletion zone
+        '''
+        return np.asarray(y) > self.get_depletion(x)
+
+
+class _AnalyticFieldComponent(object):
+
+    ''' One field component of an analytic field with the call signature of
+        a scipy spline.
+    '''
+
+    def __init__(self, field, component):
+        self.field = field
+        self.component = component
+
+    def __call__(self, x, y, grid=False):
+        if grid:
+            x, y = np.meshgrid(x, y, sparse=True, indexing='ij')
+        return np.asarray(self.field(x, y)[self.component])
+
+
 def calculate_planar_sensor_w_potential(mesh, width, pitch,
                                         n_pixel, thickness):
     ''' Calculates the weighting field of a planar sensor.
@@ -332,7 +661,8 @@ def calculate_planar_sensor_w_potential(mesh, width, pitch,
 
 
 def calculate_planar_sensor_potential(mesh, width, pitch, n_pixel, thickness,
-                                      n_eff, V_bias, V_readout, V_bi=0):
+                                      n_eff, V_bias, V_readout, V_bi=0,
+                                      start_potential=None):
     ''' Calculates the potential of a planar sensor.
 
         Parameters
@@ -365,6 +695,10 @@ def calculate_planar_sensor_potential(mesh, width, pitch, n_pixel, thickness,
             Build in voltage. Can be calculated by
             scarce.silicon.get_diffusion_potential(...).
 
+        start_potential : fipy.CellVariable
+            Potential on the same mesh used as start value of the solver,
+            e.g. the potential at a close bias voltage (warm start).
+
         Notes
         -----
         So far the depletion zone in the case of a underdepleted sensor is only
@@ -396,8 +730,9 @@ def calculate_planar_sensor_potential(mesh, width, pitch, n_pixel, thickness,
     # not correct. The analytic formular does it like this.
     V_bias += V_bi
 
-    def calculate_potential(depletion_mask=None, y_dep_new=None):
-        potential = fipy.CellVariable(mesh=mesh, name='potential', value=0.)
+    def calculate_potential(depletion_mask=None, y_dep_new=None, value=0.):
+        potential = fipy.CellVariable(mesh=mesh, name='potential',
+                                      value=value)
         electrons = fipy.CellVariable(mesh=mesh, name='e-')
         electrons.valence = -1
         charge = electrons * electrons.valence
@@ -462,6 +797,11 @@ def calculate_planar_sensor_potential(mesh, width, pitch, n_pixel, thickness,
         y_dep_new = y_dep
 
         description = None
+        # Each solution is the start value for the next iteration
+        if start_potential is None:
+            value = 0.
+        else:
+            value = np.array(start_potential.value)
 
         for i in range(max_iter):
             # First solution with full depletion assumption
@@ -471,8 +811,10 @@ def calculate_planar_sensor_potential(mesh, width, pitch, n_pixel, thickness,
                 depletion_mask = description.get_depl_mask()
 
             potential = calculate_potential(
-                depletion_mask=depletion_mask, y_dep_new=y_dep_new)
+                depletion_mask=depletion_mask, y_dep_new=y_dep_new,
+                value=value)
             potential.depletion = [x_dep, y_dep]
+            value = np.array(potential.value)
 
             description = Description(potential,
                                       min_x=min_x,
@@ -519,7 +861,8 @@ def calculate_planar_sensor_potential(mesh, width, pitch, n_pixel, thickness,
 
 def calculate_3D_sensor_potential(mesh, width_x, width_y, n_pixel_x, n_pixel_y,
                                   radius, nD, n_eff,
-                                  V_bias, V_readout, V_bi=0):
+                                  V_bias, V_readout, V_bi=0,
+                                  start_potential=None):
     ''' Calculates the potential of a planar sensor.
 
         Parameters
@@ -547,6 +890,9 @@ def calculate_3D_sensor_potential(mesh, width_x, width_y, n_pixel_x, n_pixel_y,
         V_bi : number
             Build in voltage. Can be calculated by
             scarce.silicon.get_diffusion_potential()
+        start_potential : fipy.CellVariable
+            Potential on the same mesh used as start value of the solver,
+            e.g. the potential at a close bias voltage (warm start).
 
         Notes
         -----
@@ -587,8 +933,11 @@ def calculate_3D_sensor_potential(mesh, width_x, width_y, n_pixel_x, n_pixel_y,
     epsilon_scaled = 1.
     rho_scale = rho / epsilon
 
-    # Define cell variables
-    potential = fipy.CellVariable(mesh=mesh, name='potential', value=0.)
+    # Define cell variables. The potential keeps the last solution during the
+    # depletion iterations, that is the start value of the next solve
+    potential = fipy.CellVariable(
+        mesh=mesh, name='potential',
+        value=0. if start_potential is None else np.array(start_potential.value))
     electrons = fipy.CellVariable(mesh=mesh, name='e-')
     electrons.valence = -1
     charge = electrons * electrons.valence
@@ -1038,6 +1387,43 @@ def get_potential_planar_analytic_1D(x, V_bias, V_readout, n_eff, D):
     return V
 
 
+def get_potential_planar_analytic(x, y, V_bias, V_readout, n_eff, D):
+    ''' Potential of a planar sensor with 100% fill factor at the
+        positions x, y in um, see get_potential_planar_analytic_1D.
+    '''
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64),
+                               np.asarray(y, dtype=np.float64))
+    return get_potential_planar_analytic_1D(y.ravel(), V_bias=V_bias,
+                                            V_readout=V_readout,
+                                            n_eff=n_eff,
+                                            D=D).reshape(y.shape)
+
+
+def get_field_planar_analytic(x, y, V_bias, V_readout, n_eff, D):
+    ''' Field E_x, E_y of a planar sensor with 100% fill factor at the
+        positions x, y in um, see get_electric_field_analytic.
+    '''
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64),
+                               np.asarray(y, dtype=np.float64))
+    E_x, E_y = get_electric_field_analytic(x.ravel(), y.ravel(),
+                                           V_bias=V_bias, n_eff=n_eff, D=D,
+                                           V_readout=V_readout)
+    return E_x.reshape(y.shape), E_y.reshape(y.shape)
+
+
+def get_depletion_depth_planar_analytic(V_bias, V_readout, n_eff, D):
+    ''' Depletion depth in um of a planar sensor, limited to the
+        thickness D, see get_potential_planar_analytic_1D.
+    '''
+
+    # From n_eff in cm^3 to n_eff in m^3
+    rho = n_eff * constants.elementary_charge * 1e-6
+
+    x_dep = np.sqrt(2. * C.epsilon_s / rho * (V_readout - V_bias))
+
+    return min(x_dep, D)
+
+
 def get_electric_field_analytic(x, y, V_bias, n_eff, D,
                                 V_readout=0,
                                 S=None, is_planar=True):
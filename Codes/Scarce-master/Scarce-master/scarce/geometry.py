@@ -161,6 +161,19 @@ class SensorDescription3D(object):
 
         return zip(offsets_x, offsets_y)
 
+    def get_column_offsets(self, incl_sides=False):
+        ''' Offsets of all columns in x,y as an array with shape (n, 2).
+            Same columns as used in position_in_column.
+        '''
+
+        offsets = list(self.get_ro_col_offsets()) + \
+            list(self.get_center_bias_col_offsets())
+        if incl_sides:
+            offsets += list(self.get_side_bias_col_offsets()) + \
+                list(self.get_edge_bias_col_offsets())
+
+        return np.array(offsets, dtype=np.float64).reshape(-1, 2)
+
     def position_in_center_pixel(self, x, y):
         return -self.width_x / 2. <= x + self.x0 <= self.width_x / 2. \
             and -self.width_y / 2. <= y + self.y0 <= self.width_y / 2.
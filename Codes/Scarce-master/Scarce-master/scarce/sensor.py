@@ -1,8 +1,11 @@
 ''' Functions to create a planar_sensor or 3D sensor. '''
 
 import logging
+import numpy as np
+from functools import partial
+from multiprocessing import cpu_count
 
-from scarce import (silicon, fields, geometry)
+from scarce import (silicon, fields, geometry, solver, tools)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -10,7 +13,7 @@ _LOGGER = logging.getLogger(__name__)
 def planar_sensor(n_eff, V_bias, V_readout=0., temperature=300, n_pixel=9,
                   width=50., pitch=45., thickness=200., selection=None,
                   resolution=300., nx=None, ny=None, smoothing=0.05,
-                  mesh_file='planar_mesh.msh'):
+                  mesh_file='planar_mesh.msh', cache=True, analytic=False):
     ''' Create a planar_sensor sensor pixel array.
 
         Parameters
@@ -49,7 +52,17 @@ def planar_sensor(n_eff, V_bias, V_readout=0., temperature=300, n_pixel=9,
             more smooth looking potential, but be aware too much smoothing
             leads to wrong results!
         mesh_file : str
-            File name of the created mesh file
+            File name of the created mesh file. Not created if the mesh
+            is taken from the cache.
+        cache : boolean
+            Take the mesh and the potential descriptions from the persistent
+            cache (tools.cached) if they were created before with the same
+            parameters. Otherwise they are created and stored in the cache.
+        analytic : boolean
+            Describe the potentials with the analytic solutions
+            (scarce.fields.AnalyticDescription) instead of solving them on a
+            mesh. Needs a 100% fill factor (pitch = width). The weighting
+            potential is the one of an infinite pixel array.
 
         Returns
         -----
@@ -57,74 +70,155 @@ def planar_sensor(n_eff, V_bias, V_readout=0., temperature=300, n_pixel=9,
         potential if no specified selection.
     '''
 
-    # Create mesh of the sensor and stores the result
-    # The created file can be viewed with any mesh viewer (e.g. gmsh)
-    mesh = geometry.mesh_planar_sensor(
-        n_pixel=n_pixel,
-        width=width,
-        thickness=thickness,
-        resolution=resolution,
-        filename=mesh_file)
-
-    min_x = float(mesh.getFaceCenters()[0, :].min())
-    max_x = float(mesh.getFaceCenters()[0, :].max())
-
     # Set um resolution grid
     if not nx:
         nx = width * n_pixel
     if not ny:
         ny = thickness
 
+    if analytic:
+        return _planar_sensor_analytic(n_eff, V_bias, V_readout, temperature,
+                                       n_pixel, width, pitch, thickness,
+                                       selection, nx, ny)
+
+    mesh_parameters = dict(n_pixel=n_pixel, width=width, thickness=thickness,
+                           resolution=resolution)
+    descr_parameters = dict(mesh_parameters, pitch=pitch, nx=nx, ny=ny,
+                            smoothing=smoothing)
+
+    def create_mesh():
+        # Create mesh of the sensor and stores the result
+        # The created file can be viewed with any mesh viewer (e.g. gmsh)
+        return geometry.mesh_planar_sensor(filename=mesh_file,
+                                           **mesh_parameters)
+
+    meshes = []  # The mesh is only needed if a description is not cached
+
+    def get_mesh():
+        if not meshes:
+            meshes.append(_cached(cache, 'planar_mesh', mesh_parameters,
+                                  create_mesh))
+        return meshes[0]
+
+    def create_pot_descr():
+        return _planar_pot_descr(get_mesh(), n_eff=n_eff, V_bias=V_bias,
+                                 V_readout=V_readout, temperature=temperature,
+                                 **descr_parameters)
+
+    def create_pot_w_descr():
+        return _planar_pot_w_descr(get_mesh(), **descr_parameters)
+
     if not selection or 'drift' in selection:
-        V_bi = -silicon.get_diffusion_potential(n_eff, temperature)
-        # Numerically solve the Laplace equation on the mesh
-        potential = fields.calculate_planar_sensor_potential(
-            mesh=mesh,
-            width=width,
-            pitch=pitch,
-            n_pixel=n_pixel,
-            thickness=thickness,
-            n_eff=n_eff,
-            V_bias=V_bias,
-            V_readout=V_readout,
-            V_bi=V_bi)
-        pot_descr = fields.Description(potential,
-                                       min_x=min_x,
-                                       max_x=max_x,
-                                       min_y=0,
-                                       max_y=thickness,
-                                       nx=nx,
-                                       ny=ny,
-                                       smoothing=smoothing)
+        pot_descr = _cached(cache, 'planar_potential',
+                            dict(descr_parameters, n_eff=n_eff,
+                                 V_bias=V_bias, V_readout=V_readout,
+                                 temperature=temperature),
+                            create_pot_descr)
         if selection and 'drift' in selection:
             return pot_descr
 
     if not selection or 'weighting' in selection:
-        # Numerically solve the Poisson equation on the mesh
-        w_potential = fields.calculate_planar_sensor_w_potential(
-            mesh=mesh,
-            width=width,
-            pitch=pitch,
-            n_pixel=n_pixel,
-            thickness=thickness)
-        pot_w_descr = fields.Description(w_potential,
-                                         min_x=min_x,
-                                         max_x=max_x,
-                                         min_y=0,
-                                         max_y=thickness,
-                                         nx=nx,
-                                         ny=ny,
-                                         smoothing=smoothing)
+        pot_w_descr = _cached(cache, 'planar_w_potential', descr_parameters,
+                              create_pot_w_descr)
         if selection and 'weighting' in selection:
             return pot_w_descr
 
     return pot_w_descr, pot_descr
 
 
+def planar_sensor_sweep(n_eff, V_bias, V_readout=0., temperature=300,
+                        n_pixel=9, width=50., pitch=45., thickness=200.,
+                        resolution=300., nx=None, ny=None, smoothing=0.05,
+                        mesh_file='planar_mesh.msh', cache=True,
+                        n_workers=1):
+    ''' Create the planar sensor pixel array for several bias voltages.
+
+        Faster than calling planar_sensor for each bias voltage: the mesh
+        and the bias independent weighting potential are created only once.
+        The potentials are solved with increasing bias voltage, each solution
+        is the start value of the next solve and the LU factorization of the
+        equal matrices is reused (solver.solve).
+
+        Parameters
+        ----------
+        n_eff : number, iterable
+            Effective doping concentration in :math:`\mathrm{\frac{1}{cm^3}}`
+            for all or for each bias voltage
+        V_bias : iterable
+            Bias voltages in Volt
+        n_workers : int
+            Number of processes solving the potentials in parallel, each
+            for a range of bias voltages. If None the number of cores.
+
+        The other parameters are the same as for planar_sensor.
+
+        Returns
+        -----
+        The scarce.fields.Description of the weighting potential and a
+        dictionary with the potential description for each bias voltage.
+    '''
+
+    V_bias = [float(v) for v in np.atleast_1d(V_bias)]
+    n_eff = [float(n) for n in np.broadcast_to(n_eff, (len(V_bias), ))]
+    if len(set(V_bias)) != len(V_bias):
+        raise ValueError('The bias voltages have to be unique')
+
+    # Set um resolution grid
+    if not nx:
+        nx = width * n_pixel
+    if not ny:
+        ny = thickness
+
+    mesh_parameters = dict(n_pixel=n_pixel, width=width, thickness=thickness,
+                           resolution=resolution)
+    descr_parameters = dict(mesh_parameters, pitch=pitch, nx=nx, ny=ny,
+                            smoothing=smoothing)
+
+    def create_mesh():
+        return geometry.mesh_planar_sensor(filename=mesh_file,
+                                           **mesh_parameters)
+
+    meshes = []  # The mesh is only needed if a description is not cached
+
+    def get_mesh():
+        if not meshes:
+            meshes.append(_cached(cache, 'planar_mesh', mesh_parameters,
+                                  create_mesh))
+        return meshes[0]
+
+    pot_w_descr = _cached(cache, 'planar_w_potential', descr_parameters,
+                          lambda: _planar_pot_w_descr(get_mesh(),
+                                                      **descr_parameters))
+
+    # Close bias voltages are solved after each other, they have
+    # similar potentials
+    points = sorted(zip(V_bias, n_eff), key=lambda p: abs(p[0]))
+
+    if n_workers is None:
+        n_workers = cpu_count()
+    n_workers = min(n_workers, len(points))
+
+    if n_workers > 1:
+        mesh = get_mesh()
+        pool = solver.get_pool(n_workers)
+        jobs = [tools.apply_async(pool, _planar_pot_descrs,
+                                  args=(lambda: mesh, list(chunk), cache,
+                                        V_readout, temperature,
+                                        descr_parameters))
+                for chunk in np.array_split(np.array(points), n_workers)]
+        pot_descrs = [descr for job in jobs for descr in job.get()]
+    else:
+        pot_descrs = _planar_pot_descrs(get_mesh, points, cache, V_readout,
+                                        temperature, descr_parameters)
+
+    return pot_w_descr, dict((V, descr) for (V, _), descr
+                             in zip(points, pot_descrs))
+
+
 def sensor_3D(n_eff, V_bias, V_readout=0., temperature=300, n_pixel_x=3,
               n_pixel_y=3, width_x=250., width_y=50., radius=6., nD=2,
               selection=None, resolution=80., nx=None, ny=None,
-              smoothing=0.1, mesh_file='3D_mesh.msh'):
+              smoothing=0.1, mesh_file='3D_mesh.msh', cache=True):
     ''' Create a 3D sensor pixel array.
 
         Parameters
@@ -167,7 +261,12 @@ def sensor_3D(n_eff, V_bias, V_readout=0., temperature=300, n_pixel_x=3,
             more smooth looking potential, but be aware too much smoothing
             leads to wrong results!
         mesh_file : str
-            File name of the created mesh file
+            File name of the created mesh file. Not created if the mesh
+            is taken from the cache.
+        cache : boolean
+            Take the mesh and the potential descriptions from the persistent
+            cache (tools.cached) if they were created before with the same
+            parameters. Otherwise they are created and stored in the cache.
 
         Returns
         -----
@@ -180,14 +279,22 @@ def sensor_3D(n_eff, V_bias, V_readout=0., temperature=300, n_pixel_x=3,
     if not ny:
         ny = width_y * n_pixel_y * 4
 
-    mesh = geometry.mesh_3D_sensor(width_x=width_x,
-                                   width_y=width_y,
-                                   n_pixel_x=n_pixel_x,
-                                   n_pixel_y=n_pixel_y,
-                                   radius=radius,
-                                   nD=nD,
-                                   resolution=resolution,
-                                   filename=mesh_file)
+    mesh_parameters = dict(width_x=width_x, width_y=width_y,
+                           n_pixel_x=n_pixel_x, n_pixel_y=n_pixel_y,
+                           radius=radius, nD=nD, resolution=resolution)
+    descr_parameters = dict(mesh_parameters, nx=nx, ny=ny,
+                            smoothing=smoothing)
+
+    def create_mesh():
+        return geometry.mesh_3D_sensor(filename=mesh_file, **mesh_parameters)
+
+    meshes = []  # The mesh is only needed if a description is not cached
+
+    def get_mesh():
+        if not meshes:
+            meshes.append(_cached(cache, '3D_mesh', mesh_parameters,
+                                  create_mesh))
+        return meshes[0]
 
     # Describe the 3D sensor array
     geom_descr = geometry.SensorDescription3D(width_x, width_y,
@@ -195,9 +302,9 @@ def sensor_3D(n_eff, V_bias, V_readout=0., temperature=300, n_pixel_x=3,
                                               radius, nD)
     min_x, max_x, min_y, max_y = geom_descr.get_array_corners()
 
-    if not selection or 'drift' in selection:
+    def create_pot_descr():
         V_bi = -silicon.get_diffusion_potential(n_eff, temperature)
-        potential = fields.calculate_3D_sensor_potential(mesh,
+        potential = fields.calculate_3D_sensor_potential(get_mesh(),
                                                          width_x,
                                                          width_y,
                                                          n_pixel_x,
@@ -208,35 +315,182 @@ def sensor_3D(n_eff, V_bias, V_readout=0., temperature=300, n_pixel_x=3,
                                                          V_bias,
                                                          V_readout,
                                                          V_bi)
-        pot_descr = fields.Description(potential,
-                                       min_x=min_x,
-                                       max_x=max_x,
-                                       min_y=min_y,
-                                       max_y=max_y,
-                                       nx=nx,  # um res.
-                                       ny=ny,  # um res.
-                                       smoothing=smoothing)
-        if selection and 'drift' in selection:
-            return pot_descr, geom_descr
+        return fields.Description(potential,
+                                  min_x=min_x,
+                                  max_x=max_x,
+                                  min_y=min_y,
+                                  max_y=max_y,
+                                  nx=nx,  # um res.
+                                  ny=ny,  # um res.
+                                  smoothing=smoothing)
 
-    if not selection or 'weighting' in selection:
-        w_potential = fields.calculate_3D_sensor_w_potential(mesh,
+    def create_pot_w_descr():
+        w_potential = fields.calculate_3D_sensor_w_potential(get_mesh(),
                                                              width_x,
                                                              width_y,
                                                              n_pixel_x,
                                                              n_pixel_y,
                                                              radius,
                                                              nD=nD)
-        pot_w_descr = fields.Description(w_potential,
-                                         min_x=min_x,
-                                         max_x=max_x,
-                                         min_y=min_y,
-                                         max_y=max_y,
-                                         nx=nx,
-                                         ny=ny,
-                                         smoothing=smoothing
-                                         )
+        return fields.Description(w_potential,
+                                  min_x=min_x,
+                                  max_x=max_x,
+                                  min_y=min_y,
+                                  max_y=max_y,
+                                  nx=nx,
+                                  ny=ny,
+                                  smoothing=smoothing
+                                  )
+
+    if not selection or 'drift' in selection:
+        pot_descr = _cached(cache, '3D_potential',
+                            dict(descr_parameters, n_eff=n_eff,
+                                 V_bias=V_bias, V_readout=V_readout,
+                                 temperature=temperature),
+                            create_pot_descr)
+        if selection and 'drift' in selection:
+            return pot_descr, geom_descr
+
+    if not selection or 'weighting' in selection:
+        pot_w_descr = _cached(cache, '3D_w_potential', descr_parameters,
+                              create_pot_w_descr)
         if selection and 'weighting' in selection:
             return pot_w_descr, geom_descr
 
     return pot_w_descr, pot_descr, geom_descr
+
+
+def _planar_sensor_analytic(n_eff, V_bias, V_readout, temperature, n_pixel,
+                            width, pitch, thickness, selection, nx, ny):
+    ''' Analytic descriptions of the planar sensor, see planar_sensor.
+    '''
+
+    if pitch != width:
+        raise ValueError('The analytic solution needs a 100% fill factor '
+                         '(pitch = width)')
+
+    # Build in voltage added to bias voltage like the numerical solution
+    V_bias += -silicon.get_diffusion_potential(n_eff, temperature)
+
+    if V_bias >= V_readout:
+        raise ValueError('The analytic solution needs V_bias < V_readout')
+
+    if width * n_pixel < 2. * thickness:
+        _LOGGER.warning('The analytic weighting potential is the one of an '
+                        'infinite pixel array. %d pixels are too few for '
+                        'a %d um thick sensor.', n_pixel, thickness)
+
+    boundaries = dict(min_x=-width * n_pixel / 2., max_x=width * n_pixel / 2.,
+                      min_y=0., max_y=float(thickness), nx=int(nx),
+                      ny=int(ny))
+    parameters = dict(V_bias=V_bias, V_readout=V_readout, n_eff=n_eff,
+                      D=thickness)
+
+    pot_descr = fields.AnalyticDescription(
+        potential=partial(fields.get_potential_planar_analytic,
+                          **parameters),
+        field=partial(fields.get_field_planar_analytic, **parameters),
+        depletion=fields.get_depletion_depth_planar_analytic(**parameters),
+        **boundaries)
+    if selection and 'drift' in selection:
+        return pot_descr
+
+    pot_w_descr = fields.AnalyticDescription(
+        potential=partial(fields.get_weighting_potential_analytic,
+                          D=thickness, S=width, is_planar=True),
+        field=partial(fields.get_weighting_field_analytic,
+                      D=thickness, S=width, is_planar=True),
+        **boundaries)
+    if selection and 'weighting' in selection:
+        return pot_w_descr
+
+    return pot_w_descr, pot_descr
+
+
+def _planar_pot_descrs(get_mesh, points, cache, V_readout, temperature,
+                       descr_parameters):
+    ''' Planar potential descriptions for the (V_bias, n_eff) points.
+
+        The potential of the previous point is the start value of the
+        solver (warm start).
+    '''
+
+    potentials = []
+
+    def create_pot_descr(V_bias, n_eff):
+        start_potential = potentials[-1] if potentials else None
+        return _planar_pot_descr(get_mesh(), n_eff=n_eff, V_bias=V_bias,
+                                 V_readout=V_readout, temperature=temperature,
+                                 start_potential=start_potential,
+                                 **descr_parameters)
+
+    pot_descrs = []
+    for V_bias, n_eff in points:
+        V_bias, n_eff = float(V_bias), float(n_eff)
+        pot_descr = _cached(cache, 'planar_potential',
+                            dict(descr_parameters, n_eff=n_eff,
+                                 V_bias=V_bias, V_readout=V_readout,
+                                 temperature=temperature),
+                            partial(create_pot_descr, V_bias, n_eff))
+        potentials.append(pot_descr.pot_data)
+        pot_descrs.append(pot_descr)
+
+    return pot_descrs
+
+
+def _planar_pot_descr(mesh, n_eff, V_bias, V_readout, temperature, n_pixel,
+                      width, pitch, thickness, resolution, nx, ny, smoothing,
+                      start_potential=None):
+    min_x = float(mesh.getFaceCenters()[0, :].min())
+    max_x = float(mesh.getFaceCenters()[0, :].max())
+    V_bi = -silicon.get_diffusion_potential(n_eff, temperature)
+    # Numerically solve the Laplace equation on the mesh
+    potential = fields.calculate_planar_sensor_potential(
+        mesh=mesh,
+        width=width,
+        pitch=pitch,
+        n_pixel=n_pixel,
+        thickness=thickness,
+        n_eff=n_eff,
+        V_bias=V_bias,
+        V_readout=V_readout,
+        V_bi=V_bi,
+        start_potential=start_potential)
+    return fields.Description(potential,
+                              min_x=min_x,
+                              max_x=max_x,
+                              min_y=0,
+                              max_y=thickness,
+                              nx=nx,
+                              ny=ny,
+                              smoothing=smoothing)
+
+
+def _planar_pot_w_descr(mesh, n_pixel, width, pitch, thickness, resolution,
+                        nx, ny, smoothing):
+    min_x = float(mesh.getFaceCenters()[0, :].min())
+    max_x = float(mesh.getFaceCenters()[0, :].max())
+    # Numerically solve the Poisson equation on the mesh
+    w_potential = fields.calculate_planar_sensor_w_potential(
+        mesh=mesh,
+        width=width,
+        pitch=pitch,
+        n_pixel=n_pixel,
+        thickness=thickness)
+    return fields.Description(w_potential,
+                              min_x=min_x,
+                              max_x=max_x,
+                              min_y=0,
+                              max_y=thickness,
+                              nx=nx,
+                              ny=ny,
+                              smoothing=smoothing)
+
+
+def _cached(cache, name, parameters, create):
+    ''' Object from the persistent cache (tools.cached) if the cache is
+        used, otherwise created with create()
+    '''
+    if cache:
+        return tools.cached(name, parameters, create)
+    return create()
@@ -150,6 +150,19 @@ def get_mobility(e_field, temperature, is_electron):
         The doping concentration is irrelevant for n_eff < 10^16/cm^3
     '''
 
+    v_m, E_c, beta = get_mobility_parameters(temperature, is_electron)
+
+    mu = v_m / E_c / (1. + (np.abs(e_field) / E_c) ** beta) ** (1. / beta)
+
+    return mu
+
+
+def get_mobility_parameters(temperature, is_electron):
+    ''' Parameters of the mobility parametrization used in get_mobility:
+        the saturation velocity v_m [cm/s], the critical field E_c [V/cm]
+        and beta for the temperature (T [K]) and the charge carrier type.
+    '''
+
     if is_electron:
         v_m = 1.53e9 * temperature ** (-0.87)  # [cm/s]
         E_c = 1.01 * temperature ** 1.55  # [V/cm]
@@ -159,9 +172,20 @@ def get_mobility(e_field, temperature, is_electron):
         E_c = 1.24 * temperature ** 1.68  # [V/cm]
         beta = 0.46 * temperature ** 0.17
 
-    mu = v_m / E_c / (1. + (np.abs(e_field) / E_c) ** beta) ** (1. / beta)
+    return v_m, E_c, beta
 
-    return mu
+
+def get_diffusion_constant(e_field, temperature, is_electron):
+    ''' Calculate the diffusion constant [cm^2/s] of charge carriers in
+        silicon from the electrical field (E [V/cm]) the temperature (T [K])
+        and the charge carrier type with the Einstein relation
+        D = mu * k * T / q and the field dependent mobility (get_mobility).
+    '''
+
+    mobility = get_mobility(e_field, temperature, is_electron)
+
+    return mobility * constants.Boltzmann * temperature / \
+        constants.elementary_charge
 
 
 def get_resistivity(n_eff, is_n_type=True, temperature=300, e_field=1e3):
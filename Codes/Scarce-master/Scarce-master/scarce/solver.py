@@ -4,47 +4,199 @@ These functions are either implemented here or provide an interface
 to other solvers.
 """
 
+import atexit
+import copy
+import hashlib
+import os
+import uuid
+import weakref
+import dill
 import fipy
 import numpy as np
+import scipy
 import matplotlib.pyplot as plt
+from collections import OrderedDict
 from multiprocessing import Pool, cpu_count
 from functools import partial
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+from fipy.solvers.scipy.scipySolver import ScipySolver
 import progressbar
 import logging
-from scarce import silicon, tools
+from scarce import silicon
 
+try:  # Shared memory for the worker processes needs Python >= 3.8
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
 
-def solve(var, equation, **kwargs):
+try:  # Algebraic multigrid is optional and only needed for the amg backend
+    import pyamg
+except ImportError:
+    pyamg = None
+
+try:  # Numba is optional and only needed for the compiled solver backend
+    import numba
+except ImportError:
+    numba = None
+
+
+# Linear solver backend of solve(): 'lu', 'cg' or 'amg'
+BACKEND = 'lu'
+
+# Number of LU factorizations that are kept for reuse
+LU_CACHE_SIZE = 2
+
+# Matrix hash -> LU factorization, see _get_factorization
+_factorizations = OrderedDict()
+
+# The relative tolerance of the scipy sparse solvers is called rtol since 1.12
+_cg_rtol = 'rtol' if tuple(int(v) for v in scipy.__version__.split('.')[:2]) >= (1, 12) else 'tol'
+
+
+def solve(var, equation, backend=None, tolerance=None, iterations=None,
+          **kwargs):
     ''' Interface to the fipy solver used for the 2d poisson equation.
 
     Parameters
     ----------
     var : fipy.CellVariable
-          Fipy meshed cell variables to solve the equation for
+          Fipy meshed cell variables to solve the equation for.
+          The current value is the start value of the iterative
+          solvers. Setting it to a close solution (warm start), e.g. of
+          the previous depletion iteration, reduces the iterations.
 
     equation : fipy equation
        e.g. fipy.DiffusionTerm() = 0
 
+    backend : string, fipy solver
+        'lu': LU decomposition. The factorization is reused for an
+        equal matrix, e.g. the weighting potential on the same mesh.
+        'cg': Conjugate gradient solver with Jacobi preconditioner.
+        'amg': Conjugate gradient solver with algebraic multigrid
+        preconditioner, needs pyamg.
+        A fipy solver instance is used as it is.
+        Default is the module setting BACKEND.
+
+    tolerance : number
+        Relative residual tolerance of the iterative solvers,
+        default is 1e-10.
+
+    iterations : int
+        Maximum number of iterations of the iterative solvers.
+
     kwargs : kwargs
         Arguments of fipy equation.solve(kwargs)
 
     Notes
     -----
-    A linear LU solver is forced here, since otherwise pysparse based solver
-    do not converge properly.
+    The solver of the installed fipy solver suite is not used by default,
+    since otherwise pysparse based solver do not converge properly.
+    '''
+
+    if backend is None:
+        backend = BACKEND
+
+    if isinstance(backend, str):
+        backend = _PotentialSolver(method=backend,
+                                   tolerance=tolerance,
+                                   iterations=iterations)
+
+    equation.solve(var=var, solver=backend, **kwargs)
+
+
+class _PotentialSolver(ScipySolver):
+
+    ''' Fipy solver for the symmetric linear systems of the potentials.
+
+        See solve() for the methods.
+    '''
+
+    def __init__(self, method='lu', tolerance=None, iterations=None):
+        if method not in ('lu', 'cg', 'amg'):
+            raise ValueError('Unknown solver backend %s' % method)
+        if method == 'amg' and pyamg is None:
+            raise RuntimeError('The amg solver backend needs pyamg')
+        self.method = method
+        super(_PotentialSolver, self).__init__(
+            tolerance=1e-10 if tolerance is None else tolerance,
+            iterations=10000 if iterations is None else iterations)
+
+    def _solve_(self, L, x, b):
+        L = L.tocsr()
+        b = np.asarray(b, dtype=np.float64)
+
+        if self.method == 'lu':
+            LU = _get_factorization(L)
+            x = LU.solve(b)
+            # Iterative refinement against round off errors
+            for _ in range(3):
+                residual = b - L * x
+                if np.linalg.norm(residual) <= 1e-14 * np.linalg.norm(b):
+                    break
+                x += LU.solve(residual)
+            return x
+
+        x = np.array(x, dtype=np.float64)
+
+        # Cells fixed by the large implicit source terms in not depleted
+        # regions are eliminated, otherwise they dominate the residual
+        diagonal = L.diagonal()
+        off_diagonal = abs(L).sum(axis=1).A1 - np.abs(diagonal)
+        fixed = np.abs(diagonal) > 1e8 * off_diagonal
+        x[fixed] = b[fixed] / diagonal[fixed]
+        free = ~fixed
+        L_free = L[free]
+        b_free = b[free] - L_free[:, fixed] * x[fixed]
+        L_free = L_free[:, free]
+
+        # Symmetric diagonal scaling; the sign makes the matrix positive
+        # definite for CG
+        scale = 1. / np.sqrt(np.abs(diagonal[free]))
+        sign = np.sign(diagonal[free].sum())
+        D = sparse.diags(scale)
+        A = (D * L_free * D).tocsr() * sign
+
+        if self.method == 'amg':
+            M = pyamg.smoothed_aggregation_solver(A).aspreconditioner()
+        else:  # Jacobi preconditioner is the scaling from above
+            M = None
+
+        A_x, info = sparse_linalg.cg(A, b_free * scale * sign,
+                                     x[free] / scale,
+                                     maxiter=self.iterations, M=M,
+                                     **{_cg_rtol: self.tolerance})
+
+        if info != 0:
+            logging.warning('Potential solver %s did not converge (%d)',
+                            self.method, info)
+
+        x[free] = A_x * scale
+        return x
+
+
+def _get_factorization(L):
+    ''' LU factorization of a sparse csr matrix.
+
+        Equal matrices share one factorization.
     '''
 
-    # Force a linear solver
-    # The others do not always converge (?!)
-    solver = fipy.solvers.LinearLUSolver
+    key = hashlib.sha1(np.array(L.shape))
+    for data in (L.indptr, L.indices, L.data):
+        key.update(np.ascontiguousarray(data))
+    key = key.hexdigest()
 
-    # Reasonable and more strict convergence criteria
-    tolerance = 1e-20
-    iterations = 10000
+    try:
+        LU = _factorizations.pop(key)
+    except KeyError:
+        logging.debug('Factorize matrix')
+        LU = sparse_linalg.splu(L.tocsc())
+    _factorizations[key] = LU  # Most recently used last
 
-    equation.solve(var=var,
-                   solver=solver(tolerance=tolerance, iterations=iterations),
-                   **kwargs)
+    while len(_factorizations) > LU_CACHE_SIZE:
+        _factorizations.popitem(last=False)
+
+    return LU
 
 
 class DriftDiffusionSolver(object):
@@ -58,7 +210,9 @@ class DriftDiffusionSolver(object):
                  T=300, geom_descr=None, diffusion=True,
                  t_e_trapping=0., t_h_trapping=0., 
                  t_e_t1=0., t_h_t1=0.,
-                 t_r=0., save_frac=20):
+                 t_r=0., save_frac=20, fast_field=False, backend='numpy',
+                 adaptive=False, max_displacement=0.1, dt_max=0.1,
+                 n_workers=None, chunk_size=500, outputs=None, seed=None):
         '''
         Parameters
         ----------
@@ -98,6 +252,61 @@ class DriftDiffusionSolver(object):
             is interessted in the total current. This value is independent of
             save_frac but not available for each e-h pair.
 
+        fast_field : boolean
+            Use the regular grid field lookup tables of the potential
+            descriptions (fields.Description.get_field_fast) instead of the
+            spline interpolation. Several times faster. The field deviates
+            by less than field_grid.max_error from the spline field (below
+            1 % of the maximum field except close to electrode edges).
+
+        backend : string
+            numpy: Propagate all e-h pairs together with numpy array
+                operations
+            numba: Propagate each e-h pair in a compiled loop (needs numba).
+                Always uses the field lookup tables (see fast_field). Much
+                faster, since there is no Python overhead per time step.
+
+        adaptive : boolean
+            Use an adaptive time step for every e-h pair instead of the fixed
+            time step dt. The time step is a multiple of dt chosen from the
+            drift velocity in the local field, so that a carrier drifts at
+            most max_displacement per step. Each e-h pair is propagated until
+            it is collected and diffusion follows the Einstein relation
+            independent of the time step. Only for the numpy backend.
+
+        max_displacement : number
+            Maximum drift of a carrier in um per adaptive time step
+
+        dt_max : number
+            Maximum adaptive time step in ns
+
+        n_workers : int
+            Number of worker processes for multicore solving. Default is
+            the number of cores.
+
+        chunk_size : int
+            Number of e-h pairs propagated together in one worker task.
+            Many small chunks balance the load of the workers, large chunks
+            have less overhead per time step.
+
+        outputs : iterable of strings
+            Results to return, the others are None:
+                traj: traj_e, traj_h
+                i_ind: I_ind_e, I_ind_h
+                time: T
+                i_tot: I_ind_tot
+                q_tot: Q_ind_tot_e, Q_ind_tot_h
+            Default: all results. Results that are not selected are not
+            stored. Without traj, i_ind and time the memory needed is
+            O(n_pairs) instead of O(n_steps / save_frac * n_pairs).
+
+        seed : int, array_like or numpy.random.SeedSequence
+            Seed of the random numbers for diffusion. Every chunk of
+            chunk_size e-h pairs draws from its own independent stream
+            spawned from the seed. Thus the results for a given seed are
+            identical for single and multicore solving and any number of
+            workers, but depend on chunk_size. Default: random seed.
+
         Notes
         -----
 
@@ -116,6 +325,32 @@ class DriftDiffusionSolver(object):
         self.diffusion = diffusion
 
         self.save_frac = save_frac
+        self.fast_field = fast_field
+
+        if backend not in ('numpy', 'numba'):
+            raise ValueError('Unknown solver backend %s' % backend)
+        if backend == 'numba' and numba is None:
+            raise ImportError('The numba backend needs numba installed')
+        self.backend = backend
+
+        if adaptive and backend != 'numpy':
+            raise ValueError('Adaptive time steps need the numpy backend')
+        self.adaptive = adaptive
+        self.max_displacement = max_displacement
+        self.dt_max = dt_max
+
+        if outputs is not None:
+            outputs = frozenset(outputs)
+            unknown = outputs.difference(_output_indices)
+            if unknown:
+                raise ValueError('Unknown outputs %s' %
+                                 ', '.join(sorted(unknown)))
+        self.outputs = outputs
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.seed = seed
+        # Fields shared with the worker processes
+        self._shared_fields = None
 
     def solve(self, p0, q0, dt, n_steps, multicore=True):
         ''' Solve the drift diffusion equation for quasi partciles and calculates
@@ -132,91 +367,439 @@ class DriftDiffusionSolver(object):
 
             dt : number
                 Time step in ns. Influences presicion. Should be <= 0.001 (ps).
+                For adaptive time steps this is the smallest time step and
+                the time resolution of the results.
 
             n_steps : number
                 Number of steps in time. Has to be large enough that all
-                particles reach the readout electrode.
+                particles reach the readout electrode. For adaptive time
+                steps the simulation ends at the time n_steps * dt at the
+                latest.
+
+            multicore : boolean
+                Propagate chunks of chunk_size e-h pairs in the persistent
+                worker pool (see get_pool)
+
+            Returns
+            -------
+            traj_e, traj_h, I_ind_e, I_ind_h, T, I_ind_tot, Q_ind_tot_e,
+            Q_ind_tot_h. Results not selected with outputs are None.
         '''
 
-        if dt > 0.001:
-            logging.warning('A time step > 1 ps result in wrong diffusion')
-
-        if not multicore:
-            # E-h pairs Start positions
-            p_e_0, p_h_0 = p0.copy(), p0.copy()
-            return _solve_dd(p_e_0,
-                             p_h_0,
-                             q0=q0,
-                             n_steps=n_steps,
-                             dt=dt,
-                             geom_descr=self.geom_descr,
+        solve_dd, kwargs = self._prepare(dt, n_steps)
+
+        # Split data into small chunks, to keep all cores busy until the end.
+        # Every chunk has its own random number stream.
+        starts = range(0, p0.shape[1], self.chunk_size)
+        seeds = np.random.SeedSequence(self.seed).spawn(max(len(starts), 1))
+
+        # A single chunk is solved here to safe the interprocess overhead
+        if not multicore or len(starts) <= 1:
+            if self.seed is None or len(starts) <= 1:
+                # E-h pairs Start positions
+                p_e_0, p_h_0 = p0.copy(), p0.copy()
+                results = solve_dd(p_e_0,
+                                   p_h_0,
+                                   q0=q0,
+                                   pot_w_descr=self.pot_w_descr,
+                                   pot_descr=self.pot_descr,
+                                   rng=_generator(seeds[0]),
+                                   **kwargs)
+                return _select_outputs(results, self.outputs)
+            # Same chunks as on multiple cores for reproducible results
+            results = []
+            for start, seed in zip(starts, seeds):
+                stop = start + self.chunk_size
+                p_e_0, p_h_0 = p0[:, start:stop].copy(), p0[:, start:stop].copy()
+                results.append(_select_outputs(
+                    solve_dd(p_e_0, p_h_0, q0=q0[start:stop],
                              pot_w_descr=self.pot_w_descr,
                              pot_descr=self.pot_descr,
-                             temp=self.T,
-                             diffusion=self.diffusion,
-                             t_e_trapping=self.t_e_trapping,
-                             t_h_trapping=self.t_h_trapping,
-                             t_e_t1=self.t_e_t1,
-                             t_h_t1=self.t_h_t1,
-                             t_r=self.t_r,
-                             save_frac=self.save_frac)
-            
-        n_slices = min(4, cpu_count() - 1)
-        pool = Pool(n_slices)
-
-        # Split data and into cores - 1 slices, max 4
-        slices_p_e_0 = np.array_split(p0, n_slices, axis=1)
-        slices_p_h_0 = np.array_split(p0, n_slices, axis=1)
-        slices_q0 = np.array_split(q0, n_slices, axis=0)
-
-        logging.info('Calculate drift diffusion on %d cores', n_slices)
-
-        jobs = []
-        for index in range(n_slices):
-            job = tools.apply_async(pool=pool,
-                                    fun=_solve_dd,
-                                    p_e_0=slices_p_e_0[index],
-                                    p_h_0=slices_p_h_0[index],
-                                    q0=slices_q0[index],
-                                    n_steps=n_steps,
-                                    dt=dt,
-                                    geom_descr=self.geom_descr,
-                                    pot_w_descr=self.pot_w_descr,
-                                    pot_descr=self.pot_descr,
-                                    temp=self.T,
-                                    diffusion=self.diffusion,
-                                    t_e_trapping=self.t_e_trapping,
-                                    t_h_trapping=self.t_h_trapping,
-                                    t_e_t1=self.t_e_t1,
-                                    t_h_t1=self.t_h_t1,
-                                    t_r=self.t_r,
-                                    save_frac=self.save_frac
-                                    )
-            jobs.append(job)
-
-        # Gather results
-        results = []
-        for job in jobs:
-            results.append(job.get())
-
-        pool.close()
-        pool.join()
-        
-        del pool
-
-        # Merge results
+                             rng=_generator(seed), **kwargs), self.outputs))
+            return _merge_results(results, n_steps)
+
+        return self._submit(solve_dd, kwargs, p0, q0, starts, seeds,
+                            n_steps).get()
+
+    def solve_async(self, p0, q0, dt, n_steps):
+        ''' Same as solve(multicore=True) but returns without waiting for
+            the results.
+
+            The chunks are queued in the persistent worker pool. Thus several
+            solves, e.g. with different trapping times, keep all cores busy
+            until the end. The solver settings can be changed after this
+            call, they do not affect the queued solve.
+
+            Returns
+            -------
+            An object with a get() method that waits for and returns the
+            results of solve().
+        '''
+
+        solve_dd, kwargs = self._prepare(dt, n_steps)
+        starts = range(0, p0.shape[1], self.chunk_size)
+        seeds = np.random.SeedSequence(self.seed).spawn(max(len(starts), 1))
+        return self._submit(solve_dd, kwargs, p0, q0, starts, seeds, n_steps)
+
+    def _prepare(self, dt, n_steps):
+        ''' Returns the drift diffusion function and its arguments for the
+            actual settings.
+        '''
+
+        if dt > 0.001 and not self.adaptive:
+            logging.warning('A time step > 1 ps result in wrong diffusion')
+
+        if self.fast_field or self.backend == 'numba':
+            # Create lookup tables once here and not in every process
+            self.pot_descr.get_field_fast(0., 0.)
+            self.pot_w_descr.get_field_fast(0., 0.)
+
+        if self.adaptive:
+            solve_dd = partial(_solve_dd_adaptive,
+                               max_displacement=self.max_displacement,
+                               dt_max=self.dt_max)
+        elif self.backend == 'numba':
+            solve_dd = _solve_dd_numba
+        else:
+            solve_dd = _solve_dd
+
+        kwargs = dict(n_steps=n_steps,
+                      dt=dt,
+                      geom_descr=self.geom_descr,
+                      temp=self.T,
+                      diffusion=self.diffusion,
+                      t_e_trapping=self.t_e_trapping,
+                      t_h_trapping=self.t_h_trapping,
+                      t_e_t1=self.t_e_t1,
+                      t_h_t1=self.t_h_t1,
+                      t_r=self.t_r,
+                      save_frac=self.save_frac,
+                      fast_field=self.fast_field,
+                      outputs=self.outputs)
+
+        return solve_dd, kwargs
+
+    def _submit(self, solve_dd, kwargs, p0, q0, starts, seeds, n_steps):
+        ''' Queues the chunks in the worker pool '''
+        pool = get_pool(self.n_workers)
+        fields = self._share_fields()
+
+        tasks = []
+        for index, (start, seed) in enumerate(zip(starts, seeds)):
+            stop = start + self.chunk_size
+            tasks.append((index, fields.handle, solve_dd, p0[:, start:stop],
+                          q0[start:stop], seed, kwargs, self.outputs))
+
+        logging.info('Calculate drift diffusion of %d chunks on %d cores',
+                     len(tasks), self.n_workers or cpu_count())
+
+        return _AsyncSolve(pool.map_async(_solve_chunk, tasks, chunksize=1),
+                           n_steps)
+
+    def close(self):
+        ''' Releases the field data shared with the worker processes.
+
+            The persistent worker pool itself is kept for other solvers,
+            see close_pool.
+        '''
+        if self._shared_fields is not None:
+            self._shared_fields.close()
+            self._shared_fields = None
+
+    def _share_fields(self):
+        ''' Returns the field data shared with the worker processes.
+
+            The data is only published again if the fields of the potential
+            descriptions changed (e.g. a new smoothing).
+        '''
+        fast_field = self.fast_field or self.backend == 'numba'
+        if not fast_field:  # Create field splines once here
+            self.pot_descr.get_field(0., 0.)
+            self.pot_w_descr.get_field(0., 0.)
+
+        if self._shared_fields is None or \
+                not self._shared_fields.is_valid(self.pot_descr,
+                                                 self.pot_w_descr,
+                                                 fast_field):
+            self.close()
+            self._shared_fields = _SharedFields(self.pot_descr,
+                                                self.pot_w_descr, fast_field)
+        return self._shared_fields
+
+
+# Multicore helper. A persistent process pool propagates chunks of e-h pairs.
+# The fields are published once in shared memory and kept by the workers.
+_pool = None
+_pool_workers = 0
+
+# Fields attached by this worker process: token -> descriptions, memory
+_worker_fields = OrderedDict()
+_max_worker_fields = 4
+
+# Results of _solve_dd for each output, see DriftDiffusionSolver outputs
+_output_indices = {'traj': (0, 1), 'i_ind': (2, 3), 'time': (4, ),
+                   'i_tot': (5, ), 'q_tot': (6, 7)}
+
+
+def get_pool(n_workers=None):
+    ''' Returns the persistent worker pool of the drift diffusion solver.
+
+        The pool is created on first use and reused by all following
+        multicore solves. A pool with a different number of workers
+        is replaced.
+
+        Parameters
+        ----------
+        n_workers : int
+            Number of worker processes. Default is the number of cores.
+    '''
+    global _pool, _pool_workers
+
+    if n_workers is None:
+        n_workers = cpu_count()
+
+    if _pool is None or _pool_workers != n_workers:
+        close_pool()
+        if shared_memory is not None and os.name == 'posix':
+            # The workers use the resource tracker of this process that
+            # releases the shared fields
+            resource_tracker.ensure_running()
+        _pool, _pool_workers = Pool(n_workers), n_workers
+
+    return _pool
+
+
+def close_pool():
+    ''' Stops the worker processes of the persistent pool '''
+    global _pool
+
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+
+atexit.register(close_pool)
+
+
+class _WorkerDescription(object):
+
+    ''' The parts of a fields.Description needed to propagate charges:
+        the boundaries and the field splines or the field lookup table.
+    '''
+
+    def __init__(self, descr, fast_field):
+        self.min_x, self.max_x = descr.min_x, descr.max_x
+        self.min_y, self.max_y = descr.min_y, descr.max_y
+        if fast_field:
+            self.field_grid = copy.copy(descr.field_grid)
+            self.field_x, self.field_y = None, None
+        else:
+            self.field_grid = None
+            self.field_x, self.field_y = descr.field_x, descr.field_y
+
+    def get_field(self, x, y):
+        return np.array([self.field_x(x, y, grid=False),
+                         self.field_y(x, y, grid=False)])
+
+    def get_field_fast(self, x, y):
+        return self.field_grid(x, y)
+
+
+def _field_sources(descr, fast_field):
+    ''' Field objects of a description that are shared '''
+    if fast_field:
+        return (descr.field_grid, )
+    return (descr.field_x, descr.field_y)
+
+
+class _SharedFields(object):
+
+    ''' Fields of the drift and weighting potential descriptions for the
+        worker processes.
+
+        The field lookup tables are published as arrays in shared memory
+        and the rest as a pickled payload. The workers attach on first use
+        and keep the fields (see _attach_fields), thus the tasks only carry
+        the small handle. Without shared memory (Python < 3.8) the payload
+        with the tables is in the handle and unpickled once per worker.
+    '''
+
+    def __init__(self, pot_descr, pot_w_descr, fast_field):
+        # Keep the shared objects to detect changed fields
+        self.sources = (_field_sources(pot_descr, fast_field) +
+                        _field_sources(pot_w_descr, fast_field))
+        self._memory = []
+        self._finalizer = weakref.finalize(self, _release_memory,
+                                           self._memory)
+
+        descrs = [_WorkerDescription(pot_descr, fast_field),
+                  _WorkerDescription(pot_w_descr, fast_field)]
+        token = uuid.uuid4().hex
+
+        if shared_memory is None:
+            self.handle = (token, dill.dumps(descrs), None)
+            return
+
+        tables = []
+        for descr in descrs:
+            if descr.field_grid is not None:
+                tables.append(self._publish(descr.field_grid.table))
+                descr.field_grid.table = None
+            else:
+                tables.append(None)
+        payload = np.frombuffer(dill.dumps(descrs), dtype=np.uint8)
+        self.handle = (token, self._publish(payload), tables)
+
+    def _publish(self, data):
+        ''' Copies the array into shared memory and returns the handle '''
+        memory = shared_memory.SharedMemory(create=True,
+                                            size=max(data.nbytes, 1))
+        self._memory.append(memory)
+        np.ndarray(data.shape, dtype=data.dtype, buffer=memory.buf)[...] = data
+        return (memory.name, data.shape, data.dtype.str)
+
+    def is_valid(self, pot_descr, pot_w_descr, fast_field):
+        sources = (_field_sources(pot_descr, fast_field) +
+                   _field_sources(pot_w_descr, fast_field))
+        return len(sources) == len(self.sources) and \
+            all(a is b for a, b in zip(sources, self.sources))
+
+    def close(self):
+        self._finalizer()
+
+
+def _release_memory(memory):
+    for shared in memory:
+        shared.close()
+        shared.unlink()
+
+
+def _attach_array(handle):
+    ''' Returns the shared memory and the array of a published array '''
+    name, shape, dtype = handle
+    try:  # Python >= 3.13
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Registered again in the tracker of the publisher
+        memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _attach_fields(handle):
+    ''' Returns the drift and weighting potential description of a
+        handle of _SharedFields. Only the first call per worker process
+        reads the data, later calls use the attached descriptions.
+    '''
+    token, payload, tables = handle
+
+    if token not in _worker_fields:
+        # Forget the fields of old solvers
+        while len(_worker_fields) >= _max_worker_fields:
+            _, (_, _, old_memory) = _worker_fields.popitem(last=False)
+            for shared in old_memory:
+                shared.close()
+
+        memory = []
+        if tables is None:
+            descrs = dill.loads(payload)
+        else:
+            shared, data = _attach_array(payload)
+            descrs = dill.loads(data.tobytes())
+            del data
+            shared.close()
+            for descr, table in zip(descrs, tables):
+                if table is not None:
+                    shared, descr.field_grid.table = _attach_array(table)
+                    memory.append(shared)
+        _worker_fields[token] = (descrs[0], descrs[1], memory)
+
+    return _worker_fields[token][:2]
+
+
+def _solve_chunk(task):
+    ''' Propagates one chunk of e-h pairs in a worker process '''
+    index, fields, solve_dd, p0, q0, seed, kwargs, outputs = task
+    pot_descr, pot_w_descr = _attach_fields(fields)
+    results = solve_dd(p0.copy(), p0.copy(), q0=q0, pot_descr=pot_descr,
+                       pot_w_descr=pot_w_descr, rng=_generator(seed),
+                       **kwargs)
+    return index, _select_outputs(results, outputs)
+
+
+class _AsyncSolve(object):
+
+    ''' Pending solve of the worker pool, see DriftDiffusionSolver.solve_async
+    '''
+
+    def __init__(self, result, n_steps):
+        self._result = result
+        self._n_steps = n_steps
+
+    def get(self):
+        # map_async keeps the order of the chunks
+        results = [result for _, result in self._result.get()]
+        return _merge_results(results, self._n_steps)
+
+
+def _generator(seed):
+    ''' Counter based random number generator for the seed of a chunk '''
+    return np.random.Generator(np.random.Philox(seed))
+
+
+class _RandomStream(object):
+
+    ''' Random numbers of the generator function draw(size). They are drawn
+        in blocks of block_size numbers to reduce the call overhead per
+        time step.
+    '''
+
+    def __init__(self, draw, block_size=2 ** 17):
+        self.draw = draw
+        self.block_size = block_size
+        self._block = np.empty(shape=(0, ))
+        self._index = 0
+
+    def __call__(self, shape):
+        ''' Returns the next random numbers with the given shape '''
+        n = int(np.prod(shape))
+        if self._index + n > self._block.shape[0]:
+            block = self.draw(size=max(n, self.block_size))
+            self._block = np.concatenate((self._block[self._index:], block))
+            self._index = 0
+        numbers = self._block[self._index:self._index + n]
+        self._index += n
+        return numbers.reshape(shape)
+
+
+def _select_outputs(results, outputs):
+    ''' Sets the results not selected in outputs to None '''
+    if outputs is None:
+        return results
+    selected = set()
+    for output in outputs:
+        selected.update(_output_indices[output])
+    return tuple(data if index in selected else None
+                 for index, data in enumerate(results))
+
+
+def _merge_results(results, n_steps):
+    ''' Combines the results of the chunks in chunk order '''
+
+    def concatenate(index, axis):
+        if results[0][index] is None:
+            return None
+        return np.concatenate([result[index] for result in results],
+                              axis=axis)
+
+    I_ind_tot = None
+    if results[0][5] is not None:
         I_ind_tot = np.zeros(shape=(n_steps,))
-        traj_e = np.concatenate([i[0] for i in results], axis=2)
-        traj_h = np.concatenate([i[1] for i in results], axis=2)
-        I_ind_e = np.concatenate([i[2] for i in results], axis=1)
-        I_ind_h = np.concatenate([i[3] for i in results], axis=1)
-        T = np.concatenate([i[4] for i in results], axis=1)
-        for i in results:
-            I_ind_tot += i[5]
-        Q_ind_tot_e = np.concatenate([i[6] for i in results], axis=0)
-        Q_ind_tot_h = np.concatenate([i[7] for i in results], axis=0)
+        for result in results:
+            I_ind_tot += result[5]
 
-        return traj_e, traj_h, I_ind_e, I_ind_h, T, I_ind_tot, Q_ind_tot_e, Q_ind_tot_h
+    return (concatenate(0, axis=2), concatenate(1, axis=2),
+            concatenate(2, axis=1), concatenate(3, axis=1),
+            concatenate(4, axis=1), I_ind_tot,
+            concatenate(6, axis=0), concatenate(7, axis=0))
 
 
 # Drift diffusion iteration loop helper functions
@@ -240,39 +823,117 @@ def _in_boundary(geom_descr, pot_descr, x, y, sel):
     return sel, np.where(old_sel != sel)[0]
 
 
-def _correct_boundary(geom_descr, pot_descr, x, y, sel, is_electron):
-    ''' Checks if the particles are still in the bulk and should be propagated
+def _cal_step_size(t, Q_ind_tot, dt, dydt, q_max, i_step, n_store, n_steps,
+                   max_step_size):
+    ''' Calculates the step size from the actual data
+
+    It is assumed that the actual slope stays constant.
+    The remaining time distance is calculated and the step size is
+    adjusted to fit the remaining steps.
+    The actual time t is the same for all carriers or given per carrier.
     '''
 
-    if not geom_descr:  # planar sensor
-        if is_electron:
-            y[sel][y[sel] > pot_descr.max_y] = pot_descr.max_y
-        else:
-            y[sel][y[sel] < 0.] = 0.
+    t = np.broadcast_to(t, q_max.shape)
+
+    step_size = np.zeros_like(q_max)
+
+    # All steps are used, mark as done
+    sel_done = n_store - i_step - 1 <= 0
+
+    # All storage spaces used up
+    if step_size[~sel_done].size == 0:
+        return step_size.astype(np.int64)
+
+    # Set next step to NaN if storing is done
+    step_size[sel_done] = np.nan
+
+    # Calculate remaining x distance to cover
+    try:
+        # Case: increasing function (assume value = q_max at tmax)
+        t_max_exp = ((q_max - Q_ind_tot) / dydt + t)[~sel_done]
+        # Case: decreasing function (assume value = 0 at tmax)
+        t_max_exp[dydt[~sel_done] < 0] = ((-q_max - Q_ind_tot) /
+                                          dydt + t)[~sel_done][dydt[~sel_done] < 0]
+        # Correct expected time larger than simulation time
+        t_max_exp[t_max_exp > n_steps * dt] = n_steps * dt
+        # Remaining time to cover
+        t_left = t_max_exp - t[~sel_done]
+    except (IndexError, ValueError):
+        logging.error('q_max.shape %s', str(q_max.shape))
+        logging.error('sel_done.shape %s', str(sel_done.shape))
+        logging.error('Q_ind_tot.shape %s', str(Q_ind_tot.shape))
+        logging.error('dydt.shape %s', str(dydt.shape))
+        logging.error('t_max_exp.shape %s', str(t_max_exp.shape))
+        logging.error('dydt[~sel_done].shape %s', str(dydt[~sel_done].shape))
+        logging.error('(dydt[~sel_done] < 0).shape %s', str((dydt[~sel_done] < 0).shape))
+        logging.error('(-q_max - Q_ind_tot) / dydt + t).shape %s', str(((-q_max - Q_ind_tot) / dydt + t).shape))
+        logging.error('(-q_max - Q_ind_tot) / dydt + t)[~sel_done].shape %s', str(((-q_max - Q_ind_tot) / dydt + t)[~sel_done].shape))
+
+        raise
+
+    # Calculate the step size
+    step_size[~sel_done] = t_left / dt / (n_store - i_step[~sel_done] - 1)
+
+    # Limit step size to max_step_size
+    # Needed for slope direction changing functions
+    sel_lim_max = step_size[~sel_done] > max_step_size
+    step_size[~sel_done][sel_lim_max] = max_step_size
+    # Minimum step size = 1
+    step_size[np.logical_and(~sel_done, step_size < 1.)] = 1
+
+    step_size = step_size.astype(np.int64)
+
+    return step_size
+
+
+def _n_store(n_steps, save_frac, outputs):
+    ''' Number of time steps stored per e-h pair and for the trajectories.
+
+        Zero if these results are not selected in outputs. Then the memory
+        needed is O(n_pairs) instead of O(n_store * n_pairs).
+    '''
+    n_store = int(n_steps / save_frac)
+    if outputs is None:
+        return n_store, n_store
+    outputs = frozenset(outputs)
+    if outputs.isdisjoint(('traj', 'i_ind', 'time')):
+        n_store = 0
+    return n_store, n_store if 'traj' in outputs else 0
 
 
 def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
               pot_descr, temp, diffusion, t_e_trapping, t_h_trapping,
-              t_e_t1, t_h_t1, t_r, save_frac):
+              t_e_t1, t_h_t1, t_r, save_frac, fast_field=False, outputs=None,
+              rng=None):
     p_e, p_h = p_e_0, p_h_0
 
+    if rng is None:
+        rng = _generator(None)
+
+    if fast_field:
+        get_field, get_w_field = pot_descr.get_field_fast, \
+            pot_w_descr.get_field_fast
+    else:
+        get_field, get_w_field = pot_descr.get_field, pot_w_descr.get_field
+
     # Result arrays initialized to NaN
-    n_store = int(n_steps / save_frac)  # Steps to store
+    # Steps to store, zero if not needed for the outputs
+    n_store, n_traj = _n_store(n_steps, save_frac, outputs)
 
-    max_step_size = n_steps / n_store * 10
+    max_step_size = n_steps / max(n_store, 1) * 10
     # Different store time step for each e-h pair
     T = np.full(shape=(n_store, p_e.shape[1]),
                 fill_value=np.nan, dtype=np.float32)
     # Stored trajectory for each eh pair
-    traj_e = np.full(shape=(n_store, p_e.shape[0], p_e.shape[1]),
+    traj_e = np.full(shape=(n_traj, p_e.shape[0], p_e.shape[1]),
                      fill_value=np.nan)
-    traj_h = np.full(shape=(n_store, p_h.shape[0], p_h.shape[1]),
+    traj_h = np.full(shape=(n_traj, p_h.shape[0], p_h.shape[1]),
                      fill_value=np.nan)
     # Stored induced charge for each eh pair
     I_ind_e = np.zeros(shape=(n_store, p_e.shape[1]))
     I_ind_h = np.zeros_like(I_ind_e)
     # Helper array(s) of actual step index and next step index
-    i_step = np.zeros(p_e.shape[1], dtype=np.int)  # Result array indeces
+    i_step = np.zeros(p_e.shape[1], dtype=np.int64)  # Result array indeces
     next_step = np.zeros_like(i_step)  # Next time step to store
     # Summed induced charge/current with every time step
     I_ind_tot = np.zeros(shape=(n_steps))
@@ -280,7 +941,10 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
     Q_ind_tot_e = np.zeros(shape=(p_e.shape[1]))
     Q_ind_tot_h = np.zeros(shape=(p_h.shape[1]))
 
-    def add_diffusion(v_e, v_h):
+    # Uniform random numbers for the thermal velocity
+    uniforms = _RandomStream(rng.random)
+
+    def add_diffusion(v_e, v_h, u_e, u_h):
         # Calculate absolute thermal velocity
         v_th_e = silicon.get_thermal_velocity(temperature=temp,
                                               is_electron=True)
@@ -290,15 +954,13 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
         # From: The Atomistic Simulation of Thermal Diffusion
         # and Coulomb Drift in Semiconductor Detectors
         # IEEE VOL. 56, NO. 3, JUNE 2009
-        v_th_e *= np.sqrt(2. / 3. * np.log(np.abs(
-            1. / (1. - np.random.uniform(size=v_e.shape[1])))))
-        v_th_h *= np.sqrt(2. / 3. * np.log(np.abs(
-            1. / (1. - np.random.uniform(size=v_h.shape[1])))))
+        v_th_e *= np.sqrt(2. / 3. * np.log(np.abs(1. / (1. - u_e[0]))))
+        v_th_h *= np.sqrt(2. / 3. * np.log(np.abs(1. / (1. - u_h[0]))))
         # Calculate random direction in x, y
         # Uniform random number 0 .. 2 Pi
-        eta = np.random.uniform(0., 2. * np.pi, size=v_e.shape[1])
+        eta = 2. * np.pi * u_e[1]
         direction_e = np.array([np.cos(eta), np.sin(eta)])
-        eta = np.random.uniform(0., 2. * np.pi, size=v_h.shape[1])
+        eta = 2. * np.pi * u_h[1]
         direction_h = np.array([np.cos(eta), np.sin(eta)])
 
         v_th_e = v_th_e[np.newaxis, :] * direction_e
@@ -309,94 +971,31 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
 
         return v_e, v_h
 
-    def cal_step_size(t, Q_ind_tot, dt, dydt, q_max, i_step, n_store):
-        ''' Calculates the step size from the actual data
-
-        It is assumed that the actual slope stays constant.
-        The remaining time distance is calculated and the step size is
-        adjusted to fit the remaining steps.
-        '''
+    def store_if_needed(step, i_e, i_h, p_e, p_h, Q_e, Q_h, dQ_e_step,
+                        dQ_h_step):
+        ''' Stores the carriers at their storage time step and sets
+            the next storage time step.
 
-        step_size = np.zeros_like(q_max)
-
-        # All steps are used, mark as done
-        sel_done = n_store - i_step - 1 <= 0
-
-        # All storage spaces used up
-        if step_size[~sel_done].size == 0:
-            return step_size.astype(np.int)
-
-        # Set next step to NaN if storing is done
-        step_size[sel_done] = np.NaN
-
-        # Calculate remaining x distance to cover
-        try:
-            # Case: increasing function (assume value = q_max at tmax)
-            t_max_exp = ((q_max - Q_ind_tot) / dydt + t)[~sel_done]
-            # Case: decreasing function (assume value = 0 at tmax)
-            t_max_exp[dydt[~sel_done] < 0] = ((-q_max - Q_ind_tot) /
-                                              dydt + t)[~sel_done][dydt[~sel_done] < 0]
-            # Correct expected time larger than simulation time
-            t_max_exp[t_max_exp > n_steps * dt] = n_steps * dt
-            # Remaining time to cover
-            t_left = t_max_exp - t
-        except (IndexError, ValueError):
-            logging.error('q_max.shape %s', str(q_max.shape))
-            logging.error('sel_done.shape %s', str(sel_done.shape))
-            logging.error('Q_ind_tot.shape %s', str(Q_ind_tot.shape))
-            logging.error('dydt.shape %s', str(dydt.shape))
-            logging.error('t_max_exp.shape %s', str(t_max_exp.shape))
-            logging.error('dydt[~sel_done].shape %s', str(dydt[~sel_done].shape))
-            logging.error('(dydt[~sel_done] < 0).shape %s', str((dydt[~sel_done] < 0).shape))
-            logging.error('(-q_max - Q_ind_tot) / dydt + t).shape %s', str(((-q_max - Q_ind_tot) / dydt + t).shape))
-            logging.error('(-q_max - Q_ind_tot) / dydt + t)[~sel_done].shape %s', str(((-q_max - Q_ind_tot) / dydt + t)[~sel_done].shape))
-
-            raise
-
-        # Calculate the step size
-        step_size[~sel_done] = t_left / dt / (n_store - i_step[~sel_done] - 1)
-
-        # Limit step size to max_step_size
-        # Needed for slope direction changing functions
-        sel_lim_max = step_size[~sel_done] > max_step_size
-        step_size[~sel_done][sel_lim_max] = max_step_size
-        # Minimum step size = 1
-        step_size[np.logical_and(~sel_done, step_size < 1.)] = 1
-
-        step_size = step_size.astype(np.int)
-
-        return step_size
-
-    def store_if_needed(step, next_step, Q_ind_tot_e, Q_ind_tot_h, dt, dQ_e,
-                        dQ_h, T, I_ind_e, I_ind_h, p_e, p_h, q_max,
-                        i_step, n_store, sel_e, sel_h):
-        ''' Checks if charge carriers value needs to be stored and returns
-                next storage time step
+            The carrier data is given for the drifting carriers only with
+            their e-h pair indices i_e, i_h and is written to the
+            result arrays of these e-h pairs.
         '''
 
         t = dt * step  # Actual time step
 
-        # Select charges that need storing for full array (1 entry per e-h)
-        store = step == next_step
-
-        # Select charges that need storing and are not fully propagated yet
-        # for full array (1 entry per e-h)
-        store_e = np.logical_and(store, sel_e)
-        store_h = np.logical_and(store, sel_h)
+        # Select drifting charges that need storing
+        s_e = next_step[i_e] == step
+        s_h = next_step[i_h] == step
 
-        # Select charges that need storing for reduced array (e-h that need
-        # propagating
-        s_e = store_e[sel_e]
-        s_h = store_h[sel_h]
-
-        # All carrier stored
-        if not np.any(store):
-            return
-
-        # All carriers needing storing are fully drifted
+        # No drifting carrier needs storing
         if not np.any(s_e) and not np.any(s_h):
             return
 
+        # E-h pair indices of the charges to store
+        store_e = i_e[s_e]
+        store_h = i_h[s_h]
+        store = np.union1d(store_e, store_h)
+
         # Set data of actual time step
         T[i_step[store], store] = t
 
@@ -405,59 +1004,57 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
         DT_h = T[i_step[store_h], store_h] - T[i_step[store_h] - 1, store_h]
         DT_e[np.isnan(DT_e)] = dt  # First storing
         DT_h[np.isnan(DT_h)] = dt  # First storing
-        I_ind_e[i_step[store_e], store_e] = dQ_e_step[store_e] / DT_e
-        I_ind_h[i_step[store_h], store_h] = dQ_h_step[store_h] / DT_h
+        I_ind_e[i_step[store_e], store_e] = dQ_e_step[s_e] / DT_e
+        I_ind_h[i_step[store_h], store_h] = dQ_h_step[s_h] / DT_h
 
         # Store data
-#         I_ind_e[i_step[store_e], store_e] = dQ_e[s_e] / dt
-#         I_ind_h[i_step[store_h], store_h] = dQ_h[s_h] / dt
-
-        traj_e[i_step[store_e], :, store_e] = p_e[:, store_e].T
-        traj_h[i_step[store_h], :, store_h] = p_h[:, store_h].T
-
-#         if np.max(i_step) == 145:
-#             plt.plot(T[:, 0], I_ind_e[:, 0], '.')
-#             plt.plot(T[:, 0], I_ind_h[:, 0], '.')
-#             plt.show()
+        if n_traj:
+            traj_e[i_step[store_e], :, store_e] = p_e[:, s_e].T
+            traj_h[i_step[store_h], :, store_h] = p_h[:, s_h].T
+        Q_ind_tot_e[store_e] = Q_e[s_e]
+        Q_ind_tot_h[store_h] = Q_h[s_h]
 
         # Calculate step size as the minimum of the e and h step size
-        d_step = np.zeros_like(next_step)
-        d_step_e = np.zeros_like(d_step)
-        d_step_h = np.zeros_like(d_step)
-        if np.any(store_e):
-            d_step_e[store_e] = cal_step_size(t, Q_ind_tot=Q_ind_tot_e[store_e], dt=dt,
-                                              dydt=I_ind_e[i_step[store_e], store_e],
-                                              q_max=q_max[store_e],
-                                              i_step=i_step[store_e],
-                                              n_store=n_store)
-            d_step[store_e] = d_step_e[store_e]
-
-        if np.any(store_h):
-            d_step_h[store_h] = cal_step_size(t, Q_ind_tot=Q_ind_tot_h[store_h], dt=dt,
-                                              dydt=I_ind_h[i_step[store_h], store_h],
-                                              q_max=q_max[store_h],
-                                              i_step=i_step[store_h],
-                                              n_store=n_store)
-            d_step[store_h] = d_step_h[store_h]
-        sel = np.logical_and(store_e, store_h)
-        d_step[sel] = np.minimum(d_step_e[sel], d_step_h[sel])
-
-        next_step += d_step
+        d_step_e = _cal_step_size(t, Q_ind_tot=Q_e[s_e], dt=dt,
+                                  dydt=I_ind_e[i_step[store_e], store_e],
+                                  q_max=q0[store_e],
+                                  i_step=i_step[store_e],
+                                  n_store=n_store, n_steps=n_steps,
+                                  max_step_size=max_step_size)
+        d_step_h = _cal_step_size(t, Q_ind_tot=Q_h[s_h], dt=dt,
+                                  dydt=I_ind_h[i_step[store_h], store_h],
+                                  q_max=q0[store_h],
+                                  i_step=i_step[store_h],
+                                  n_store=n_store, n_steps=n_steps,
+                                  max_step_size=max_step_size)
+        _, both_e, both_h = np.intersect1d(store_e, store_h,
+                                           assume_unique=True,
+                                           return_indices=True)
+        d_step_e[both_e] = np.minimum(d_step_e[both_e], d_step_h[both_h])
+        d_step_h[both_h] = d_step_e[both_e]
+
+        next_step[store_e] = step + d_step_e
+        next_step[store_h] = step + d_step_h
 
         # Increase storage hists indeces
-        i_step[store] += 1
-
-        i_step[i_step >= T.shape[0]] = T.shape[0] - 1
+        i_step[store] = np.minimum(i_step[store] + 1, n_store - 1)
 
         # Reset tmp. variable
-        dQ_e_step[store_e] = 0.
-        dQ_h_step[store_h] = 0.
+        dQ_e_step[s_e] = 0.
+        dQ_h_step[s_h] = 0.
 
-    # Tmp. variables to store the total induced charge per save step
-    # Otherwise the resolution of induced current calculation
-    # is reduced
-    dQ_e_step = np.zeros(shape=p_e.shape[1])
-    dQ_h_step = np.zeros(shape=p_h.shape[1])
+    def remove_finished(step, sel, i, p, Q, dQ_step, q, p_full, Q_ind_tot):
+        ''' Writes the results of finished carriers to their e-h pair
+            and removes them from the drifting carrier arrays.
+        '''
+        finished = i[~sel]
+        Q_ind_tot[finished] = Q[~sel]
+        p_full[:, finished] = np.nan
+
+        # Force a storing step at for e-h pairs where one is finished
+        next_step[finished] = step + 1
+
+        return i[sel], p[:, sel], Q[sel], dQ_step[sel], q[sel]
 
     progress_bar = progressbar.ProgressBar(
         widgets=['', progressbar.Percentage(), ' ',
@@ -467,23 +1064,35 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
 
     progress_bar.start()
 
+    # Only the drifting carriers are propagated. Their data is kept in
+    # compact arrays together with their e-h pair index i_e, i_h. Finished
+    # carriers are removed from these arrays.
     sel_e, _ = _in_boundary(geom_descr, pot_descr=pot_descr,
                             x=p_e[0, :], y=p_e[1, :],
-                            sel=np.ones(p_e.shape[1], dtype=np.bool))
+                            sel=np.ones(p_e.shape[1], dtype=bool))
     sel_h, _ = _in_boundary(geom_descr, pot_descr=pot_descr,
                             x=p_h[0, :], y=p_h[1, :],
-                            sel=np.ones(p_h.shape[1], dtype=np.bool))
+                            sel=np.ones(p_h.shape[1], dtype=bool))
+    i_e, i_h = np.where(sel_e)[0], np.where(sel_h)[0]
+    # Positions
+    pos_e, pos_h = p_e[:, i_e], p_h[:, i_h]
+    # Total induced charge
+    Q_e, Q_h = np.zeros(shape=i_e.shape[0]), np.zeros(shape=i_h.shape[0])
+    # Tmp. variables to store the total induced charge per save step
+    # Otherwise the resolution of induced current calculation
+    # is reduced
+    dQ_e_step, dQ_h_step = np.zeros_like(Q_e), np.zeros_like(Q_h)
+    # Charge
+    q_e, q_h = q0[i_e], q0[i_h]
 
     for step in range(n_steps):
         # Check if all particles out of boundary
-        if not np.any(sel_h) and not np.any(sel_e):
+        if i_e.shape[0] == 0 and i_h.shape[0] == 0:
             break  # Stop loop to safe time
 
         # Electric field in V/cm
-        E_e = pot_descr.get_field(
-            p_e[0, sel_e], p_e[1, sel_e]) * 1e4
-        E_h = pot_descr.get_field(
-            p_h[0, sel_h], p_h[1, sel_h]) * 1e4
+        E_e = get_field(pos_e[0], pos_e[1]) * 1e4
+        E_h = get_field(pos_h[0], pos_h[1]) * 1e4
 
         # Mobility in cm2 / Vs
         mu_e = silicon.get_mobility(np.sqrt(E_e[0] ** 2 + E_e[1] ** 2),
@@ -495,17 +1104,19 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
         v_e, v_h = - E_e * mu_e, E_h * mu_h
 
         if diffusion:
-            v_e, v_h = add_diffusion(v_e, v_h)
+            v_e, v_h = add_diffusion(v_e, v_h,
+                                     u_e=uniforms((2, i_e.shape[0])),
+                                     u_h=uniforms((2, i_h.shape[0])))
 
         # Calculate induced current
         # Only if electrons are still drifting
-        if np.any(sel_e):
+        if i_e.shape[0]:
             # Weighting field in V/um
-            W_e = pot_w_descr.get_field(p_e[0, sel_e], p_e[1, sel_e])
+            W_e = get_w_field(pos_e[0], pos_e[1])
 
             # Induced charge in C/s, Q = E_w * v * q * dt
             dQ_e = (W_e[0] * v_e[0] + W_e[1] * v_e[1]) * \
-                - q0[sel_e] * dt * 1e-5
+                - q_e * dt * 1e-5
 
             # Reduce induced charge due to trapping
             if t_e_trapping:
@@ -515,19 +1126,19 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
             if t_r:
                 dQ_e *= np.exp(-dt * step / (t_r / 2.2))
 
-            dQ_e_step[sel_e] += dQ_e
+            dQ_e_step += dQ_e
 
-            Q_ind_tot_e[sel_e] += dQ_e
+            Q_e += dQ_e
 
             I_ind_tot[step] += dQ_e.sum() / dt
 
-        if np.any(sel_h):  # Only if holes are still drifting
+        if i_h.shape[0]:  # Only if holes are still drifting
             # Weighting field in V/um
-            W_h = pot_w_descr.get_field(p_h[0, sel_h], p_h[1, sel_h])
+            W_h = get_w_field(pos_h[0], pos_h[1])
 
             # Induced charge in C/s, Q = E_w * v * q * dt
             dQ_h = (W_h[0] * v_h[0] + W_h[1] * v_h[1]) * \
-                q0[sel_h] * dt * 1e-5
+                q_h * dt * 1e-5
 
             # Reduce induced charge due to trapping
             if t_h_trapping:
@@ -537,51 +1148,565 @@ def _solve_dd(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
             if t_r:
                 dQ_h *= np.exp(-dt * step / (t_r / 2.2))
 
-            dQ_h_step[sel_h] += dQ_h
+            dQ_h_step += dQ_h
 
-            Q_ind_tot_h[sel_h] += dQ_h
+            Q_h += dQ_h
 
             I_ind_tot[step] += dQ_h.sum() / dt
 
         # Store
-        store_if_needed(step, next_step, Q_ind_tot_e=Q_ind_tot_e,
-                        Q_ind_tot_h=Q_ind_tot_h, dt=dt,
-                        dQ_e=dQ_e, dQ_h=dQ_h, T=T, I_ind_e=I_ind_e,
-                        I_ind_h=I_ind_h, p_e=p_e, p_h=p_h, q_max=q0,
-                        i_step=i_step, n_store=n_store,
-                        sel_e=sel_e, sel_h=sel_h)
-
-        # Position change in um
-        d_p_e, d_p_h = v_e * dt * 1e-5, v_h * dt * 1e-5
-
-        # Update position
-        p_e[:, sel_e] = p_e[:, sel_e] + d_p_e
-        p_h[:, sel_h] = p_h[:, sel_h] + d_p_h
-
-        # Correct boundaries (e.g. leaving sensor due to diffusion)
-        _correct_boundary(geom_descr, pot_descr,
-                          x=p_e[0, :], y=p_e[1, :],
-                          sel=sel_e, is_electron=True)
-        _correct_boundary(geom_descr, pot_descr,
-                          x=p_h[0, :], y=p_h[1, :],
-                          sel=sel_h, is_electron=False)
-
-        # Check boundaries and update selection
+        if n_store:
+            store_if_needed(step, i_e=i_e, i_h=i_h, p_e=pos_e, p_h=pos_h,
+                            Q_e=Q_e, Q_h=Q_h, dQ_e_step=dQ_e_step,
+                            dQ_h_step=dQ_h_step)
+
+        # Update position, position change in um
+        pos_e = pos_e + v_e * dt * 1e-5
+        pos_h = pos_h + v_h * dt * 1e-5
+
+        # Check boundaries and remove finished carriers
         sel_e, new_e = _in_boundary(geom_descr, pot_descr=pot_descr,
-                                    x=p_e[0, :], y=p_e[1, :],
-                                    sel=sel_e)
+                                    x=pos_e[0], y=pos_e[1],
+                                    sel=np.ones(i_e.shape[0], dtype=bool))
         sel_h, new_h = _in_boundary(geom_descr, pot_descr=pot_descr,
-                                    x=p_h[0, :], y=p_h[1, :],
-                                    sel=sel_h)
+                                    x=pos_h[0], y=pos_h[1],
+                                    sel=np.ones(i_h.shape[0], dtype=bool))
+        if new_e.shape[0]:
+            i_e, pos_e, Q_e, dQ_e_step, q_e = remove_finished(
+                step, sel_e, i_e, pos_e, Q_e, dQ_e_step, q_e, p_e,
+                Q_ind_tot_e)
+        if new_h.shape[0]:
+            i_h, pos_h, Q_h, dQ_h_step, q_h = remove_finished(
+                step, sel_h, i_h, pos_h, Q_h, dQ_h_step, q_h, p_h,
+                Q_ind_tot_h)
 
-        # Force a storing step at for e-h pairs where one is finished
-        next_step[new_e] = step + 1
-        next_step[new_h] = step + 1
+        progress_bar.update(step)
+    progress_bar.finish()
 
-        p_e[:, ~sel_e] = np.nan
-        p_h[:, ~sel_h] = np.nan
+    # Results of carriers still drifting
+    Q_ind_tot_e[i_e], Q_ind_tot_h[i_h] = Q_e, Q_h
+    p_e[:, i_e], p_h[:, i_h] = pos_e, pos_h
 
-        progress_bar.update(step)
+    return traj_e, traj_h, I_ind_e, I_ind_h, T, I_ind_tot, Q_ind_tot_e, Q_ind_tot_h
+
+
+def _solve_dd_adaptive(p_e_0, p_h_0, q0, n_steps, dt, geom_descr,
+                       pot_w_descr, pot_descr, temp, diffusion, t_e_trapping,
+                       t_h_trapping, t_e_t1, t_h_t1, t_r, save_frac,
+                       fast_field=False, outputs=None, rng=None,
+                       max_displacement=0.1, dt_max=0.1):
+    ''' Same as _solve_dd but with an adaptive time step for every e-h pair.
+
+        The time step of an e-h pair is chosen so that its faster carrier
+        drifts at most max_displacement [um]. It is a multiple of dt and
+        limited to dt_max [ns]. Every e-h pair has its own time and is
+        propagated until both carriers are collected or the time
+        n_steps * dt is reached. The results have the same format as
+        the results of _solve_dd, with times on the dt grid.
+
+        Diffusion is a gaussian random walk with the diffusion constant of
+        the Einstein relation (silicon.get_diffusion_constant) and thus
+        independent of the time step.
+    '''
+    p_e, p_h = p_e_0, p_h_0
+
+    if rng is None:
+        rng = _generator(None)
+
+    if fast_field:
+        get_field, get_w_field = pot_descr.get_field_fast, \
+            pot_w_descr.get_field_fast
+    else:
+        get_field, get_w_field = pot_descr.get_field, pot_w_descr.get_field
+
+    # Result arrays as in _solve_dd
+    n_store, n_traj = _n_store(n_steps, save_frac, outputs)
+    max_step_size = n_steps / max(n_store, 1) * 10
+    T = np.full(shape=(n_store, p_e.shape[1]),
+                fill_value=np.nan, dtype=np.float32)
+    traj_e = np.full(shape=(n_traj, p_e.shape[0], p_e.shape[1]),
+                     fill_value=np.nan)
+    traj_h = np.full(shape=(n_traj, p_h.shape[0], p_h.shape[1]),
+                     fill_value=np.nan)
+    I_ind_e = np.zeros(shape=(n_store, p_e.shape[1]))
+    I_ind_h = np.zeros_like(I_ind_e)
+    i_step = np.zeros(p_e.shape[1], dtype=np.int64)  # Result array indeces
+    next_step = np.zeros_like(i_step)  # Next time step to store
+    Q_ind_tot_e = np.zeros(shape=(p_e.shape[1]))
+    Q_ind_tot_h = np.zeros(shape=(p_h.shape[1]))
+    # Changes of the summed induced current at every time step. A time step
+    # of k * dt adds its current to k entries of I_ind_tot.
+    dI_ind_tot = np.zeros(shape=(n_steps + 1))
+
+    max_steps = max(int(round(dt_max / dt)), 1)  # Max. time step in dt
+
+    # Gaussian random numbers for diffusion
+    normals = _RandomStream(rng.standard_normal)
+
+    # Decay rate of the induced charge in 1 / ns due to the CSA
+    rate_r = 2.2 / t_r if t_r else 0.
+
+    def time_step(v):
+        ''' Time step in units of dt for a max_displacement at the
+            velocity v in cm / s
+        '''
+        with np.errstate(divide='ignore'):
+            k = max_displacement / (np.sqrt(v[0] ** 2 + v[1] ** 2) *
+                                    dt * 1e-5)
+        return np.clip(k, 1, max_steps).astype(np.int64)
+
+    def displacement(v, E, h, is_electron):
+        ''' Position change in um within the time step h in ns '''
+        d = v * h * 1e-5
+        if diffusion:
+            # Standard deviation of the gaussian random walk in x, y
+            D = silicon.get_diffusion_constant(E, temperature=temp,
+                                               is_electron=is_electron)
+            d += np.sqrt(2. * D * h * 1e-9) * 1e4 * normals(d.shape)
+        return d
+
+    def reduction(t, h, E, t_trapping, t_t1):
+        ''' Mean reduction of the induced charge due to trapping and the
+            CSA within the time step [t, t + h]
+        '''
+        rate = rate_r
+        if t_trapping:
+            rate = rate + 1. / (t_trapping + t_t1 * E * 1e-4)
+        if not np.any(rate):
+            return 1.
+        return np.exp(-rate * t) * -np.expm1(-rate * h) / (rate * h)
+
+    def store(step, i_p, sel, drift_e, drift_h, pos_e, pos_h, Q_e, Q_h,
+              dQ_e_step, dQ_h_step):
+        ''' Stores the selected e-h pairs and sets their next storage
+            time step.
+        '''
+        pairs = i_p[sel]
+        T[i_step[pairs], pairs] = dt * step[sel]
+        # Integrated time since the last storing
+        DT = T[i_step[pairs], pairs] - T[i_step[pairs] - 1, pairs]
+        DT[np.isnan(DT)] = dt  # First storing
+
+        d_step = np.full(pairs.shape[0], n_steps, dtype=np.int64)
+        for drift, pos, Q, dQ_step, traj, I_ind, Q_ind_tot in (
+                (drift_e, pos_e, Q_e, dQ_e_step, traj_e, I_ind_e,
+                 Q_ind_tot_e),
+                (drift_h, pos_h, Q_h, dQ_h_step, traj_h, I_ind_h,
+                 Q_ind_tot_h)):
+            s = drift[sel]  # Drifting carriers of the stored pairs
+            store_c = pairs[s]
+            I_ind[i_step[store_c], store_c] = dQ_step[sel][s] / DT[s]
+            if n_traj:
+                traj[i_step[store_c], :, store_c] = pos[:, sel][:, s].T
+            Q_ind_tot[store_c] = Q[sel][s]
+            d_step_c = _cal_step_size(dt * step[sel][s], Q_ind_tot=Q[sel][s],
+                                      dt=dt,
+                                      dydt=I_ind[i_step[store_c], store_c],
+                                      q_max=q0[store_c],
+                                      i_step=i_step[store_c],
+                                      n_store=n_store, n_steps=n_steps,
+                                      max_step_size=max_step_size)
+            # Step sizes < 1: no storing needed anymore
+            d_step_c[d_step_c < 1] = n_steps
+            d_step[s] = np.minimum(d_step[s], d_step_c)
+            dQ_step[sel & drift] = 0.
+
+        next_step[pairs] = step[sel] + d_step
+        i_step[pairs] = np.minimum(i_step[pairs] + 1, n_store - 1)
+
+    progress_bar = progressbar.ProgressBar(
+        widgets=['', progressbar.Percentage(), ' ',
+                 progressbar.Bar(marker='*', left='|', right='|'), ' ',
+                 progressbar.AdaptiveETA()],
+        maxval=n_steps, term_width=80)
+
+    progress_bar.start()
+
+    # Only the e-h pairs with drifting carriers are propagated. Their data
+    # is kept in compact arrays together with their e-h pair index i_p.
+    sel_e, _ = _in_boundary(geom_descr, pot_descr=pot_descr,
+                            x=p_e[0, :], y=p_e[1, :],
+                            sel=np.ones(p_e.shape[1], dtype=bool))
+    sel_h, _ = _in_boundary(geom_descr, pot_descr=pot_descr,
+                            x=p_h[0, :], y=p_h[1, :],
+                            sel=np.ones(p_h.shape[1], dtype=bool))
+    i_p = np.where(np.logical_or(sel_e, sel_h))[0]
+    drift_e, drift_h = sel_e[i_p], sel_h[i_p]
+    pos_e, pos_h = p_e[:, i_p], p_h[:, i_p]
+    Q_e, Q_h = np.zeros(shape=i_p.shape[0]), np.zeros(shape=i_p.shape[0])
+    dQ_e_step, dQ_h_step = np.zeros_like(Q_e), np.zeros_like(Q_h)
+    q = q0[i_p]
+    step = np.zeros(i_p.shape[0], dtype=np.int64)  # Time step of each pair
+
+    while i_p.shape[0]:
+        t = dt * step
+        idx_e, idx_h = np.where(drift_e)[0], np.where(drift_h)[0]
+
+        # Electric field in V/cm
+        E_e = get_field(pos_e[0, idx_e], pos_e[1, idx_e]) * 1e4
+        E_h = get_field(pos_h[0, idx_h], pos_h[1, idx_h]) * 1e4
+        E_e_abs = np.sqrt(E_e[0] ** 2 + E_e[1] ** 2)
+        E_h_abs = np.sqrt(E_h[0] ** 2 + E_h[1] ** 2)
+
+        # Drift velocity in cm / s
+        v_e = - E_e * silicon.get_mobility(E_e_abs, temperature=temp,
+                                           is_electron=True)
+        v_h = E_h * silicon.get_mobility(E_h_abs, temperature=temp,
+                                         is_electron=False)
+
+        # Time step in units of dt, the same for electron and hole and
+        # limited by the end of the simulation
+        k = np.full(i_p.shape[0], max_steps, dtype=np.int64)
+        k[idx_e] = np.minimum(k[idx_e], time_step(v_e))
+        k[idx_h] = np.minimum(k[idx_h], time_step(v_h))
+        k = np.minimum(k, n_steps - step)
+        h = k * dt
+
+        d_e = displacement(v_e, E_e_abs, h[idx_e], is_electron=True)
+        d_h = displacement(v_h, E_h_abs, h[idx_h], is_electron=False)
+
+        # Induced charge, Q = E_w * dx * q
+        W_e = get_w_field(pos_e[0, idx_e], pos_e[1, idx_e])
+        W_h = get_w_field(pos_h[0, idx_h], pos_h[1, idx_h])
+        dQ_e = (W_e[0] * d_e[0] + W_e[1] * d_e[1]) * - q[idx_e] * \
+            reduction(t[idx_e], h[idx_e], E_e_abs, t_e_trapping, t_e_t1)
+        dQ_h = (W_h[0] * d_h[0] + W_h[1] * d_h[1]) * q[idx_h] * \
+            reduction(t[idx_h], h[idx_h], E_h_abs, t_h_trapping, t_h_t1)
+        Q_e[idx_e] += dQ_e
+        Q_h[idx_h] += dQ_h
+        dQ_e_step[idx_e] += dQ_e
+        dQ_h_step[idx_h] += dQ_h
+
+        # Induced current of the pair during its time step
+        I = np.zeros(i_p.shape[0])
+        I[idx_e] += dQ_e
+        I[idx_h] += dQ_h
+        I /= h
+        np.add.at(dI_ind_tot, step, I)
+        np.add.at(dI_ind_tot, step + k, -I)
+
+        # Store
+        sel = step >= next_step[i_p]
+        if n_store and np.any(sel):
+            store(step, i_p, sel, drift_e, drift_h, pos_e, pos_h, Q_e, Q_h,
+                  dQ_e_step, dQ_h_step)
+
+        # Update position and time
+        pos_e[:, idx_e] += d_e
+        pos_h[:, idx_h] += d_h
+        step += k
+
+        # Check boundaries
+        sel_e, new_e = _in_boundary(geom_descr, pot_descr=pot_descr,
+                                    x=pos_e[0, idx_e], y=pos_e[1, idx_e],
+                                    sel=np.ones(idx_e.shape[0], dtype=bool))
+        sel_h, new_h = _in_boundary(geom_descr, pot_descr=pot_descr,
+                                    x=pos_h[0, idx_h], y=pos_h[1, idx_h],
+                                    sel=np.ones(idx_h.shape[0], dtype=bool))
+        drift_e[idx_e[new_e]] = False
+        drift_h[idx_h[new_h]] = False
+        # Force a storing step for e-h pairs where one is finished
+        next_step[i_p[idx_e[new_e]]] = step[idx_e[new_e]]
+        next_step[i_p[idx_h[new_h]]] = step[idx_h[new_h]]
+
+        # Write results of finished e-h pairs and remove them
+        done = np.logical_or(np.logical_and(~drift_e, ~drift_h),
+                             step >= n_steps)
+        if np.any(done):
+            finished = i_p[done]
+            Q_ind_tot_e[finished], Q_ind_tot_h[finished] = Q_e[done], Q_h[done]
+            p_e[:, finished] = np.where(drift_e[done], pos_e[:, done], np.nan)
+            p_h[:, finished] = np.where(drift_h[done], pos_h[:, done], np.nan)
+            keep = ~done
+            i_p, drift_e, drift_h = i_p[keep], drift_e[keep], drift_h[keep]
+            pos_e, pos_h = pos_e[:, keep], pos_h[:, keep]
+            Q_e, Q_h, q = Q_e[keep], Q_h[keep], q[keep]
+            dQ_e_step, dQ_h_step = dQ_e_step[keep], dQ_h_step[keep]
+            step = step[keep]
+
+        if step.shape[0]:
+            progress_bar.update(step.min())
     progress_bar.finish()
 
+    I_ind_tot = np.cumsum(dI_ind_tot)[:n_steps]
+
+    return traj_e, traj_h, I_ind_e, I_ind_h, T, I_ind_tot, Q_ind_tot_e, Q_ind_tot_h
+
+
+# Compiled drift diffusion solver. Every e-h pair is propagated on its own in
+# a loop, with the same physics and storing scheme as _solve_dd.
+def _jit(function):
+    ''' Compiles the function with numba if available '''
+    if numba is None:
+        return function
+    # Division by zero has to give inf / nan as in numpy
+    return numba.njit(cache=True, error_model='numpy')(function)
+
+
+@_jit
+def _grid_field(table, grid, x, y):
+    ''' Bilinear interpolation of a fields.FieldGrid table.
+        grid = min_x, min_y, dx, dy, nx, ny
+    '''
+    nx, ny = int(grid[4]), int(grid[5])
+    f_x = min(max((x - grid[0]) / grid[2], 0.), nx - 1.)
+    f_y = min(max((y - grid[1]) / grid[3], 0.), ny - 1.)
+    i_x = min(int(f_x), nx - 2)
+    i_y = min(int(f_y), ny - 2)
+    t_x = f_x - i_x
+    t_y = f_y - i_y
+    # Weights of the 4 surrounding grid points
+    w_00, w_01 = (1. - t_x) * (1. - t_y), (1. - t_x) * t_y
+    w_10, w_11 = t_x * (1. - t_y), t_x * t_y
+    i_00 = i_x * ny + i_y
+    i_10 = i_00 + ny
+    f_x = (table[i_00, 0] * w_00 + table[i_00 + 1, 0] * w_01 +
+           table[i_10, 0] * w_10 + table[i_10 + 1, 0] * w_11)
+    f_y = (table[i_00, 1] * w_00 + table[i_00 + 1, 1] * w_01 +
+           table[i_10, 1] * w_10 + table[i_10 + 1, 1] * w_11)
+    return f_x, f_y
+
+
+@_jit
+def _in_bulk(x, y, bounds, columns, radius):
+    ''' True if the position is within the sensor and not in a column '''
+    if not (bounds[0] <= x <= bounds[1] and bounds[2] <= y <= bounds[3]):
+        return False
+    for i in range(columns.shape[0]):
+        if np.sqrt((x - columns[i, 0]) ** 2 +
+                   (y - columns[i, 1]) ** 2) < radius:
+            return False
+    return True
+
+
+@_jit
+def _store_step_size(t, Q_ind_tot, dydt, q_max, i_step, n_store, dt,
+                     n_steps):
+    ''' Steps to the next storing, see cal_step_size in _solve_dd.
+        Returns -1 if this carrier does not need storing anymore.
+    '''
+    if n_store - i_step - 1 <= 0:  # All storage spaces used up
+        return -1
+    if dydt < 0:  # Decreasing function (assume value = 0 at tmax)
+        t_max_exp = (-q_max - Q_ind_tot) / dydt + t
+    else:  # Increasing function (assume value = q_max at tmax)
+        t_max_exp = (q_max - Q_ind_tot) / dydt + t
+    if t_max_exp > n_steps * dt:
+        t_max_exp = n_steps * dt
+    step_size = (t_max_exp - t) / dt / (n_store - i_step - 1)
+    if np.isnan(step_size):
+        return -1
+    if step_size < 1.:
+        return 1
+    return int(min(step_size, n_steps))
+
+
+@_jit
+def _carrier_step(x, y, is_electron, q, step, dt, e_table, e_grid,
+                  w_table, w_grid, mobility, v_th, diffusion, t_trapping,
+                  t_t1, t_r, rng):
+    ''' Velocity [cm/s] and induced charge of one carrier for one time step.
+        The random numbers for diffusion are drawn from the generator rng.
+    '''
+    # Electric field in V/cm
+    E_x, E_y = _grid_field(e_table, e_grid, x, y)
+    E_x *= 1e4
+    E_y *= 1e4
+    E = np.sqrt(E_x ** 2 + E_y ** 2)
+
+    # Mobility in cm2 / Vs (silicon.get_mobility)
+    v_m, E_c, beta = mobility[0], mobility[1], mobility[2]
+    mu = v_m / E_c / (1. + (E / E_c) ** beta) ** (1. / beta)
+
+    # Drift velocity in cm / s
+    if is_electron:
+        v_x, v_y = -E_x * mu, -E_y * mu
+    else:
+        v_x, v_y = E_x * mu, E_y * mu
+
+    if diffusion:  # Thermal velocity with random direction
+        v = v_th * np.sqrt(2. / 3. * np.log(np.abs(
+            1. / (1. - rng.random()))))
+        eta = rng.random() * 2. * np.pi
+        v_x += v * np.cos(eta)
+        v_y += v * np.sin(eta)
+
+    # Weighting field in V/um
+    W_x, W_y = _grid_field(w_table, w_grid, x, y)
+
+    # Induced charge, Q = E_w * v * q * dt
+    dQ = (W_x * v_x + W_y * v_y) * q * dt * 1e-5
+    if is_electron:
+        dQ = -dQ
+
+    # Reduce induced charge due to trapping
+    if t_trapping:
+        dQ *= np.exp(-dt * step / (t_trapping + t_t1 * E * 1e-4))
+
+    if t_r:
+        dQ *= np.exp(-dt * step / (t_r / 2.2))
+
+    return v_x, v_y, dQ
+
+
+@_jit
+def _dd_kernel(p_e, p_h, q0, n_steps, dt, bounds, columns, radius,
+               e_table, e_grid, w_table, w_grid, mobility_e, mobility_h,
+               v_th_e, v_th_h, diffusion, t_e_trapping, t_h_trapping,
+               t_e_t1, t_h_t1, t_r, traj_e, traj_h, I_ind_e, I_ind_h, T,
+               I_ind_tot, Q_ind_tot_e, Q_ind_tot_h, rng):
+    ''' Propagates all e-h pairs and fills the result arrays. Nothing is
+        stored per time step if T has no rows and no trajectories if
+        traj_e, traj_h have no rows.
+    '''
+    n_store = T.shape[0]
+    store_traj = traj_e.shape[0] > 0
+
+    for i in range(p_e.shape[1]):
+        x_e, y_e = p_e[0, i], p_e[1, i]
+        x_h, y_h = p_h[0, i], p_h[1, i]
+        sel_e = _in_bulk(x_e, y_e, bounds, columns, radius)
+        sel_h = _in_bulk(x_h, y_h, bounds, columns, radius)
+
+        i_step = 0  # Result array index
+        next_step = 0  # Next time step to store
+        # Induced charge since the last storing
+        dQ_e_step, dQ_h_step = 0., 0.
+        v_e_x, v_e_y, v_h_x, v_h_y = 0., 0., 0., 0.
+
+        for step in range(n_steps):
+            if not sel_e and not sel_h:
+                break
+
+            if sel_e:
+                v_e_x, v_e_y, dQ_e = _carrier_step(
+                    x_e, y_e, True, q0[i], step, dt, e_table, e_grid,
+                    w_table, w_grid, mobility_e, v_th_e, diffusion,
+                    t_e_trapping, t_e_t1, t_r, rng)
+                dQ_e_step += dQ_e
+                Q_ind_tot_e[i] += dQ_e
+                I_ind_tot[step] += dQ_e / dt
+
+            if sel_h:
+                v_h_x, v_h_y, dQ_h = _carrier_step(
+                    x_h, y_h, False, q0[i], step, dt, e_table, e_grid,
+                    w_table, w_grid, mobility_h, v_th_h, diffusion,
+                    t_h_trapping, t_h_t1, t_r, rng)
+                dQ_h_step += dQ_h
+                Q_ind_tot_h[i] += dQ_h
+                I_ind_tot[step] += dQ_h / dt
+
+            # Store
+            if n_store and step == next_step:
+                T[i_step, i] = dt * step
+                # Integrated time since the last storing
+                DT = T[i_step, i] - T[i_step - 1, i] if i_step > 0 else dt
+                if np.isnan(DT):
+                    DT = dt
+                d_step_e, d_step_h = 0, 0
+                if sel_e:
+                    I_ind_e[i_step, i] = dQ_e_step / DT
+                    if store_traj:
+                        traj_e[i_step, 0, i] = x_e
+                        traj_e[i_step, 1, i] = y_e
+                    d_step_e = _store_step_size(dt * step, Q_ind_tot_e[i],
+                                                I_ind_e[i_step, i], q0[i],
+                                                i_step, n_store, dt, n_steps)
+                    dQ_e_step = 0.
+                if sel_h:
+                    I_ind_h[i_step, i] = dQ_h_step / DT
+                    if store_traj:
+                        traj_h[i_step, 0, i] = x_h
+                        traj_h[i_step, 1, i] = y_h
+                    d_step_h = _store_step_size(dt * step, Q_ind_tot_h[i],
+                                                I_ind_h[i_step, i], q0[i],
+                                                i_step, n_store, dt, n_steps)
+                    dQ_h_step = 0.
+                if sel_e and sel_h:
+                    d_step = min(d_step_e, d_step_h)
+                else:
+                    d_step = d_step_e if sel_e else d_step_h
+                next_step = next_step + d_step if d_step >= 0 else -1
+                i_step = min(i_step + 1, n_store - 1)
+
+            # Update position, position change in um
+            finished = False
+            if sel_e:
+                x_e += v_e_x * dt * 1e-5
+                y_e += v_e_y * dt * 1e-5
+                if not _in_bulk(x_e, y_e, bounds, columns, radius):
+                    sel_e, finished = False, True
+            if sel_h:
+                x_h += v_h_x * dt * 1e-5
+                y_h += v_h_y * dt * 1e-5
+                if not _in_bulk(x_h, y_h, bounds, columns, radius):
+                    sel_h, finished = False, True
+
+            # Force a storing step for e-h pairs where one is finished
+            if finished:
+                next_step = step + 1
+
+        p_e[0, i], p_e[1, i] = (x_e, y_e) if sel_e else (np.nan, np.nan)
+        p_h[0, i], p_h[1, i] = (x_h, y_h) if sel_h else (np.nan, np.nan)
+
+
+def _solve_dd_numba(p_e_0, p_h_0, q0, n_steps, dt, geom_descr, pot_w_descr,
+                    pot_descr, temp, diffusion, t_e_trapping, t_h_trapping,
+                    t_e_t1, t_h_t1, t_r, save_frac, fast_field=True,
+                    outputs=None, rng=None):
+    ''' Same as _solve_dd but with the compiled kernel. The fields are
+        always taken from the lookup tables (fields.FieldGrid).
+    '''
+    p_e, p_h = p_e_0, p_h_0
+
+    if rng is None:
+        rng = _generator(None)
+
+    n_store, n_traj = _n_store(n_steps, save_frac, outputs)
+
+    # Result arrays as in _solve_dd
+    T = np.full(shape=(n_store, p_e.shape[1]),
+                fill_value=np.nan, dtype=np.float32)
+    traj_e = np.full(shape=(n_traj, p_e.shape[0], p_e.shape[1]),
+                     fill_value=np.nan)
+    traj_h = np.full(shape=(n_traj, p_h.shape[0], p_h.shape[1]),
+                     fill_value=np.nan)
+    I_ind_e = np.zeros(shape=(n_store, p_e.shape[1]))
+    I_ind_h = np.zeros_like(I_ind_e)
+    I_ind_tot = np.zeros(shape=(n_steps))
+    Q_ind_tot_e = np.zeros(shape=(p_e.shape[1]))
+    Q_ind_tot_h = np.zeros(shape=(p_h.shape[1]))
+
+    def grid_description(descr):
+        if getattr(descr, 'field_grid', None) is None:
+            descr.get_field_fast(0., 0.)
+        grid = descr.field_grid
+        return grid.table, np.array([grid.min_x, grid.min_y, grid.dx,
+                                     grid.dy, grid.nx, grid.ny],
+                                    dtype=np.float64)
+
+    e_table, e_grid = grid_description(pot_descr)
+    w_table, w_grid = grid_description(pot_w_descr)
+
+    bounds = np.array([pot_descr.min_x, pot_descr.max_x,
+                       pot_descr.min_y, pot_descr.max_y], dtype=np.float64)
+    if geom_descr:
+        columns = geom_descr.get_column_offsets(incl_sides=True)
+        radius = float(geom_descr.radius)
+    else:
+        columns = np.zeros(shape=(0, 2))
+        radius = 0.
+
+    _dd_kernel(p_e, p_h, np.asarray(q0, dtype=np.float64), int(n_steps),
+               float(dt), bounds, columns, radius,
+               e_table, e_grid, w_table, w_grid,
+               np.array(silicon.get_mobility_parameters(temp, True)),
+               np.array(silicon.get_mobility_parameters(temp, False)),
+               silicon.get_thermal_velocity(temp, is_electron=True),
+               silicon.get_thermal_velocity(temp, is_electron=False),
+               bool(diffusion), float(t_e_trapping), float(t_h_trapping),
+               float(t_e_t1), float(t_h_t1), float(t_r),
+               traj_e, traj_h, I_ind_e, I_ind_h, T, I_ind_tot,
+               Q_ind_tot_e, Q_ind_tot_h, rng)
+
     return traj_e, traj_h, I_ind_e, I_ind_h, T, I_ind_tot, Q_ind_tot_e, Q_ind_tot_h
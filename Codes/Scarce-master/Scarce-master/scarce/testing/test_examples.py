@@ -9,10 +9,19 @@ from scarce.examples import sensor_planar
 from scarce.examples import sensor_3D
 from scarce.examples import transient_planar
 from scarce.examples import transient_3D
+from scarce.testing import tools
 
 
 class TestExamples(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.cache = tools.TemporaryCache()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache.close()
+
     def setUp(self):
         if os.getenv('TRAVIS', False):
             from xvfbwrapper import Xvfb
@@ -1,18 +1,24 @@
 import unittest
 import numpy as np
 import os
+import pickle
 
 from fipy.tools import dump
 
 from scarce.testing import tools
 from scarce import constant
-from scarce import fields, geometry
+from scarce import fields, geometry, sensor
 
 
 class TestFields(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.cache = tools.TemporaryCache()
+
     @classmethod
     def tearDownClass(cls):
+        cls.cache.close()
         os.remove('planar_mesh_tmp_2.msh')
 
     def test_w_potential_analytic(self):
@@ -296,6 +302,159 @@ class TestFields(unittest.TestCase):
                 self.assertTrue(
                     np.allclose(pot_numeric, pot_numeric_2, equal_nan=True))
 
+    def test_potential_smoothing_cache(self):
+        '''  Checks that the smoothed potential is fitted once and only
+             refitted when the smoothing or the grid changes.
+        '''
+
+        potential = dump.read(
+            filename=os.path.join(constant.FIXTURE_FOLDER, 'potential.sc'))
+
+        potential_descr = fields.Description(potential,
+                                             min_x=-550.,
+                                             max_x=550.,
+                                             min_y=0.,
+                                             max_y=50.,
+                                             nx=400,
+                                             ny=100,
+                                             smoothing=0.1)
+
+        x, y = np.linspace(-500., 500., 50), np.linspace(1., 49., 50)
+
+        pot_1 = potential_descr.get_potential_smooth(x, y)
+        pot_smooth = potential_descr.pot_smooth
+        field_1 = potential_descr.get_field(x, y)
+
+        # Same spline for all calls
+        pot_2 = potential_descr.get_potential_smooth(x, y)
+        self.assertIs(pot_smooth, potential_descr.pot_smooth)
+        self.assertTrue(np.all(pot_1 == pot_2))
+
+        # Cached spline can be pickled
+        potential_descr_2 = pickle.loads(pickle.dumps(potential_descr))
+        self.assertTrue(np.all(
+            pot_1 == potential_descr_2.get_potential_smooth(x, y)))
+
+        # Changing the smoothing invalidates the spline and the field
+        potential_descr.smoothing = 10.
+        potential_descr.get_potential_smooth(x, y)
+        self.assertIsNot(pot_smooth, potential_descr.pot_smooth)
+        self.assertFalse(np.all(field_1 == potential_descr.get_field(x, y)))
+
+    def test_planar_sensor_sweep(self):
+        '''  Compares the potentials of the bias voltage sweep with the
+             potentials calculated for each bias voltage separately.
+        '''
+
+        parameters = dict(n_eff=1.45e12, V_readout=0., n_pixel=5, width=50.,
+                          pitch=30., thickness=200., resolution=50.,
+                          nx=250, ny=200, mesh_file='planar_mesh_tmp_2.msh',
+                          cache=False)
+        biases = [-20., -80.]  # Not and fully depleted
+
+        pot_w_descr, pot_descrs = sensor.planar_sensor_sweep(
+            V_bias=biases, **parameters)
+        self.assertEqual(sorted(pot_descrs), sorted(biases))
+
+        x, y = np.linspace(-100., 100., 50), np.linspace(1., 199., 50)
+        for V_bias in biases:
+            pot_w_descr_2, pot_descr = sensor.planar_sensor(V_bias=V_bias,
+                                                            **parameters)
+            self.assertTrue(np.allclose(
+                pot_descrs[V_bias].get_potential(x, y),
+                pot_descr.get_potential(x, y), atol=1e-6, equal_nan=True))
+        self.assertTrue(np.allclose(pot_w_descr.get_potential(x, y),
+                                    pot_w_descr_2.get_potential(x, y),
+                                    equal_nan=True))
+
+    def test_planar_sensor_analytic(self):
+        '''  Checks the analytic planar sensor descriptions.
+        '''
+
+        thickness = 200.
+        x = np.linspace(-100., 100., 201)
+        y = np.linspace(0., thickness, 201)
+        xx, yy = np.meshgrid(x, y, sparse=True, indexing='ij')
+
+        for V_bias in [-80., -30.]:  # Fully and not depleted
+            pot_w_descr, pot_descr = sensor.planar_sensor(n_eff=1.45e12,
+                                                          V_bias=V_bias,
+                                                          n_pixel=9,
+                                                          width=50.,
+                                                          pitch=50.,
+                                                          thickness=thickness,
+                                                          analytic=True)
+
+            self.assertTrue(np.allclose(
+                pot_w_descr.get_potential(xx, yy),
+                fields.get_weighting_potential_analytic(
+                    xx, yy, D=thickness, S=50., is_planar=True),
+                equal_nan=True))
+
+            # Field is the derivation of the potential
+            for descr in (pot_descr, pot_w_descr):
+                E_x, E_y = np.gradient(-descr.get_potential(xx, yy),
+                                       x[1] - x[0], y[1] - y[0])
+                field = descr.get_field(xx, yy)
+                sel = (yy > 5.) & (yy < thickness - 5.) & \
+                    np.ones_like(xx, dtype=bool)
+                self.assertLess(np.abs(field[0] - E_x)[sel].max(), 1e-3)
+                self.assertLess(np.abs(field[1] - E_y)[sel].max(), 1e-3)
+
+                self.assertTrue(np.allclose(
+                    descr.get_field_fast(xx, yy)[:, sel], field[:, sel],
+                    rtol=0., atol=1e-2))
+
+        # Potential and depletion of the not fully depleted sensor
+        depletion = pot_descr.get_depletion(0.)
+        self.assertLess(depletion, thickness)
+        self.assertTrue(np.allclose(pot_descr.get_potential(
+            0., np.linspace(depletion + 1., thickness, 10)),
+            pot_descr.get_potential(0., thickness)))
+
+        with self.assertRaises(ValueError):  # Fill factor < 100%
+            sensor.planar_sensor(n_eff=1.45e12, V_bias=-80., width=50.,
+                                 pitch=30., analytic=True)
+
+    def test_field_grid(self):
+        '''  Checks the regular grid field lookup table against the
+             analytic weighting field of a planar sensor.
+        '''
+
+        width, thickness = 50., 200.
+
+        # 0.25 um grid, without the readout plane where the field diverges
+        x = np.linspace(-width * 2, width * 2, 801)
+        y = np.linspace(1., thickness, 797)
+        xx, yy = np.meshgrid(x, y, sparse=True, indexing='ij')
+        E_w_x, E_w_y = fields.get_weighting_field_analytic(
+            xx, yy, D=thickness, S=width, is_planar=True)
+
+        field_grid = fields.FieldGrid(x, y, E_w_x, E_w_y)
+
+        # Exact at the grid points
+        self.assertTrue(np.allclose(field_grid(xx, yy), [E_w_x, E_w_y],
+                                    rtol=1e-6, atol=1e-7))
+
+        # Bilinear interpolation between grid points. Positions close to the
+        # electrode edges are excluded (field diverges there)
+        x_r = np.random.uniform(-width * 2, width * 2, 10000)
+        y_r = np.random.uniform(5., thickness, 10000)
+        field_analytic = np.array(fields.get_weighting_field_analytic(
+            x_r, y_r, D=thickness, S=width, is_planar=True))
+        self.assertTrue(np.allclose(field_grid(x_r, y_r), field_analytic,
+                                    rtol=1e-3, atol=1e-4))
+
+        # Positions outside get the boundary values
+        self.assertTrue(np.allclose(field_grid(x[-1] + 10., y[-1] + 10.),
+                                    [E_w_x[-1, -1], E_w_y[-1, -1]]))
+
+        # NaN positions give a NaN field, as Description.get_field
+        field = field_grid(np.array([0., np.nan, 0.]),
+                           np.array([10., 10., np.nan]))
+        self.assertTrue(np.all(np.isfinite(field[:, 0])))
+        self.assertTrue(np.all(np.isnan(field[:, 1:])))
+
 
 if __name__ == "__main__":
     import logging
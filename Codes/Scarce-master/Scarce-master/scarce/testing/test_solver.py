@@ -1,14 +1,44 @@
 import unittest
+import os
 import fipy
 import numpy as np
 
 from scarce.examples import potential_1D
-from scarce import constant, fields
+from scarce import analysis, constant, fields, sensor, solver
+from scarce.testing import tools
 from scipy import constants
 
 
 class TestSolver(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.cache = tools.TemporaryCache()
+
+        # Analytic planar sensor for the drift diffusion tests, needs no mesh
+        thickness = 200.
+        cls.pot_w_descr, cls.pot_descr = sensor.planar_sensor(n_eff=1.45e12,
+                                                              V_bias=-80.,
+                                                              V_readout=0.,
+                                                              n_pixel=9,
+                                                              width=50.,
+                                                              pitch=50.,
+                                                              thickness=thickness,
+                                                              analytic=True)
+
+        # Start positions away from the pixel borders, where the path of a
+        # carrier depends on the time step
+        xx, yy = np.meshgrid(np.linspace(-20., 20., 10),
+                             np.linspace(5., thickness - 10., 10))
+        cls.p0 = np.array([xx.ravel(), yy.ravel()])
+        cls.q0 = np.ones(cls.p0.shape[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cache.close()
+        if os.path.exists('3D_mesh_tmp_dd.msh'):
+            os.remove('3D_mesh_tmp_dd.msh')
+
     def test_linear_poison_solver(self):
         ''' Compare the result of the poison solution with
             analytical result.
@@ -40,5 +70,298 @@ class TestSolver(unittest.TestCase):
 
             self.assertTrue(np.allclose(potential, potential_a[:-1], atol=1e-1))
 
+    def test_potential_solver_backends(self):
+        ''' Compare the iterative potential solvers with the LU solver
+            for a partially depleted planar sensor.
+        '''
+
+        mesh = fipy.Grid2D(dx=1., dy=1., nx=100, ny=50)
+        X, _ = mesh.faceCenters
+        not_depleted = mesh.cellCenters[1] > 30.
+
+        def solve(backend, value=0.):
+            potential = fipy.CellVariable(mesh=mesh, value=value)
+            equation = (fipy.DiffusionTerm(coeff=1.) - 1e-3 ==
+                        fipy.ImplicitSourceTerm(not_depleted * 1e10) +
+                        not_depleted * 1e10 * 50.)
+            bcs = [fipy.FixedValue(value=-50., faces=mesh.facesTop),
+                   fipy.FixedValue(value=0., faces=mesh.facesBottom &
+                                   (np.abs(X - 50.) < 15.))]
+            solver.solve(potential, equation=equation, backend=backend,
+                         boundaryConditions=bcs)
+            return np.array(potential.value)
+
+        potential_lu = solve('lu')
+        self.assertTrue(np.allclose(
+            potential_lu[np.array(not_depleted)], -50.))
+
+        # The factorization of an equal matrix is reused
+        factorizations = list(solver._factorizations.items())
+        self.assertTrue(np.array_equal(solve('lu'), potential_lu))
+        self.assertEqual(list(solver._factorizations.items()),
+                         factorizations)
+
+        backends = ['cg', 'amg'] if solver.pyamg is not None else ['cg']
+        for backend in backends:
+            self.assertTrue(np.allclose(solve(backend), potential_lu,
+                                        rtol=0., atol=1e-6))
+            # Warm start
+            self.assertTrue(np.allclose(solve(backend, value=potential_lu),
+                                        potential_lu, rtol=0., atol=1e-6))
+
+        with self.assertRaises(ValueError):
+            solve('unknown')
+
+    @unittest.skipIf(solver.numba is None, 'numba not installed')
+    def test_numba_backend(self):
+        ''' Compare the compiled drift diffusion solver with the numpy solver.
+        '''
+
+        pot_descr, pot_w_descr = self.pot_descr, self.pot_w_descr
+        p0, q0 = self.p0, self.q0
+
+        def solve(diffusion, backend):
+            dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                             diffusion=diffusion,
+                                             t_e_trapping=5.,
+                                             t_h_trapping=5.,
+                                             fast_field=True,
+                                             backend=backend)
+            return dd.solve(p0.copy(), q0, dt=0.001, n_steps=5000,
+                            multicore=False)
+
+        # Without diffusion both solvers propagate the same way
+        results_numpy = solve(diffusion=False, backend='numpy')
+        results_numba = solve(diffusion=False, backend='numba')
+        for data_numpy, data_numba in zip(results_numpy, results_numba):
+            self.assertEqual(data_numpy.shape, data_numba.shape)
+            self.assertTrue(np.allclose(data_numpy, data_numba, rtol=1e-3,
+                                        atol=1e-5, equal_nan=True))
+
+        # With diffusion the total induced charge agrees within errors
+        Q_numpy = np.sum(solve(diffusion=True, backend='numpy')[6:], axis=0)
+        Q_numba = np.sum(solve(diffusion=True, backend='numba')[6:], axis=0)
+        error = np.sqrt((Q_numpy.var() + Q_numba.var()) / Q_numpy.shape[0])
+        self.assertLess(np.abs(Q_numpy.mean() - Q_numba.mean()), 3 * error)
+
+    def test_multicore(self):
+        ''' Compare the drift diffusion solved in chunks by the worker pool
+            with the single core solution.
+        '''
+
+        pot_descr, pot_w_descr = self.pot_descr, self.pot_w_descr
+        p0, q0 = self.p0, self.q0
+
+        dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                         diffusion=False, fast_field=True,
+                                         n_workers=2, chunk_size=30)
+        results = dd.solve(p0.copy(), q0, dt=0.001, n_steps=3000,
+                           multicore=False)
+        # Second call reuses the pool and the shared fields
+        for _ in range(2):
+            results_multicore = dd.solve(p0.copy(), q0, dt=0.001,
+                                         n_steps=3000, multicore=True)
+            for data, data_multicore in zip(results, results_multicore):
+                self.assertTrue(np.allclose(data, data_multicore,
+                                            equal_nan=True))
+        dd.close()
+
+        # Only the selected results are returned
+        dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                         diffusion=False, fast_field=True,
+                                         n_workers=2, chunk_size=30,
+                                         outputs=('q_tot', 'i_tot'))
+        results_multicore = dd.solve(p0.copy(), q0, dt=0.001, n_steps=3000,
+                                     multicore=True)
+        dd.close()
+        for index, data in enumerate(results_multicore):
+            if index in (5, 6, 7):
+                self.assertTrue(np.allclose(data, results[index]))
+            else:
+                self.assertIsNone(data)
+
+        with self.assertRaises(ValueError):
+            solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                        outputs=('q_tot', 'charge'))
+
+    def test_reduction_outputs(self):
+        ''' Check that only the total induced charge can be calculated
+            without storing the results per time step.
+        '''
+
+        # Nothing is stored per time step without traj, i_ind and time
+        self.assertEqual(solver._n_store(20000, 50, ('q_tot', 'i_tot')),
+                         (0, 0))
+        self.assertEqual(solver._n_store(20000, 50, ('i_ind', )), (400, 0))
+        self.assertEqual(solver._n_store(20000, 50, None), (400, 400))
+
+        pot_descr, pot_w_descr = self.pot_descr, self.pot_w_descr
+        p0, q0 = self.p0, self.q0
+
+        for adaptive in (False, True):
+            results = []
+            for outputs in (None, ('q_tot', 'i_tot')):
+                dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                                 diffusion=False,
+                                                 fast_field=True,
+                                                 adaptive=adaptive,
+                                                 outputs=outputs)
+                results.append(dd.solve(p0.copy(), q0, dt=0.001,
+                                        n_steps=3000, multicore=False))
+            for index, data in enumerate(results[1]):
+                if index in (5, 6, 7):
+                    self.assertTrue(np.array_equal(data, results[0][index]))
+                else:
+                    self.assertIsNone(data)
+
+    def test_seed(self):
+        ''' Check that the drift diffusion with a seed is identical for
+            single and multicore solving with any number of workers.
+        '''
+
+        pot_descr, pot_w_descr = self.pot_descr, self.pot_w_descr
+        p0, q0 = self.p0, self.q0
+
+        settings = [{}, {'adaptive': True}]
+        if solver.numba is not None:
+            settings.append({'backend': 'numba'})
+
+        for kwargs in settings:
+            results = []
+            for seed, multicore, n_workers in ((42, False, 1), (42, True, 1),
+                                               (42, True, 2), (43, True, 2)):
+                dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                                 diffusion=True,
+                                                 fast_field=True,
+                                                 n_workers=n_workers,
+                                                 chunk_size=30, seed=seed,
+                                                 **kwargs)
+                results.append(dd.solve(p0.copy(), q0, dt=0.001,
+                                        n_steps=3000, multicore=multicore))
+                dd.close()
+
+            for other in results[1:3]:
+                for data, data_other in zip(results[0], other):
+                    self.assertTrue(np.array_equal(data, data_other,
+                                                   equal_nan=True))
+            # Another seed gives other results
+            self.assertFalse(np.array_equal(results[0][6], results[3][6]))
+
+    def test_charge_planar_batch(self):
+        ''' Check the batched charge collection scan against single
+            calculations.
+        '''
+
+        width, thickness = 50., 200.
+
+        def descriptions(bias, thickness):
+            pot_w_descr, pot_descr = sensor.planar_sensor(n_eff=1.45e12,
+                                                          V_bias=bias,
+                                                          n_pixel=9,
+                                                          width=width,
+                                                          pitch=width,
+                                                          thickness=thickness,
+                                                          analytic=True)
+            return pot_descr, pot_w_descr
+
+        kwargs = dict(grid_x=10, grid_y=20, n_pairs=4, dt=0.001,
+                      n_steps=20000, adaptive=True)
+        parameters = [(1000., 0., -80., thickness),
+                      (5., 0., -80., thickness),
+                      (5., 0.5, -150., thickness)]
+
+        for multicore in (False, True):
+            charges = analysis.get_charge_planar_batch(width, parameters,
+                                                       descriptions,
+                                                       multicore=multicore,
+                                                       **kwargs)
+            self.assertEqual(len(charges), len(parameters))
+            for (t_tr, t_t1, bias, _), (_, _, charge) in zip(parameters,
+                                                             charges):
+                pot_descr, pot_w_descr = descriptions(bias, thickness)
+                _, _, charge_single = analysis.get_charge_planar(
+                    width, thickness, pot_descr, pot_w_descr,
+                    t_e_trapping=t_tr, t_h_trapping=t_tr,
+                    t_e_t1=t_t1, t_h_t1=t_t1, multicore=False, **kwargs)
+                self.assertEqual(charge.shape, charge_single.shape)
+                self.assertAlmostEqual(charge.sum() / charge_single.sum(),
+                                       1., delta=0.05)
+            # Trapping reduces the collected charge
+            self.assertLess(charges[1][2].sum(), 0.9 * charges[0][2].sum())
+
+        solver.close_pool()
+
+    def check_adaptive_time_step(self, pot_descr, pot_w_descr, p0,
+                                 geom_descr=None):
+        ''' Compare the adaptive time step results with the fixed time
+            step results.
+        '''
+
+        q0 = np.ones(p0.shape[1])
+        n_steps = 10000
+
+        def solve(adaptive):
+            dd = solver.DriftDiffusionSolver(pot_descr, pot_w_descr,
+                                             geom_descr=geom_descr,
+                                             diffusion=False,
+                                             t_e_trapping=5.,
+                                             t_h_trapping=5.,
+                                             fast_field=True,
+                                             adaptive=adaptive)
+            return dd.solve(p0.copy(), q0, dt=0.001, n_steps=n_steps,
+                            multicore=False)
+
+        results_fixed = solve(adaptive=False)
+        results_adaptive = solve(adaptive=True)
+
+        # Same output format
+        for data_fixed, data_adaptive in zip(results_fixed,
+                                             results_adaptive):
+            self.assertEqual(data_fixed.shape, data_adaptive.shape)
+
+        # Same start positions and total induced charge
+        self.assertTrue(np.allclose(results_fixed[0][0],
+                                    results_adaptive[0][0], equal_nan=True))
+        Q_fixed = results_fixed[6] + results_fixed[7]
+        Q_adaptive = results_adaptive[6] + results_adaptive[7]
+        self.assertTrue(np.allclose(Q_fixed, Q_adaptive, atol=1e-2))
+        # The total induced current adds up to the induced charge
+        self.assertAlmostEqual(results_adaptive[5].sum() * 0.001,
+                               Q_adaptive.sum(), delta=1e-6 * p0.shape[1])
+
+    def test_adaptive_time_step(self):
+        ''' Compare the adaptive time step drift diffusion solver with the
+            fixed time step solver in a planar sensor.
+        '''
+
+        self.check_adaptive_time_step(self.pot_descr, self.pot_w_descr,
+                                      self.p0)
+
+    def test_adaptive_time_step_3D(self):
+        ''' Compare the adaptive time step drift diffusion solver with the
+            fixed time step solver in a 3D sensor.
+        '''
+
+        width_x, width_y = 250., 50.
+        pot_w_descr, pot_descr, geom_descr = sensor.sensor_3D(n_eff=1e12,
+                                                              V_bias=-20.,
+                                                              V_readout=0.,
+                                                              n_pixel_x=3,
+                                                              n_pixel_y=3,
+                                                              width_x=width_x,
+                                                              width_y=width_y,
+                                                              radius=6.,
+                                                              nD=2,
+                                                              resolution=80,
+                                                              smoothing=0.1,
+                                                              mesh_file='3D_mesh_tmp_dd.msh')
+
+        xx, yy = np.meshgrid(np.linspace(-width_x / 2., width_x / 2., 10),
+                             np.linspace(-width_y / 2., width_y / 2., 5))
+        p0 = np.array([xx.ravel(), yy.ravel()])
+
+        self.check_adaptive_time_step(pot_descr, pot_w_descr, p0,
+                                      geom_descr=geom_descr)
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,5 +1,7 @@
 import unittest
 import os
+import shutil
+import fipy
 import numpy as np
 
 from scarce import tools, geometry, fields
@@ -9,7 +11,11 @@ class TestTools(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        os.remove('tmp.sc')
+        for filename in ('tmp.sc', 'tmp_cache'):
+            if os.path.isdir(filename):
+                shutil.rmtree(filename)
+            elif os.path.exists(filename):
+                os.remove(filename)
 
     def test_save_and_load(self):
         ''' Check the saving and loading to disk.
@@ -55,6 +61,86 @@ class TestTools(unittest.TestCase):
                                == np.array(description_2.get_field(description_2._xx,
                                                                    description_2._yy))))
 
+    def test_save_and_load_formats(self):
+        ''' Check saving and loading in the binary and dill format.
+        '''
+
+        mesh = fipy.Grid2D(dx=0.5, dy=0.5, nx=100, ny=50)
+        potential = fipy.CellVariable(mesh=mesh, value=np.array(mesh.x))
+        data = {'potential': potential,
+                'grid': np.random.normal(size=(200, 300)),
+                'function': lambda x: 2 * x}
+
+        for kwargs in ({}, {'compress': False}, {'compress': 'zlib'},
+                       {'binary': False},
+                       {'binary': False, 'compress': False}):
+            tools.save(data, 'tmp.sc', **kwargs)
+            for mmap in (True, False):
+                data_2 = tools.load('tmp.sc', mmap=mmap)
+                self.assertTrue(np.all(data['grid'] == data_2['grid']))
+                self.assertTrue(np.all(np.array(potential) ==
+                                       np.array(data_2['potential'])))
+                self.assertTrue(np.all(np.array(mesh.cellCenters) ==
+                                       np.array(data_2['potential'].mesh.cellCenters)))
+                self.assertEqual(data_2['function'](2), 4)
+                # Loaded arrays can be changed
+                data_2['grid'][0, 0] = 1.
+                del data_2
+
+        # zlib is the default, other codecs need their package
+        tools.save(data, 'tmp.sc')
+        with open('tmp.sc', 'rb') as in_file:
+            content = in_file.read()
+        self.assertIn(b'"codec": "zlib"', content)
+        if tools.zstandard is None:
+            with open('tmp.sc', 'wb') as out_file:
+                out_file.write(content.replace(b'"codec": "zlib"',
+                                               b'"codec": "zstd"'))
+            with self.assertRaisesRegex(ImportError, 'zstandard'):
+                tools.load('tmp.sc')
+            with self.assertRaisesRegex(ImportError, 'zstandard'):
+                tools.save(data, 'tmp.sc', compress='zstd')
+
+    def test_cache(self):
+        ''' Check the persistent cache.
+        '''
+
+        created = []
+
+        def create(size):
+            created.append(size)
+            return np.arange(size)
+
+        def cached(size, name='data', max_size=1e9):
+            return tools.cached(name, {'size': size, 'name': None},
+                                lambda: create(size), folder='tmp_cache',
+                                max_size=max_size)
+
+        # Created only once, the parameters 10 and 10. are the same
+        self.assertTrue(np.all(cached(10) == np.arange(10)))
+        self.assertTrue(np.all(cached(10.) == np.arange(10)))
+        self.assertEqual(created, [10])
+
+        # Other parameters or names are created again
+        cached(20)
+        cached(10, name='other')
+        self.assertEqual(created, [10, 20, 10])
+
+        # A corrupt cache file is created again
+        filename = tools.get_cache_file('data', {'size': 20, 'name': None},
+                                        folder='tmp_cache')
+        with open(filename, 'wb') as out_file:
+            out_file.write(b'corrupt')
+        self.assertTrue(np.all(cached(20) == np.arange(20)))
+        self.assertEqual(created, [10, 20, 10, 20])
+
+        # The least recently used files are removed if the cache is full
+        os.utime(filename, (0, 0))
+        size = os.path.getsize(filename)
+        cached(30, max_size=2.5 * size)
+        self.assertFalse(os.path.exists(filename))
+        self.assertEqual(len(os.listdir('tmp_cache')), 2)
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.INFO,
@@ -1,10 +1,13 @@
 import inspect
 import os
+import shutil
+import tempfile
 import tables as tb
 import numpy as np
 import itertools
 
 from scarce import constant
+from scarce import tools as scarce_tools
 
 
 def compare_arrays(array_1, array_2, threshold=0.01):
@@ -30,6 +33,23 @@ def compare_arrays(array_1, array_2, threshold=0.01):
     return float(bad_points[0].shape[0]) / n_points
 
 
+class TemporaryCache(object):
+
+    ''' Uses a new temporary folder as persistent cache
+        (scarce.tools.CACHE_FOLDER) until close(). Thus tests do not load
+        objects cached by other code versions.
+    '''
+
+    def __init__(self):
+        self.folder = tempfile.mkdtemp()
+        self._old_folder = scarce_tools.CACHE_FOLDER
+        scarce_tools.CACHE_FOLDER = self.folder
+
+    def close(self):
+        scarce_tools.CACHE_FOLDER = self._old_folder
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
 def _call_function_with_args(function, **kwargs):
     ''' Calls the function with the given kwargs
     and returns the result in a numpy array. All combinations
@@ -4,17 +4,87 @@ r"""The tools module offers helper functions.
 
 import dill
 import gzip
+import hashlib
+import io
+import json
 import logging
+import numbers
+import os
+import pickle
+import struct
+import uuid
+import zlib
 
 import numpy as np
 from scipy import interpolate
 _LOGGER = logging.getLogger(__name__)
 
+try:  # Optional fast compression of the binary file format
+    import zstandard
+except ImportError:
+    zstandard = None
 
-def save(obj, filename, compress=True):
-    ''' Save object to file'''
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Persistent cache of meshes and field descriptions, see cached. Set the
+# folder to None to disable the cache.
+CACHE_FOLDER = os.environ.get('SCARCE_CACHE_FOLDER',
+                              os.path.join(os.path.expanduser('~'),
+                                           '.scarce', 'cache'))
+CACHE_MAX_SIZE = 2 * 1024 ** 3  # Bytes
+# Changes of the cached objects need a new cache version
+# 2: Mesh interpolation, potential solver backends and analytic descriptions
+_CACHE_VERSION = 2
+
+# Binary file format: magic, header size, json header and the data sections.
+# The first section is the pickled object, the others the numpy array data.
+_BINARY_MAGIC = b'\x93SCARCE\x01'
+_BINARY_ALIGNMENT = 64  # Bytes, alignment of the data sections
+# The binary format needs the out-of-band buffers of pickle protocol 5
+_HAS_BINARY = pickle.HIGHEST_PROTOCOL >= 5
+
+# Compression codecs of the binary format. zlib is always available and the
+# default, zstd and lz4 are faster but need optional packages.
+_CODECS = {}
+_CODECS['zlib'] = (lambda data: zlib.compress(data, 1), zlib.decompress)
+if zstandard is not None:
+    _CODECS['zstd'] = (
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data))
+if lz4_frame is not None:
+    _CODECS['lz4'] = (lz4_frame.compress, lz4_frame.decompress)
+_CODEC_PACKAGES = {'zstd': 'zstandard', 'lz4': 'lz4'}
+
+
+def save(obj, filename, compress=True, binary=True):
+    ''' Save object to file
+
+        Parameters
+        ----------
+        obj : object
+            Any object that can be pickled with dill, e.g.
+            fields.Description or a mesh
+        filename : string
+            File name
+        compress : boolean, string
+            Compress the file. The binary format uses zlib or the codec
+            given by name: 'zlib', 'zstd' (needs zstandard) or 'lz4' (needs
+            lz4). Files with zstd or lz4 can only be loaded where the
+            package is installed. The dill format uses gzip.
+        binary : boolean
+            Store the numpy arrays of the object as raw binary data next to
+            the pickled rest of the object (pickle protocol 5). Much faster
+            and smaller than pickling everything with dill protocol 0, that
+            is used otherwise. Needs Python >= 3.8. The arrays of
+            uncompressed files are memory mapped on load.
+    '''
     _LOGGER.info('Saving to %s', filename)
-    if compress:
+    if binary and _HAS_BINARY:
+        _save_binary(obj, filename, compress)
+    elif compress:
         with gzip.open(filename, mode='wb') as out_file:
             dill.dump(obj, out_file, protocol=0)
     else:
@@ -22,10 +92,26 @@ def save(obj, filename, compress=True):
             dill.dump(obj, out_file, protocol=0)
 
 
-def load(filename, compress=True):
-    ''' Load object from file'''
+def load(filename, compress=True, mmap=True):
+    ''' Load object from file
+
+        The file format (binary, gzip or plain dill) is detected from the
+        file, compress is not needed anymore.
+
+        Parameters
+        ----------
+        filename : string
+            File name
+        mmap : boolean
+            Memory map the arrays of uncompressed binary files instead of
+            reading them. Changes of the arrays are not written to the file.
+    '''
     _LOGGER.info('Loading %s', filename)
-    if compress:
+    with open(filename, mode='rb') as in_file:
+        magic = in_file.read(len(_BINARY_MAGIC))
+    if magic == _BINARY_MAGIC:
+        return _load_binary(filename, mmap)
+    if magic[:2] == b'\x1f\x8b':  # gzip
         with gzip.open(filename, mode='rb') as in_file:
             return dill.load(in_file)
     else:
@@ -33,6 +119,196 @@ def load(filename, compress=True):
             return dill.load(in_file)
 
 
+class _BinaryPickler(dill.Pickler):
+
+    ''' Pickles numpy arrays out-of-band with pickle protocol 5. Otherwise
+        dill pickles them in-band.
+    '''
+
+    def reducer_override(self, obj):
+        if type(obj) is np.ndarray and not obj.dtype.hasobject:
+            return obj.__reduce_ex__(5)
+        return NotImplemented
+
+
+def _save_binary(obj, filename, compress):
+    buffers = []
+    data = io.BytesIO()
+    _BinaryPickler(data, protocol=5, buffer_callback=buffers.append).dump(obj)
+
+    sections = [data.getvalue()] + [buffer.raw() for buffer in buffers]
+    sizes = [memoryview(section).nbytes for section in sections]
+    codec = None
+    if compress:
+        codec = compress if isinstance(compress, str) else 'zlib'
+        sections = [_get_codec(codec)[0](section) for section in sections]
+
+    # Header with the offsets of the aligned data sections
+    def get_header(start):
+        layout, offset = [], start
+        for section, size in zip(sections, sizes):
+            offset += -offset % _BINARY_ALIGNMENT
+            layout.append([offset, len(section), size])
+            offset += len(section)
+        return json.dumps({'codec': codec, 'sections': layout}).encode()
+
+    # The offsets depend on the header size, reserve space for them
+    header_size = len(get_header(0)) + 32
+    header = get_header(len(_BINARY_MAGIC) + 8 + header_size)
+    header = header.ljust(header_size)
+
+    with open(filename, mode='wb') as out_file:
+        out_file.write(_BINARY_MAGIC)
+        out_file.write(struct.pack('<Q', header_size))
+        out_file.write(header)
+        for section in sections:
+            out_file.write(b'\0' * (-out_file.tell() % _BINARY_ALIGNMENT))
+            out_file.write(section)
+
+
+def _get_codec(codec):
+    ''' Returns the compress and decompress function of the codec '''
+    if codec in _CODECS:
+        return _CODECS[codec]
+    if codec in _CODEC_PACKAGES:
+        raise ImportError('The %s compression needs the %s package, install '
+                          'it with pip install %s' % (
+                              codec, _CODEC_PACKAGES[codec],
+                              _CODEC_PACKAGES[codec]))
+    raise ValueError('Unknown compression codec %s' % codec)
+
+
+def _load_binary(filename, mmap):
+    with open(filename, mode='rb') as in_file:
+        in_file.seek(len(_BINARY_MAGIC))
+        header_size = struct.unpack('<Q', in_file.read(8))[0]
+        header = json.loads(in_file.read(header_size).decode())
+
+        if header['codec'] is None and mmap:
+            # Copy on write, changes are not written to the file
+            data = np.memmap(in_file, dtype=np.uint8, mode='c')
+            sections = [data[offset:offset + size]
+                        for offset, size, _ in header['sections']]
+        else:
+            sections = []
+            for offset, size, _ in header['sections']:
+                in_file.seek(offset)
+                section = in_file.read(size)
+                if header['codec'] is not None:
+                    section = _get_codec(header['codec'])[1](section)
+                sections.append(bytearray(section))  # Writable arrays
+
+    return dill.Unpickler(io.BytesIO(sections[0]),
+                          buffers=sections[1:]).load()
+
+
+def get_cache_file(name, parameters, folder=None):
+    ''' File name of the cached object name defined by the parameters.
+
+        The file name contains the hash of the name and all parameters.
+        Numbers are compared as floats, thus 50 and 50. are the same.
+    '''
+
+    def normalize(value):
+        if isinstance(value, numbers.Number) and not isinstance(value, bool):
+            return float(value)
+        return value
+
+    data = json.dumps([name, _CACHE_VERSION,
+                       sorted((key, normalize(value))
+                              for key, value in parameters.items())])
+    key = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    return os.path.join(folder or CACHE_FOLDER, '%s_%s.sc' % (name, key))
+
+
+def cached(name, parameters, create, folder=None, max_size=None):
+    ''' Returns the object defined by the parameters from the persistent
+        cache or creates it with create() and stores it in the cache.
+
+        The objects are stored with save in the cache folder
+        (CACHE_FOLDER), the file name is the hash of the name and the
+        parameters (get_cache_file). Thus the parameters have to define the
+        object completely. If the cached files exceed max_size bytes
+        (CACHE_MAX_SIZE) the least recently used files are removed.
+
+        Parameters
+        ----------
+        name : string
+            Name of the object type, e.g. planar_mesh
+        parameters : dict
+            Numbers, strings, booleans and None defining the object
+        create : function
+            Creates the object if it is not cached
+        folder : string
+            Cache folder. Default: CACHE_FOLDER. Not cached if None.
+        max_size : number
+            Maximum size of the cache folder in bytes.
+            Default: CACHE_MAX_SIZE
+    '''
+
+    folder = folder or CACHE_FOLDER
+    if not folder:
+        return create()
+    filename = get_cache_file(name, parameters, folder)
+
+    if os.path.isfile(filename):
+        try:
+            obj = load(filename)
+        except Exception:  # Corrupt or incompatible cache file
+            _LOGGER.warning('Cannot load cache file %s', filename)
+        else:
+            try:  # Mark as recently used
+                os.utime(filename, None)
+            except OSError:  # Removed by other process
+                pass
+            return obj
+
+    obj = create()
+
+    # Other processes only see complete files
+    tmp_filename = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        save(obj, tmp_filename)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        _LOGGER.warning('Cannot store %s in cache %s', name, folder)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    else:
+        _limit_cache_size(folder, max_size or CACHE_MAX_SIZE)
+
+    return obj
+
+
+def _limit_cache_size(folder, max_size):
+    ''' Removes the least recently used cache files until the cache
+        folder is smaller than max_size bytes
+    '''
+    files = []
+    for filename in os.listdir(folder):
+        if not filename.endswith('.sc'):
+            continue
+        filename = os.path.join(folder, filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:  # Removed by other process
+            continue
+        files.append((stat.st_mtime, stat.st_size, filename))
+
+    size = sum(file_size for _, file_size, _ in files)
+    for _, file_size, filename in sorted(files):
+        if size <= max_size:
+            break
+        _LOGGER.info('Remove %s from cache', filename)
+        try:
+            os.remove(filename)
+        except OSError:  # Removed by other process
+            pass
+        size -= file_size
+
+
 def apply_async(pool, fun, args=None, **kwargs):
     ''' Run fun(*args, **kwargs) in different process.
 
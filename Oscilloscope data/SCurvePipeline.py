@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Batch s-curve analysis for edge-TCT width scans.
+
+Takes a scan folder of scope CSVs named with the stage position (e.g. 50VBeamSizeEdgeY-2700X16800.csv),
+integrates the sensor pulse in every file at once and fits the erf model to the edge(s) to get the beam width.
+
+Usage: python SCurvePipeline.py [--dual] "scan folder" ["scan folder" ...]
+"""
+
+import os, re, sys, glob, time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.special as scpS
+from scipy.optimize import curve_fit
+try:
+    from scipy.integrate import cumulative_trapezoid
+except ImportError:
+    from scipy.integrate import cumtrapz as cumulative_trapezoid
+
+headerLength = 24
+micronsPerStep = 2.5 #stage steps to um (as used for steps in PulseProcessing.py)
+
+
+def erf(z,a,b,c,d):
+   return a*scpS.erf(b*(z+c))+d
+
+def params(b,c):
+    std = 1/(np.sqrt(2)*np.abs(b))
+    mean = (-1)*c
+    return mean, std
+
+
+def parsePosition(fileName):
+    #"50VBeamSizeEdgeY-2700X16800" -> {'Y': -2700.0, 'X': 16800.0}
+    stem = os.path.splitext(os.path.basename(fileName))[0]
+    return {axis: float(value) for axis, value in re.findall(r"([XYZ])(-?\d+(?:\.\d+)?)", stem)}
+
+def scanFiles(scanDir):
+    #All the CSVs in a scan folder sorted along the axis that was scanned (the one which changes between files)
+    files = glob.glob(os.path.join(scanDir, "*.csv"))
+    positions = [parsePosition(f) for f in files]
+    files = [f for f, p in zip(files, positions) if len(p) > 0]
+    positions = [p for p in positions if len(p) > 0]
+    if len(files) == 0:
+        raise ValueError("No scan files with positions in their names found in " + str(scanDir))
+
+    axes = sorted(positions[0].keys())
+    scanned = [a for a in axes if len(set([p.get(a) for p in positions])) > 1]
+    axis = scanned[0] if len(scanned) > 0 else axes[0]
+
+    order = np.argsort([p[axis] for p in positions])
+    return [files[i] for i in order], axis, np.array([positions[i][axis] for i in order])
+
+
+def loadWaveform(path):
+    #Columns: time, then the scope channels (usually trigger, sensor, beam monitor)
+    return pd.read_csv(path, skiprows = headerLength, header = None, dtype = np.float64).to_numpy()
+
+def loadScan(scanDir, workers = 8):
+    ''' Loads every waveform in a scan folder in parallel.
+        Returns the scanned axis, the stage positions, the time axis and the waveforms as (n_files, n_samples, n_channels) '''
+    files, axis, positions = scanFiles(scanDir)
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        waveforms = list(pool.map(loadWaveform, files))
+
+    #Files from an interrupted save can be short, so cut everything to the shortest
+    nSamples = min([w.shape[0] for w in waveforms])
+    data = np.stack([w[:nSamples] for w in waveforms])
+    return axis, positions, data[0,:,0], data[:,:,1:]
+
+
+def windowIntegrals(Time, Volts, start, end):
+    #Running integral over [start, end] for every waveform at once, shape (n_files, n_window_samples)
+    window = (Time > start) & (Time < end)
+    return cumulative_trapezoid(Volts[:, window], Time[window], axis = 1, initial = 0)
+
+def integrateScan(Time, Volts, channel = 1, cutP = None, cutWidth = 8e-9, noiseStart = -2e-8, noiseEnd = -1.2e-8):
+    ''' Integral of the sensor pulse and its noise estimate for every waveform (vectorised version of cut()/sample()).
+        channel indexes Volts (0 = first scope channel after time, so 1 is the sensor pulse in data[:,2]).
+        The integral is the minimum of the running integral over [cutP - cutWidth, cutP]; the noise is the largest
+        magnitude of the running integral over a window of the same width before the pulse.
+        With cutP = None the window is centred on the minimum of the scan averaged waveform, as the pulse moves between runs '''
+    signal = Volts[:, :, channel]
+    if cutP is None:
+        cutP = Time[np.argmin(np.mean(signal, axis = 0))] + (cutWidth / 2)
+    integrals = np.min(windowIntegrals(Time, signal, cutP - cutWidth, cutP), axis = 1)
+    noise = np.max(np.abs(windowIntegrals(Time, signal, noiseStart, noiseEnd)), axis = 1)
+    return integrals, noise
+
+
+def initialGuess(steps, integrals):
+    #a and d from the plateau levels, c from the half way point, b from the spacing of the points
+    low, high = np.min(integrals), np.max(integrals)
+    half = (low + high) / 2
+    rising = np.mean(integrals[:len(integrals)//2]) < np.mean(integrals[len(integrals)//2:])
+    a = (high - low) / 2 if rising else (low - high) / 2
+    iHalf = np.argmin(np.abs(integrals - half))
+    b = 1 / (2 * np.median(np.abs(np.diff(steps))))
+    return [a, b, -steps[iHalf], half]
+
+def fitEdge(steps, integrals, noise, p0 = None):
+    ''' Fits a*erf(b*(z+c))+d to one edge. Returns the edge position (mean) and width (sigma) in um with their errors
+        and the chi^2 per degree of freedom (weighted by the noise). '''
+    #The integrals are ~1e-10, so fit them in units of their largest value to keep the parameters of similar size
+    scale = np.max(np.abs(integrals))
+    if p0 is None:
+        p0 = initialGuess(steps, integrals)
+    p0 = [p0[0] / scale, p0[1], p0[2], p0[3] / scale]
+    sigma = np.where(noise > 0, noise, np.max(noise)) / scale
+    popt, pcov, info, message, ier = curve_fit(erf, steps, integrals / scale, p0, sigma = sigma, full_output = True, maxfev = 10000)
+    errors = np.sqrt(np.diag(pcov))
+    popt = np.array([popt[0] * scale, popt[1], popt[2], popt[3] * scale])
+    pcov = pcov * np.outer([scale, 1, 1, scale], [scale, 1, 1, scale])
+
+    mean, std = params(popt[1], popt[2])
+    dof = max(1, len(steps) - len(popt))
+    return {'mean' : mean, 'meanError' : errors[2],
+            'sigma' : std, 'sigmaError' : std * errors[1] / np.abs(popt[1]),
+            'chi2dof' : np.sum(info["fvec"]**2) / dof,
+            'popt' : popt, 'pcov' : pcov}
+
+def splitEdges(integrals):
+    #For a scan across the whole sensor: split at the middle of the region with more than half of the signal
+    signal = np.abs(integrals - np.median(integrals[[0, -1]]))
+    inside = np.where(signal > np.max(signal) / 2)[0]
+    return (inside[0] + inside[-1]) // 2 + 1
+
+
+def analyseScan(scanDir, dual = False, workers = 8, **integrationSettings):
+    ''' Whole pipeline for one scan folder: load, integrate and fit. Positions are converted to um relative to the first file.
+        dual = True fits the two edges (either side of the sensor) separately. Returns a dict with everything needed to plot '''
+    timeAtStart = time.perf_counter()
+    axis, positions, Time, Volts = loadScan(scanDir, workers)
+    integrals, noise = integrateScan(Time, Volts, **integrationSettings)
+    steps = micronsPerStep * (positions - positions[0])
+
+    results = {'folder' : scanDir, 'axis' : axis, 'positions' : positions, 'steps' : steps,
+               'integrals' : integrals, 'noise' : noise, 'fits' : []}
+    if dual:
+        split = splitEdges(integrals)
+        edges = [slice(0, split), slice(split - 1, len(steps))]
+    else:
+        edges = [slice(0, len(steps))]
+    for edge in edges:
+        try:
+            results['fits'].append(fitEdge(steps[edge], integrals[edge], noise[edge]))
+        except (RuntimeError, ValueError, TypeError) as e:
+            print("Fit failed for " + str(scanDir) + ": " + str(e))
+            results['fits'].append(None)
+
+    results['time'] = time.perf_counter() - timeAtStart
+    return results
+
+def printSummary(results):
+    print(str(results['folder']) + " (" + results['axis'] + ", " + str(len(results['steps'])) + " files, {0:.2f} s)".format(results['time']))
+    for i, fit in enumerate(results['fits']):
+        if fit is None:
+            print("  edge {0}: fit failed".format(i))
+        else:
+            print("  edge {0}: mean = {1:.2f} +- {2:.2f} um, sigma = {3:.3f} +- {4:.3f} um, chi^2 per dof = {5:.3f}".format(
+                i, fit['mean'], fit['meanError'], fit['sigma'], fit['sigmaError'], fit['chi2dof']))
+
+def writeSummary(results, path):
+    #One line per edge, appended so a whole batch of folders ends up in one file
+    newFile = not os.path.exists(path)
+    with open(path, 'a') as f:
+        if newFile:
+            f.write("folder,axis,edge,mean,meanError,sigma,sigmaError,chi2dof\n")
+        for i, fit in enumerate(results['fits']):
+            if fit is not None:
+                f.write("{0},{1},{2},{3},{4},{5},{6},{7}\n".format(results['folder'], results['axis'], i,
+                        fit['mean'], fit['meanError'], fit['sigma'], fit['sigmaError'], fit['chi2dof']))
+
+
+if __name__ == '__main__':
+    dual = "--dual" in sys.argv
+    folders = [a for a in sys.argv[1:] if a != "--dual"]
+    if len(folders) == 0:
+        print(__doc__)
+        sys.exit(1)
+    for folder in folders:
+        results = analyseScan(folder, dual)
+        printSummary(results)
+        writeSummary(results, os.path.join(folder, "SCurveSummary.csv"))
@@ -6,6 +6,8 @@
 from Interfaces import GPIB
 from Interfaces import Serial
 from Interfaces import Socket
+from Read_Write_Files.Read_FastOsc_Output import FastOscHeader
+from Read_Write_Files.Read_FastOsc_Output import Write_XYFormat_Background
 from math import fabs
 import numpy as np
 import time
@@ -768,8 +770,8 @@ class KeysightE4980AL(GPIB):
 
     def openCorrection(self):
         self.sendCommandWriteOnly(':CORR:OPEN:EXEC')
-        time.sleep(35.)
-        #return True
+        # Wait for the correction measurement to finish rather than a fixed 35 s
+        return self.waitForCompletion(60000)
 
     def openCorrectionToggle(self,state):
         if state == 'on':
@@ -789,8 +791,8 @@ class KeysightE4980AL(GPIB):
 
     def shortCorrection(self): #doSCTrim
         self.sendCommandWriteOnly(':CORR:SHOR:EXEC')
-        time.sleep(35.)
-        #return True
+        # Wait for the correction measurement to finish rather than a fixed 35 s
+        return self.waitForCompletion(60000)
 
     def readCapacitance(self):
         self.sendCommandWriteOnly(':TRIG:IMM')
@@ -1069,11 +1071,13 @@ class AgilentMSO9254A():
     
     device = None
     visaName = ""
+    waveformFormat = ""
     #def __init__(self, port, compliance, average = 1):
         #super(Keithley6517, self).__init__(port)t)
 
     def __init__(self, _visaName):
         self.visaName = _visaName
+        self.waveformFormat = ""
 
     def setup(self):
         rm = visa.ResourceManager()
@@ -1163,6 +1167,225 @@ class AgilentMSO9254A():
             print(e)
             return False
 
+    #Direct (binary) waveform transfer over VISA.
+    #Rather than asking the scope to write a .csv to disk and then reading it back over the
+    #network share, the raw ADC codes are pulled with :WAVeform:DATA? and scaled using the
+    #preamble. The returned array has the same column layout as the .csv files (time, then
+    #one column per channel) so the analysis code does not care where the data came from
+
+    def setupWaveformTransfer(self, fmt = 'WORD'):
+        #WORD = 16 bit signed, BYTE = 8 bit signed (half the transfer but coarser)
+        self.device.write(':SYSTem:HEADer OFF')
+        self.device.write(':WAVeform:FORMat ' + str(fmt))
+        self.device.write(':WAVeform:BYTeorder LSBFirst')
+        self.device.write(':WAVeform:STReaming ON')
+        self.waveformFormat = fmt
+
+    def getDisplayedChannels(self):
+        #Equivalent of the "ALL" used by saveWaveformXY
+        channels = []
+        for channelNum in range(1, 5):
+            if int(self.device.query(':CHANnel' + str(channelNum) + ':DISPlay?')) == 1:
+                channels.append(channelNum)
+        return channels
+
+    def digitize(self, timeout = 10000):
+        #Single acquisition which only returns once it is complete, so no sleep is needed
+        oldTimeout = self.device.timeout
+        self.device.timeout = timeout
+        try:
+            self.device.write(':DIGitize')
+            self.device.query('*OPC?')
+        finally:
+            self.device.timeout = oldTimeout
+
+    def getWaveformPreamble(self, channelNum):
+        self.device.write(':WAVeform:SOURce CHANnel' + str(channelNum))
+        preamble = self.device.query(':WAVeform:PREamble?').strip().split(',')
+        #format, type, points, count, XInc, XOrg, XRef, YInc, YOrg, YRef, ...
+        return {'points' : int(float(preamble[2])),
+                'count'  : int(float(preamble[3])),
+                'xInc'   : float(preamble[4]),
+                'xOrg'   : float(preamble[5]),
+                'xRef'   : float(preamble[6]),
+                'yInc'   : float(preamble[7]),
+                'yOrg'   : float(preamble[8]),
+                'yRef'   : float(preamble[9])}
+
+    def getWaveformRaw(self, channelNum):
+        #Returns the preamble and the raw ADC codes for one channel
+        if self.waveformFormat == "":
+            self.setupWaveformTransfer()
+        preamble = self.getWaveformPreamble(channelNum)
+        datatype = 'h' if self.waveformFormat == 'WORD' else 'b'
+        raw = self.device.query_binary_values(':WAVeform:DATA?', datatype = datatype, is_big_endian = False, container = np.array)
+        return preamble, raw
+
+    def getWaveformData(self, channelNum):
+        #Returns the preamble and the scaled voltages for one channel
+        preamble, raw = self.getWaveformRaw(channelNum)
+        volts = ((raw - preamble['yRef']) * preamble['yInc']) + preamble['yOrg']
+        return preamble, volts
+
+    def _buildHeader(self, channels, preambles, points, count, scaled = False):
+        #FastOscHeader for a transfer of channels with one preamble per channel
+        #For raw codes (scaled = False) yOrg includes the yRef offset, so volts = codes * yInc + yOrg
+        header = FastOscHeader()
+        header.channels = ['Channel ' + str(c) for c in channels]
+        header.yUnits = 'Volt'
+        header.xUnits = 'Second'
+        header.frame = 'MSO9254A'
+        header.date = time.strftime('%d %b %Y').upper()
+        header.time = time.strftime('%H:%M:%S')
+
+        for preamble in preambles:
+            header.yInc.append(preamble['yInc'])
+            if scaled:
+                header.yOrg.append(preamble['yOrg'])
+            else:
+                header.yOrg.append(preamble['yOrg'] - (preamble['yRef'] * preamble['yInc']))
+
+        header.points = points
+        header.count = count
+        header.xInc = preambles[-1]['xInc']
+        header.xOrg = preambles[-1]['xOrg'] - (preambles[-1]['xRef'] * preambles[-1]['xInc'])
+        return header
+
+    def getWaveformsRaw(self, channels = None):
+        #Returns (success, header, codes) with codes as (points, channels) 16 bit integers
+        #The header yOrg includes the yRef offset, so volts = codes * yInc + yOrg (the EventStore convention)
+        try:
+            if channels is None:
+                channels = self.getDisplayedChannels()
+
+            preambles = []
+            columns = []
+            for channelNum in channels:
+                preamble, raw = self.getWaveformRaw(channelNum)
+                preambles.append(preamble)
+                columns.append(raw)
+
+            points = min([len(c) for c in columns])
+            header = self._buildHeader(channels, preambles, points, preamble['count'])
+
+            codes = np.empty((points, len(channels)), dtype = np.int16)
+            for i in range(len(columns)):
+                codes[:, i] = columns[i][:points]
+
+        except Exception as e:
+            print("getWaveformsRaw() failed with exception: ")
+            print(e)
+            return False, None, None
+
+        return True, header, codes
+
+    def getWaveforms(self, channels = None, dtype = np.float64):
+        #Returns (success, header, data) like Read_XYFormatWithHeader
+        #data[:,0] is time, data[:,i] is channels[i-1]
+        try:
+            if channels is None:
+                channels = self.getDisplayedChannels()
+
+            preambles = []
+            columns = []
+            for channelNum in channels:
+                preamble, volts = self.getWaveformData(channelNum)
+                preambles.append(preamble)
+                columns.append(volts)
+
+            #All channels come from the same acquisition, but trim to be safe
+            points = min([len(c) for c in columns])
+            header = self._buildHeader(channels, preambles, points, preamble['count'], scaled = True)
+
+            data = np.empty((points, len(channels) + 1), dtype = dtype)
+            data[:, 0] = header.getTimeAxis()
+            for i in range(len(columns)):
+                data[:, i + 1] = columns[i][:points]
+
+        except Exception as e:
+            print("getWaveforms() failed with exception: ")
+            print(e)
+            return False, None, None
+
+        return True, header, data
+
+    def acquireWaveforms(self, channels = None, archivePath = None, dtype = np.float64):
+        #Trigger, wait for the acquisition and transfer it. Replaces the old
+        #singleMeasurement(), sleep, saveWaveformXY(), sleep, Read_XYFormat() sequence.
+        #If archivePath is given the waveform is also written to archivePath + ".csv"
+        #on a background thread, in the same format the scope would have saved it
+        self.digitize()
+        success, header, data = self.getWaveforms(channels, dtype)
+        if success and archivePath is not None:
+            Write_XYFormat_Background(archivePath, ".csv", header, data)
+        return success, data
+
+    #Segmented memory acquisition.
+    #The scope arms nSegments triggers in one go and stores each one in its own segment of memory, so there is
+    #no save or re-arm between hits. All the segments of a channel then come back in one :WAVeform:DATA? transfer,
+    #along with the trigger time tag of every segment
+
+    def setupSegmented(self, nSegments, points = None):
+        self.device.write(':ACQuire:MODE SEGMented')
+        self.device.write(':ACQuire:SEGMented:COUNt ' + str(int(nSegments)))
+        if points is not None:
+            self.device.write(':ACQuire:POINts:ANALog ' + str(int(points)))
+        self.device.write(':WAVeform:SEGMented:ALL ON')
+
+    def setupRealTime(self):
+        #Back to normal single waveform acquisitions
+        self.device.write(':WAVeform:SEGMented:ALL OFF')
+        self.device.write(':ACQuire:MODE RTIMe')
+
+    def getSegmentCount(self):
+        return int(float(self.device.query(':WAVeform:SEGMented:COUNt?')))
+
+    def getSegmentTimeTags(self):
+        #Trigger time of every segment relative to the first one (s)
+        return np.array([float(t) for t in self.device.query(':WAVeform:SEGMented:XLISt? TTAG').strip().split(',') if t.strip() != ""])
+
+    def getSegments(self, channels = None):
+        #Returns (success, header, codes, timeTags) for the segments in memory
+        #codes is (segments, points, channels) 16 bit integers with volts = codes * yInc + yOrg (as getWaveformsRaw)
+        try:
+            if channels is None:
+                channels = self.getDisplayedChannels()
+            nSegments = self.getSegmentCount()
+            if nSegments == 0:
+                return False, None, None, None
+
+            preambles = []
+            columns = []
+            for channelNum in channels:
+                preamble, raw = self.getWaveformRaw(channelNum)
+                preambles.append(preamble)
+                columns.append(raw)
+
+            points = min([len(c) for c in columns]) // nSegments
+            header = self._buildHeader(channels, preambles, points, nSegments)
+
+            codes = np.empty((nSegments, points, len(channels)), dtype = np.int16)
+            for i in range(len(columns)):
+                codes[:, :, i] = columns[i][:nSegments * points].reshape(nSegments, points)
+
+            timeTags = self.getSegmentTimeTags()[:nSegments]
+
+        except Exception as e:
+            print("getSegments() failed with exception: ")
+            print(e)
+            return False, None, None, None
+
+        return True, header, codes, timeTags
+
+    def acquireSegments(self, channels = None, timeout = 600000):
+        #Arm all the segments, wait once for them to fill, then transfer them all
+        #If they have not all filled within timeout (ms), stop and return the ones which have
+        try:
+            self.digitize(timeout)
+        except visa.errors.VisaIOError:
+            self.device.write(':STOP')
+        return self.getSegments(channels)
+
     #def shutdown(self):
     #    self.close()
     
@@ -1207,6 +1430,8 @@ class XilabController():
     deviceID_2 = -1
     deviceID_3 = -1
     visaName = ""
+    #In 100um, there are 40 steps and 16 micro steps. Pre-measured calibration (fairly consistent)
+    steps_per_micron = 0.400625
     #def __init__(self, port, compliance, average = 1):
         #super(Keithley6517, self).__init__(port)t)
 
@@ -1409,13 +1634,10 @@ class XilabController():
         #Given a pre-measured calibration (fairly consistent)
         #Assuming 256 usteps in 1 step
         
-        #In 100um, there are 40 steps and 16 micro steps
-        steps_per_micron = 0.400625
-        
         unsigned_distance = np.abs(distance)
         sign_distance = np.sign(distance)
         
-        total_steps = unsigned_distance * steps_per_micron
+        total_steps = unsigned_distance * self.steps_per_micron
         pure_steps = int(total_steps)
         decimal_steps = total_steps - pure_steps
         micro_steps = int(decimal_steps * 256)
@@ -1426,6 +1648,60 @@ class XilabController():
         steps, usteps = self.calc_steps(distance)
         self.move_to(device_id, steps, usteps)
         
+    def calc_microns(self, steps, usteps):
+        #Inverse of calc_steps. Assuming 256 usteps in 1 step
+        return (steps + (usteps / 256.0)) / self.steps_per_micron
+    
+    def is_moving(self, device_id):
+        x_status = status_t()
+        result = self.device.get_status(device_id, byref(x_status))
+        if result != Result.Ok:
+            #Can't tell, so fall back on the blocking wait for this axis
+            self.wait_for_stop(device_id, 100)
+            return False
+        return bool(x_status.MvCmdSts & MvcmdStatus.MVCMD_RUNNING) or bool(x_status.MoveSts & MoveState.MOVE_STATE_MOVING)
+    
+    def wait_for_stop_all(self, device_ids, interval = 100, suppressPrint = True):
+        #Poll the status of every axis together until none of them are moving (interval in ms)
+        if not suppressPrint: print("\nWaiting for stop on {0} axes".format(len(device_ids)))
+        moving = list(device_ids)
+        while len(moving) > 0:
+            moving = [device_id for device_id in moving if self.is_moving(device_id)]
+            if len(moving) > 0:
+                time.sleep(interval / 1000.0)
+    
+    def get_position_microns(self, device_id):
+        x_pos = get_position_t()
+        result = self.device.get_position(device_id, byref(x_pos))
+        if result != Result.Ok:
+            return None
+        return self.calc_microns(x_pos.Position, x_pos.uPosition)
+    
+    def get_position_xy(self, include_z = False):
+        #Combined position readback (in um) of the x, y (and z) axes
+        device_ids = [self.deviceID_1, self.deviceID_2] + ([self.deviceID_3] if include_z else [])
+        return tuple([self.get_position_microns(device_id) for device_id in device_ids])
+    
+    def move_to_xy(self, x_um, y_um, z_um = None, interval = 100, readback = False, suppressPrint = True):
+        #Start every axis moving before waiting on any of them, so a diagonal move
+        #takes as long as the longest axis rather than the sum of the axes
+        if not suppressPrint: print("\nGoing to x = {0}, y = {1}, z = {2} um".format(x_um, y_um, z_um))
+        device_ids = [self.deviceID_1, self.deviceID_2]
+        self.move_to_microns(self.deviceID_1, x_um)
+        self.move_to_microns(self.deviceID_2, y_um)
+        if z_um is not None:
+            self.move_to_microns(self.deviceID_3, z_um)
+            device_ids.append(self.deviceID_3)
+        self.wait_for_stop_all(device_ids, interval)
+        if readback:
+            return self.get_position_xy(z_um is not None)
+    
+    def return_home_xy(self, interval = 100):
+        #Both axes back to zero together
+        self.move_to(self.deviceID_1, 0, 0)
+        self.move_to(self.deviceID_2, 0, 0)
+        self.wait_for_stop_all([self.deviceID_1, self.deviceID_2], interval)
+        
     def return_home(self, device_id):
         steps, usteps = self.get_position(device_id, suppressPrint = True)
         #self.move(device_id, -steps, -usteps)
@@ -76,52 +76,133 @@ class Socket(object):
 
 class GPIB(object):
 
-    __slots__ = ['device_id', 'rm', 'response']
+    # One VISA session is kept open for the lifetime of the instrument. It is only torn down and
+    # re-opened (reconnect) after an actual VISA I/O error, rather than after every transaction.
+    # The device is cleared on reconnect, so a late reply to a timed-out query is not read as the
+    # answer to the next one. Only pure queries are re-sent after an error, since writes (triggers,
+    # :DIGitize, stage or voltage steps) must not be executed twice.
+    # Completion of slow operations is detected with *OPC? (or a service request) instead of sleeping.
+    # Per-command latency is recorded in self.latency as {command header: [count, total s, max s]}
 
-    def __init__(self, device_id = None):
+    __slots__ = ['device_id', 'rm', 'response', 'timeout', 'latency']
+
+    def __init__(self, device_id = None, timeout = 5000):
         super(GPIB, self).__init__()
         self.device_id = device_id
         self.rm        = None
         self.response  = None
+        self.timeout   = timeout # ms
+        self.latency   = {}
 
     def open(self, device_id = None):
         if device_id is not None:
             self.device_id = device_id
         # See: https://stackoverflow.com/questions/51520737/pyvisa-attributeerror-nivisalibrary-object-has-no-attribute-viparsersrcex
         self.rm = pyvisa.ResourceManager().open_resource(self.device_id)
+        self.rm.timeout = self.timeout
 
     def close(self):
-        self.rm.close()
+        if self.rm is not None:
+            self.rm.close()
         self.rm = None
-
-    def sendCommand(self, command, wait_for = 5, converter = 's'): #wait_for = 0.1
+        if len(self.latency) > 0:
+            self.printLatency()
+
+    def reconnect(self):
+        print('WARNING :: VISA I/O error on {0}, reconnecting'.format(self.device_id))
+        try:
+            self.rm.close()
+        except Exception:
+            pass
+        self.open()
+        # Device clear: drops a pending reply and any half-parsed command in the instrument
+        self.rm.clear()
+
+    def setTimeout(self, timeout):
+        self.timeout = timeout
+        if self.rm is not None:
+            self.rm.timeout = timeout
+
+    @staticmethod
+    def isQuery(command):
+        # A single query without side effects, e.g. ':MEAS:VOLT?' but not ':DIG;*OPC?'
+        command = command.strip()
+        return ';' not in command and command.split(' ')[0].endswith('?')
+
+    def transaction(self, command, function, repeat = False):
+        # Runs function() (which talks to self.rm) and records how long it took.
+        # On an I/O error the session is re-opened. The command is only tried once more
+        # if repeat is set, i.e. it is safe to execute twice; otherwise the error is raised
+        start = time.perf_counter()
+        try:
+            result = function()
+        except pyvisa.errors.VisaIOError:
+            self.reconnect()
+            if not repeat:
+                raise
+            result = function()
+        self.recordLatency(command, time.perf_counter() - start)
+        return result
+
+    def recordLatency(self, command, elapsed):
+        # Key on the command header only, so ':SOUR:VOLT 10' and ':SOUR:VOLT 20' are counted together
+        key = command.strip().split(' ')[0]
+        if key not in self.latency:
+            self.latency[key] = [0, 0., 0.]
+        entry = self.latency[key]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+    def resetLatency(self):
+        self.latency = {}
+
+    def printLatency(self):
+        print('Command latency for {0}:'.format(self.device_id))
+        print('  {0:<30} {1:>7} {2:>10} {3:>10} {4:>10}'.format('command', 'count', 'total [s]', 'mean [ms]', 'max [ms]'))
+        for key, (count, total, maximum) in sorted(self.latency.items(), key = lambda item: -item[1][1]):
+            print('  {0:<30} {1:>7d} {2:>10.3f} {3:>10.2f} {4:>10.2f}'.format(key, count, total, 1000. * total / count, 1000. * maximum))
+
+    def sendCommand(self, command, wait_for = 0, converter = 's'):
         # See: https://docs.python.org/2/library/string.html#formatspec
-        self.response = self.rm.query_ascii_values(command + '\n', converter = converter)
-        time.sleep(wait_for)
-        # We close and re-open the resource manager to allow us to send more commands (hacky?)
-        # --> TODO: fix this!
-        self.rm.close()
-        self.rm.open()
+        # The query only returns once the instrument has replied, so no wait is needed by default
+        self.response = self.transaction(command, lambda: self.rm.query_ascii_values(command + '\n', converter = converter),
+                                         repeat = self.isQuery(command))
+        if wait_for > 0:
+            time.sleep(wait_for)
 
     def sendCommandWriteOnly(self,command):
-        self.rm.write(command)
-        self.rm.close()
-        self.rm.open()
+        self.transaction(command, lambda: self.rm.write(command))
 
     def sendCommandWriteRead(self,command):
-        self.rm.write(command)
-        self.response = self.rm.read()
-        self.rm.close()
-        self.rm.open()
-
-    def sendCommandWithWait(self, command):
-        self.rm.timeout = 60000
-        self.rm.write(command + '\n')
-        response = self.rm.read('\n')
-        self.rm.timeout = 5000
-        self.rm.close()
-        self.rm.open()
-        return response
+        self.response = self.transaction(command, lambda: self.rm.query(command), repeat = self.isQuery(command))
+
+    def sendCommandWithWait(self, command, timeout = 60000):
+        # For slow queries (e.g. trims/corrections), temporarily raise the timeout
+        def writeRead():
+            self.rm.timeout = timeout
+            try:
+                self.rm.write(command + '\n')
+                return self.rm.read('\n')
+            finally:
+                self.rm.timeout = self.timeout
+        return self.transaction(command, writeRead, repeat = self.isQuery(command))
+
+    def waitForCompletion(self, timeout = 60000):
+        # Blocks until all pending operations have finished (*OPC? returns 1)
+        return self.sendCommandWithWait('*OPC?', timeout).strip() == '1'
+
+    def sendCommandAndWaitSRQ(self, command, timeout = 60000):
+        # Alternative to waitForCompletion that does not hold the bus while waiting:
+        # the instrument asserts a service request when *OPC sets the operation complete bit
+        def writeAndWait():
+            self.rm.write('*CLS')
+            self.rm.write('*ESE 1')
+            self.rm.write('*SRE 32')
+            self.rm.write(command + ';*OPC')
+            self.rm.wait_for_srq(timeout)
+            self.rm.write('*CLS')
+        self.transaction(command, writeAndWait)
 
     def getData(self):
         return self.response
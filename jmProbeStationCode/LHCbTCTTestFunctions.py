@@ -5,9 +5,12 @@
 
 import sys, os, time
 from Read_Write_Files.Read_FastOsc_Output import Read_XYFormat
+from Read_Write_Files.EventStore import EventStoreWriter
+from ScanEngine import ScanEngine, ScanResults, linearScanPoints, coordinateListPoints, adaptiveEdgeSearch
 from Read_Write_Files.Write_Plt_Format import  Write_StandardPltFormat
 from Read_Write_Files.Write_Plt_Format import  Read_StandardPltFormat
 from Mathematical_Analysis.Interpolation import linearInterpolation_2pT
+from Mathematical_Analysis.PulseFeatures import pulseFeatures
 from Sorting_Algorithms.MultidimentionalArraySort import d2SortX
 
 from Plots import IVTimePlot as TimePlot
@@ -529,7 +532,44 @@ def jmRecordPulses(myOSC, save_folder,ps,Voltages,Imax,InitCurrentRange,full_ste
     
     return status
     
-def jmCollectHits(myOSC, save_folder, runTime):
+def storeEvent(myOSC, channels, eventStore, eventStorePath, biasVoltage, count, temperature = float('nan')):
+    #Appends the waveform sitting in the scope memory to the event store (opened on the first event)
+    #Returns the store and the waveform in the Read_XYFormat layout (None if it could not be read) for any quick checks
+    success, header, codes = myOSC.getWaveformsRaw(channels)
+    if not success:
+        print("Event " + str(count) + " could not be read from the scope")
+        return eventStore, None
+    if eventStore is None:
+        eventStore = EventStoreWriter(eventStorePath, header.channels, header.points, header.xInc, header.xOrg)
+    eventStore.append(codes, header.yInc, header.yOrg, biasVoltage = biasVoltage, triggerCount = count, temperature = temperature)
+    data = np.empty((header.points, len(channels) + 1))
+    data[:, 0] = header.getTimeAxis()
+    data[:, 1:] = (codes * np.array(header.yInc)) + np.array(header.yOrg)
+    return eventStore, data
+
+def storeSegments(myOSC, channels, eventStore, eventStorePath, biasVoltage, count, temperature = float('nan')):
+    #Segmented mode (myOSC.setupSegmented): waits once for every segment to fill, pulls them all in one transfer
+    #and appends them to the event store (if eventStorePath is given) with trigger counts following on from count.
+    #Timestamps come from the scope trigger time tags, relative to when the transfer finished.
+    #Returns the store, the time axis and the volts (segments, points, channels) or None if nothing could be read
+    success, header, codes, timeTags = myOSC.acquireSegments(channels)
+    timeAtEnd = time.time()
+    if not success:
+        print("Segments after event " + str(count) + " could not be read from the scope")
+        return eventStore, None, None
+    nSegments = codes.shape[0]
+    if len(timeTags) != nSegments:
+        timeTags = np.zeros(nSegments)
+    if eventStorePath is not None:
+        if eventStore is None:
+            eventStore = EventStoreWriter(eventStorePath, header.channels, header.points, header.xInc, header.xOrg)
+        for i in range(nSegments):
+            eventStore.append(codes[i], header.yInc, header.yOrg, timestamp = timeAtEnd - (timeTags[-1] - timeTags[i]),
+                              biasVoltage = biasVoltage, triggerCount = count + i + 1, temperature = temperature)
+    volts = (codes * np.array(header.yInc)) + np.array(header.yOrg)
+    return eventStore, header.getTimeAxis(), volts
+
+def jmCollectHits(myOSC, save_folder, runTime, eventStorePath = None, biasVoltage = float('nan'), segments = None):
     #So some assumptions for this test measurement:
     #That the oscilloscope is setup auto triggering and all your settings are as you want them
     #All we need to do is set to single trigger mode
@@ -537,12 +577,18 @@ def jmCollectHits(myOSC, save_folder, runTime):
     #Record the data
     #Move onto next voltage (but for now we will just test the saving aspect
     
+    #If eventStorePath is given (a path on this PC) every event is pulled straight from the scope memory and appended
+    #to one binary event store (Read_Write_Files/EventStore.py) instead of one CSV per event saved on the scope
+    #With segments = N as well the scope is put in segmented memory mode and N events are taken per transfer
+    #(no re-arming between triggers), so the dead time between hits is only the scope's own re-arm time
+    
     status=0 #0=success, 1=fail
     
     print("Setup complete- beginning test")
     comment = ""
 
     errorThrown = False
+    eventStore = None
 
     try:
     
@@ -550,15 +596,31 @@ def jmCollectHits(myOSC, save_folder, runTime):
         #(I don't think it overwrites anything, but we are only doing this once 
         #at the start anyway
         #We have to do each folder separately
-        myOSC.mkdir(save_folder)
-        myOSC.mkdir(save_folder + '\\Data\\')
-        myOSC.mkdir(save_folder + '\\Images\\')
+        if eventStorePath is None:
+            myOSC.mkdir(save_folder)
+            myOSC.mkdir(save_folder + '\\Data\\')
+            myOSC.mkdir(save_folder + '\\Images\\')
+        else:
+            channels = myOSC.getDisplayedChannels()
+
+        #Set to a non zero value if you want to continue from a previous run
+        count = 0;
+
+        if segments is not None:
+            if eventStorePath is None:
+                raiseError("Segmented acquisition needs an eventStorePath to save the events to")
+            myOSC.setupSegmented(segments)
+            #This will run on  continuous loop until you press Ctrl-C in the terminal to cancel it
+            while(True):
+                eventStore, Time, volts = storeSegments(myOSC, channels, eventStore, eventStorePath, biasVoltage, count)
+                if volts is None:
+                    continue
+                count = count + volts.shape[0]
+                print("Event_" + str(count).zfill(6) + "_Captured (" + str(volts.shape[0]) + " segments)")
 
         #This will run on  continuous loop until you press Ctrl-C in the terminal to cancel it
         myOSC.singleMeasurement()
         
-        #Set to a non zero value if you want to continue from a previous run
-        count = 0;
         while(True):
         
             #Cheeck if single measurement has been made
@@ -571,11 +633,14 @@ def jmCollectHits(myOSC, save_folder, runTime):
 
                 print("Event_" + str(countStr) + "_Captured")
                 
-                fileName = save_folder + '\\Data\\Event_' + str(countStr)
-                myOSC.saveWaveformXY(fileName)
-                
-                time.sleep(0.5) #Need to allow the OSC to perform this action 
-                #time.sleep(1.0)
+                if eventStorePath is None:
+                    fileName = save_folder + '\\Data\\Event_' + str(countStr)
+                    myOSC.saveWaveformXY(fileName)
+                    
+                    time.sleep(0.5) #Need to allow the OSC to perform this action 
+                    #time.sleep(1.0)
+                else:
+                    eventStore, data = storeEvent(myOSC, channels, eventStore, eventStorePath, biasVoltage, count)
                 
                 ########## NOTE THAT THE INFINIIUM MUST BE ON DISPLAY FOR THIS TO WORK ##########
                 #fileName = save_folder + '\\Images\\Event_' + str(countStr)
@@ -592,16 +657,23 @@ def jmCollectHits(myOSC, save_folder, runTime):
 
             comment = ""
      
+    except KeyboardInterrupt:
+        #Ctrl-C is how this run is stopped, so it is not a failure
+        print("Keyboard Interrupt")
     except Exception as e:
         print(e)
         status=1
 
+    if eventStore is not None:
+        eventStore.close()
+    if segments is not None:
+        myOSC.setupRealTime()
     
     print('Measurement finished at: {0}.'.format(time.strftime('%Y/%m/%d-%H:%M:%S')))
     
     return status
 
-def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
+def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime, eventStorePath = None, segments = None):
     #So some assumptions for this test measurement:
     #That the oscilloscope is setup auto triggering and all your settings are as you want them
     #All we need to do is set to single trigger mode
@@ -609,6 +681,8 @@ def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
     #Record the data
     #Move onto next voltage (but for now we will just test the saving aspect
     
+    #segments = N (with an eventStorePath) takes N events per transfer in the scope's segmented memory mode
+    
     voltageTolerance=0.01 #V
     rampDownStep=5.0 #V
     rampDownWait=0.25 #s #Used to be 0.5, but the LabView used 0.1. Which is 5 times faster...
@@ -624,9 +698,14 @@ def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
     comment = ""
 
     errorThrown = False
+    eventStore = None
 
     try:
     
+        if segments is not None:
+            if eventStorePath is None:
+                raiseError("Segmented acquisition needs an eventStorePath to save the events to")
+            myOSC.setupSegmented(segments)
     
         voltageCheck=float(ps.readVoltageAndCurrent()[0])
             #if fabs(float(Vstart)-float(voltageCheck))>float(voltageTolerance):
@@ -652,10 +731,14 @@ def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
             
             specific_folder = save_folder + "\\Vbias_" + targetVoltageStr + "V"
             
-            myOSC.mkdir(save_folder)
-            myOSC.mkdir(specific_folder)
-            myOSC.mkdir(specific_folder + '\\Data\\')
-            myOSC.mkdir(specific_folder + '\\Images\\')          
+            if eventStorePath is None:
+                myOSC.mkdir(save_folder)
+                myOSC.mkdir(specific_folder)
+                myOSC.mkdir(specific_folder + '\\Data\\')
+                myOSC.mkdir(specific_folder + '\\Images\\')          
+            else:
+                #One store for the whole run, the bias voltage of each event is in its metadata
+                channels = myOSC.getDisplayedChannels()
 
             print("index = " + str(i) + "  (" + str(i+1) + " / " + str(len(Voltages)) + ")")
             print("Stepping to voltage",targetVoltage)
@@ -677,16 +760,28 @@ def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
                 raiseError("Measured voltage does not match that observed, aborting run")
 
             
-            #This will run on  continuous loop until you press Ctrl-C in the terminal to cancel it
-            myOSC.singleMeasurement() 
-            
-            
             timeAtStart = time.time()
             oldCount = count
             count = 0
             if i > 0:
                 if Voltages[i] == Voltages[i-1]:
                     count = oldCount
+
+            if segments is not None:
+                while(True):
+                    eventStore, Time, volts = storeSegments(myOSC, channels, eventStore, eventStorePath, float(voltage), count)
+                    if volts is not None:
+                        count = count + volts.shape[0]
+                    secondsLeft = runTime - fabs(time.time() - timeAtStart)
+                    minutesLeft = round(secondsLeft / 60)
+                    print("Vbias " + targetVoltageStr + "V: Event_" + str(count).zfill(6) + "_Captured   " + str(minutesLeft) + " minutes left")
+                    if secondsLeft < 0:
+                        break;
+                continue
+
+            #This will run on  continuous loop until you press Ctrl-C in the terminal to cancel it
+            myOSC.singleMeasurement() 
+            
             while(True):
             
                 #Cheeck if single measurement has been made
@@ -702,11 +797,14 @@ def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
 
                     print("Vbias " + targetVoltageStr + "V: Event_" + str(countStr) + "_Captured   " + str(minutesLeft) + " minutes left")
                     
-                    fileName = specific_folder + '\\Data\\Event_' + str(countStr)
-                    myOSC.saveWaveformXY(fileName)
-                    
-                    time.sleep(0.5) #Need to allow the OSC to perform this action 
-                    #time.sleep(1.0)
+                    if eventStorePath is None:
+                        fileName = specific_folder + '\\Data\\Event_' + str(countStr)
+                        myOSC.saveWaveformXY(fileName)
+                        
+                        time.sleep(0.5) #Need to allow the OSC to perform this action 
+                        #time.sleep(1.0)
+                    else:
+                        eventStore, data = storeEvent(myOSC, channels, eventStore, eventStorePath, float(voltage), count)
                     
                     ########## NOTE THAT THE INFINIIUM MUST BE ON DISPLAY FOR THIS TO WORK ##########
                     #fileName = save_folder + '\\Images\\Event_' + str(countStr)
@@ -728,10 +826,18 @@ def jmCollectHits_Fixed(myOSC, ps, Voltages, save_folder, runTime):
 
                 comment = ""
          
+    except KeyboardInterrupt:
+        print("Keyboard Interrupt")
+        status=1
     except Exception as e:
         print(e)
         status=1
 
+    if eventStore is not None:
+        eventStore.close()
+    if segments is not None:
+        myOSC.setupRealTime()
+
     RampDown(ps,rampDownStep,rampDownWait)
     ps.controlSource('off')
     
@@ -911,7 +1017,7 @@ def jmMeasureIV(ps,save_path,pltFormatFile,Voltages,Imax,InitCurrentRange,full_s
     return status
     
     
-def jmSpiralSearch(XlC, myOSC, linked_folder, save_folder):
+def jmSpiralSearch(XlC, myOSC, linked_folder, save_folder, channels = None, archiveCSV = False):
     #So some assumptions for this test measurement:
     #That the oscilloscope is setup auto triggering and all your settings are as you want them
     #All we need to do is set to single trigger mode
@@ -980,6 +1086,12 @@ def jmSpiralSearch(XlC, myOSC, linked_folder, save_folder):
     angleStep = 0.1 #degrees        
 
     try:
+        #The channels to pull from the scope. By default the ones on display, which is
+        #what saveWaveformXY used to write out (so data[:,1], data[:,2], ... are as before)
+        if channels is None:
+            channels = myOSC.getDisplayedChannels()
+        archivePath = save_folder if archiveCSV else None
+
         #We are now ready to begin moving the sensor around by increase x.
         
         x = 0 #Might as well start here as it can't be further than 500um until this point by very definition
@@ -1036,11 +1148,8 @@ def jmSpiralSearch(XlC, myOSC, linked_folder, save_folder):
             print("newX = {0}; newY = {1}".format(newX, newY))
                     
             #Movement
-            XlC.move_to_microns(XlC.deviceID_1, newX)            
-            XlC.move_to_microns(XlC.deviceID_2, newY)            
-            #We should be able to move both axes at once
-            XlC.wait_for_stop(XlC.deviceID_1, 100)            
-            XlC.wait_for_stop(XlC.deviceID_2, 100)
+            #Both axes move at once, so this takes as long as the longest axis
+            XlC.move_to_xy(newX, newY)
             
             
             overVoltageThreshold = 40e-3 #V
@@ -1052,23 +1161,11 @@ def jmSpiralSearch(XlC, myOSC, linked_folder, save_folder):
             
             #Run a loop until we get a valid waveform
             while True:
-                #Measurement            
-                myOSC.singleMeasurement()
-                time.sleep(0.2) #Need to allow the OSC to perform this action                            
-                
-                fileName = linked_folder
-                print("fileName = " + str(fileName))
-                myOSC.saveWaveformXY(fileName)                       
-                
-                time.sleep(1) #Need to allow the OSC to perform this action                            
-                
-                
-                #Analysis
-
-                startIndex = 24
-                success = False                
+                #Measurement. The waveform is transferred straight over VISA (no save to disk and re-read)
+                #If archiveCSV is set a copy is written to save_folder.csv in the background
+                success = False
                 while not success:
-                    success, data = Read_XYFormat(save_folder, ".csv", False, startIndex)
+                    success, data = myOSC.acquireWaveforms(channels, archivePath)
                 Time = data[:,0]
                 trigVolt = data[:,1]
                 Volt = data[:,2]
@@ -1103,20 +1200,14 @@ def jmSpiralSearch(XlC, myOSC, linked_folder, save_folder):
                 print("")
                 print("LASER ALIGNMENT FAILED")
                 print("Maximum search radius reached")
-                XlC.return_home(XlC.deviceID_1)
-                XlC.return_home(XlC.deviceID_2)
-                XlC.wait_for_stop(XlC.deviceID_1, 100)            
-                XlC.wait_for_stop(XlC.deviceID_2, 100)
+                XlC.return_home_xy()
                 status=1
                 break;
                 
             print("Sufficient signal not found ({0} vs {1}). Moving to next position".format(minVolt, validSignalThreshold))         
     except KeyboardInterrupt:
         print ("Keyboard Interruption. Returning home")
-        XlC.return_home(XlC.deviceID_1)
-        XlC.return_home(XlC.deviceID_2)
-        XlC.wait_for_stop(XlC.deviceID_1, 100)            
-        XlC.wait_for_stop(XlC.deviceID_2, 100)
+        XlC.return_home_xy()
         status=1
     except Exception as e:
         print(e)
@@ -1165,7 +1256,7 @@ def jmFineSearch2Dx2(XlC, myOSC, linked_folder, save_folder, scan_folder):
 
     return status
 
-def mmChaosSearch(XlC, myOSC, linked_folder, save_folder, coords):
+def mmChaosSearch(XlC, myOSC, linked_folder, save_folder, coords, channels = None, archiveCSV = False):
     """
     coords is a list of coordinates that need to be searched
 
@@ -1189,6 +1280,11 @@ def mmChaosSearch(XlC, myOSC, linked_folder, save_folder, coords):
     errorThrown = False
 
     try:
+        #The channels to pull from the scope. By default the ones on display, which is
+        #what saveWaveformXY used to write out (so data[:,1], data[:,2], ... are as before)
+        if channels is None:
+            channels = myOSC.getDisplayedChannels()
+        archivePath = save_folder if archiveCSV else None
 
         integrals = []
         heights = []
@@ -1200,97 +1296,38 @@ def mmChaosSearch(XlC, myOSC, linked_folder, save_folder, coords):
         XlC.set_zero_pos(XlC.deviceID_1)
         XlC.set_zero_pos(XlC.deviceID_2)
 
-        #print(f"moving to first coordinate ({coords[0][0]}, {coords[0][1]}) from (0, 0) home which you have jmLaserAligned")
-        XlC.move_to_microns(XlC.deviceID_1, coords[0][0])  #x                     
-        XlC.wait_for_stop(XlC.deviceID_1, 100)
-        XlC.move_to_microns(XlC.deviceID_2, coords[0][1])  #y                     
-        XlC.wait_for_stop(XlC.deviceID_2, 100)
-
-        for i in range(0, len(coords)):
-            #skip the first coordinate as we shoul already be there
-            #coords is a list of coordinated (x, y)
-            print(f"moving to coordinate, ({coords[i][0]}, {coords[i][1]})")
-            #how much the stage needs to move in x to get to new target (like a vector translation here)
-            XlC.move_to_microns(XlC.deviceID_1, coords[i][0])                        
-            XlC.wait_for_stop(XlC.deviceID_1, 100)
-            #how much the stage needs to move in y to get to new target
-            XlC.move_to_microns(XlC.deviceID_2, coords[i][1])                       
-            XlC.wait_for_stop(XlC.deviceID_2, 100)
-            #now we are at the correct coord, take the wave form and calc integral
-                
-            repeats_at_each_loc = 5
-            
-            avg_integral_list = []
-            avg_height_list = []
-             
-            for i in range(0, repeats_at_each_loc):
-                
-                print(f"repeat number: {i}")
-                
-                while True:           
-                    myOSC.singleMeasurement()
-                    time.sleep(0.2) #Need to allow the OSC to perform this action                            
-                    
-                    fileName = linked_folder
-                    print("fileName = " + str(fileName))
-                    myOSC.saveWaveformXY(fileName)                       
-                    
-                    time.sleep(2) #Need to allow the OSC to perform this action                            
-                    
-                    #Analysis
-                    startIndex = 24
-                    success = False                
-                    while not success:
-                        success, data = Read_XYFormat(save_folder, ".csv", False, startIndex)
-                    Time = data[:,0]
-                    trigVolt = data[:,1]
-                    Volt = data[:,2]
-                    bmVolt = data[:,3]
-
-                    #Check that the signal is valid. If the voltage goes too high (positive)
-                    #Then we need to retake the waveform
-                    if max(Volt) < overVoltageThreshold:          
-                        break
-                    print("Overvoltage Found. Retaking Waveform")
+        repeats_at_each_loc = 5
 
-                    #If we made it this far, perform the analysis
-                    #Calculate integral and move on
-                                
-                #Firstly find the minimum
-                minVolt = min(Volt)
-                timeAtMin = 0
-                for j in range(len(Time)):
-                    if Volt[j] == minVolt:
-                        timeAtMin = Time[j]
-                        break
-                        
-                #Then define an area around it to integrate (sufficiently large)
-                timeBefore = 5e-9 #20e-9
-                timeAfter = 10e-9 #20e-9
-                #change these based on just how the waveform looks roughly
-                #We could be more refined, but I think it's fine to be coarse (also see how this goes with tests)
-                timeStep = Time[1] - Time[0]
-                startTime = timeAtMin - timeBefore
-                endTime = timeAtMin + timeAfter
-                integral = 0
-                for j in range(len(Time)):
-                    if Time[j] > startTime:
-                        if Time[j] < endTime:
-                            integral = integral + (timeStep * Volt[j])
-                
-                avg_integral_list.append(integral)
-                avg_height_list.append(-min(Volt))
-                
-            #END FOR LOOP HERE
-            
-            #calculate average integral
-            avg_integral = sum(avg_integral_list)/repeats_at_each_loc
-            avg_height = sum(avg_height_list)/repeats_at_each_loc
-            
+        def analyse(data):
+            #Define an area around the minimum to integrate (sufficiently large)
+            #change these based on just how the waveform looks roughly
+            timeBefore = 5e-9 #20e-9
+            timeAfter = 10e-9 #20e-9
+            features = pulseFeatures(data[:,0], data[:,2], -1, timeBefore, timeAfter)
+
+            #Check that the signal is valid. If the voltage goes too high (positive)
+            #Then we need to retake the waveform
+            if features['maxVolt'] >= overVoltageThreshold:
+                print("Overvoltage Found. Retaking Waveform")
+                return None
+
+            return {'integral' : features['integral'], 'height' : features['height']}
+
+        #The ScanEngine starts the move to the next coordinate while the last waveform is transferred and analysed
+        #coords is a list of coordinated (x, y)
+        engine = ScanEngine(XlC, myOSC, [XlC.deviceID_1, XlC.deviceID_2], analyse, channels, ['x', 'y'], repeats = repeats_at_each_loc, archivePath = archivePath)
+        results = engine.run(coordinateListPoints(coords))
+        engine.printTimings()
+
+        #calculate average integral and height at each coordinate
+        x = results.column('x')
+        y = results.column('y')
+        for c in coords:
+            atCoord = (x == c[0]) & (y == c[1])
             #having a list of just the output coords as well, just incase...
-            output_coords.append(coords[i])
-            integrals.append(-avg_integral)
-            heights.append(avg_height)
+            output_coords.append(c)
+            integrals.append(np.mean(results.column('integral')[atCoord]))
+            heights.append(np.mean(results.column('height')[atCoord]))
 
     except Exception as e:
         print(type(e))
@@ -1302,13 +1339,16 @@ def mmChaosSearch(XlC, myOSC, linked_folder, save_folder, coords):
     print('Measurement finished at: {0}.'.format(time.strftime('%Y/%m/%d-%H:%M:%S')))
     return output_coords, integrals, heights
     
-def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_filename, device_ID):
+def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_filename, device_ID, channels = None, archiveCSV = False, adaptive = False, coarseStep = 100, tolerance = 1):
     #So some assumptions for this test measurement:
     #We are assuming we have already hit the target in some way
     
     #This function is also a simple scan in one axis/direction.
     #We can call this multiple times if we so please
     
+    #With adaptive = True the fixed grid is replaced by coarse steps (coarseStep um) to bracket the sensor,
+    #then a bisection around each threshold crossing until it is known to within tolerance um
+    
     voltageTolerance=0.01 #V
     rampDownStep=5.0 #V
     rampDownWait=0.25 #s #Used to be 0.5, but the LabView used 0.1. Which is 5 times faster...
@@ -1332,6 +1372,12 @@ def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_fil
     #print('')
 
     try:
+        #The channels to pull from the scope. By default the ones on display, which is
+        #what saveWaveformXY used to write out (so data[:,1], data[:,2], ... are as before)
+        if channels is None:
+            channels = myOSC.getDisplayedChannels()
+        archivePath = save_folder if archiveCSV else None
+
         #scanDistance = 2000 #um  +- from home position
         scanDistance = 400 #um  +- from home position #NN HERE
         #scanStep = 25
@@ -1349,163 +1395,66 @@ def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_fil
         #Calcualte the integral
         #Correct for the beam monitor (optional)
         #Append and move on
-        
-        print("")        
-        print("Moving backwards")
-        print("")
-        loopEnd = -scanDistance
-        stopCheck = False
-        #for newPos in range(0, loopEnd, -scanStep):
-        newPos = scanStep
-        while newPos > loopEnd:
-            newPos = newPos - scanStep
-            #print(newPos, loopEnd)
-        
-            XlC.move_to_microns(device_ID, newPos)                       
-            XlC.wait_for_stop(device_ID, 100)
+        #The ScanEngine starts the move to the next position while the last waveform is transferred and analysed
 
-            Time = []
-            Volt = []
-            while True:
-                #Measurement            
-                myOSC.singleMeasurement()
-                time.sleep(0.2) #Need to allow the OSC to perform this action                            
-                
-                fileName = linked_folder
-                print("fileName = " + str(fileName))
-                myOSC.saveWaveformXY(fileName)                       
-                
-                time.sleep(1) #Need to allow the OSC to perform this action                            
-                
-                
-                #Analysis
-                startIndex = 24
-                success = False                
-                while not success:
-                    success, data = Read_XYFormat(save_folder, ".csv", False, startIndex)
-                Time = data[:,0]
-                trigVolt = data[:,1]
-                Volt = data[:,2]
-                bmVolt = data[:,3]
+        def makeAnalysis(timeBefore, timeAfter):
+            #timeBefore/timeAfter define an area around the minimum to integrate (sufficiently large)
+            def analyse(data):
+                features = pulseFeatures(data[:,0], data[:,2], -1, timeBefore, timeAfter)
 
                 #Check that the signal is valid. If the voltage goes too high (positive)
                 #Then we need to retake the waveform
-                if max(Volt) < overVoltageThreshold:          
-                    break
-                print("Overvoltage Found. Retaking Waveform")
-        
-
-            if min(Volt) > validSignalThreshold:                
-                if not stopCheck:
-                    stopCheck = True
+                if features['maxVolt'] >= overVoltageThreshold:
+                    print("Overvoltage Found. Retaking Waveform")
+                    return None
+
+                return {'integral' : features['integral'], 'height' : features['height'], 'minVolt' : features['minVolt'],
+                        'cfdTime' : features['cfdTime'], 'noise' : features['noise']}
+            return analyse
+
+        def makeStopCondition():
+            #Once the signal is too small carry on for 5 more steps, then stop
+            weakAt = []
+            def stopCondition(results):
+                position = results.last('position')
+                if len(weakAt) == 0 and results.last('minVolt') > validSignalThreshold:
                     print("Max Voltage too small. Moving on in 5 more steps")
-                    loopEnd = newPos - (5*scanStep)
-         
-            #If we made it this far, perform the analysis
-            #Calculate integral and move on
-                    
-            #Firstly find the minimum
-            minVolt = min(Volt)
-            timeAtMin = 0
-            for i in range(len(Time)):
-                if Volt[i] == minVolt:
-                    timeAtMin = Time[i]
-                    break
-                    
-            #Then define an area around it to integrate (sufficiently large)
-            timeBefore = 5e-9 #20e-9
-            timeAfter = 10e-9 #20e-9
-            #We could be more refined, but I think it's fine to be coarse
-            timeStep = Time[1] - Time[0]
-            startTime = timeAtMin - timeBefore
-            endTime = timeAtMin + timeAfter
-            integral = 0
-            for i in range(len(Time)):
-                if Time[i] > startTime:
-                    if Time[i] < endTime:
-                        integral = integral + (timeStep * Volt[i])
-         
-            positions.append(newPos)
-            integrals.append(-integral)
-            heights.append(-min(Volt))
-         
-        print("")        
-        print("Moving forwards")
-        print("")
-        #Repeat for the other direction 
-        loopEnd = scanDistance
-        stopCheck = False
-        #for newPos in range(scanStep, loopEnd, scanStep):
-        newPos = 0
-        while newPos < loopEnd:
-            newPos = newPos + scanStep
-            XlC.move_to_microns(device_ID, newPos)                       
-            XlC.wait_for_stop(device_ID, 100)
-
-            Time = []
-            Volt = []
-            while True:
-                #Measurement            
-                myOSC.singleMeasurement()
-                time.sleep(0.2) #Need to allow the OSC to perform this action                            
-                
-                fileName = linked_folder
-                print("fileName = " + str(fileName))
-                myOSC.saveWaveformXY(fileName)                       
-                
-                time.sleep(1) #Need to allow the OSC to perform this action                            
-                
-                
-                #Analysis
-                startIndex = 24
-                success = False
-                while not success:
-                    success, data = Read_XYFormat(save_folder, ".csv", False, startIndex)
-                Time = data[:,0]
-                trigVolt = data[:,1]
-                Volt = data[:,2]
-                bmVolt = data[:,3]
+                    weakAt.append(position)
+                return len(weakAt) > 0 and abs(position - weakAt[0]) >= 5*scanStep
+            return stopCondition
 
-                #Check that the signal is valid. If the voltage goes too high (positive)
-                #Then we need to retake the waveform
-                if max(Volt) < overVoltageThreshold:          
-                    break
-                print("Overvoltage Found. Retaking Waveform")
-        
-            if min(Volt) > validSignalThreshold:                
-                if not stopCheck:
-                    stopCheck = True
-                    print("Max Voltage too small. Moving on in 5 more steps")
-                    loopEnd = newPos + (5*scanStep)
-                
-                
-            #If we made it this far, perform the analysis
-            #Calculate integral and move on
-                    
-            #Firstly find the minimum
-            minVolt = min(Volt)
-            timeAtMin = 0
-            for i in range(len(Time)):
-                if Volt[i] == minVolt:
-                    timeAtMin = Time[i]
-                    break
-                    
-            #Then define an area around it to integrate (sufficiently large)
-            timeBefore = 20e-9
-            timeAfter = 20e-9
-            #We could be more refined, but I think it's fine to be coarse
-            timeStep = Time[1] - Time[0]
-            startTime = timeAtMin - timeBefore
-            endTime = timeAtMin + timeAfter
-            integral = 0
-            for i in range(len(Time)):
-                if Time[i] > startTime:
-                    if Time[i] < endTime:
-                        integral = integral + (timeStep * Volt[i])
+        engine = ScanEngine(XlC, myOSC, [device_ID], makeAnalysis(5e-9, 10e-9), channels, ['position'], archivePath = archivePath) #20e-9, 20e-9
+
+        if adaptive:
+            print("")        
+            print("Adaptive edge search")
+            print("")
+            adaptiveResults = ScanResults(['position'])
+            def measureHeight(position):
+                #Same integration windows as the fixed grid uses either side of home
+                engine.analyse = makeAnalysis(5e-9, 10e-9) if position <= 0 else makeAnalysis(20e-9, 20e-9)
+                return engine.measureAt(position, adaptiveResults)['height']
+            edges = adaptiveEdgeSearch(measureHeight, -scanDistance, scanDistance, coarseStep, tolerance)
+            scans = [adaptiveResults]
+        else:
+            print("")        
+            print("Moving backwards")
+            print("")
+            backwards = engine.run(linearScanPoints(0, -scanDistance, scanStep), makeStopCondition())
          
-            positions.append(newPos)
-            integrals.append(-integral) 
-            heights.append(-min(Volt))            
+            print("")        
+            print("Moving forwards")
+            print("")
+            #Repeat for the other direction 
+            engine.analyse = makeAnalysis(20e-9, 20e-9)
+            forwards = engine.run(linearScanPoints(scanStep, scanDistance, scanStep), makeStopCondition())
+            scans = [backwards, forwards]
+        engine.printTimings()
+
+        for results in scans:
+            positions.extend(results.column('position'))
+            integrals.extend(results.column('integral'))
+            heights.extend(results.column('height'))
                 
                 
         #Now rearrange the data into order and do a final analysis and homing
@@ -1525,38 +1474,46 @@ def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_fil
         firstCrossing = 0
         secondCrossing = 0
         
-        for i in range(1, len(orderedHeights[1])-1, 1):
-            if orderedHeights[1][i] > threshold:   
-                #We need to check that there is actually a solution to the problem, otherwise report an error
-                if orderedHeights[1][i-1] < threshold:
-                    firstCrossing = linearInterpolation_2pT(orderedHeights[0][i-1], orderedHeights[0][i], orderedHeights[1][i-1], orderedHeights[1][i], threshold)
-                else:
-                    firstCrossing = orderedHeights[0][i]
-                    print("No valid paramters for interpolation (device not likely found by spiral search")
-                #print("")
-                #print("threshold crossed at: " + str(orderedHeights[1][i]))
-                #print("i = " + str(i))
-                #print("interpolating between {0} and {1}".format(orderedHeights[0][i-1], orderedHeights[0][i]))
-                #print("with heights: {0} and {1}".format(orderedHeights[1][i-1], orderedHeights[1][i]))
-                #print("firstCrossing = " + str(firstCrossing))
-                #print("")
-                break
-
-        for i in range(len(orderedHeights[1])-2, 0, -1):
-            if orderedHeights[1][i] > threshold:
-                if orderedHeights[1][i+1] < threshold:
-                    secondCrossing = linearInterpolation_2pT(orderedHeights[0][i+1], orderedHeights[0][i], orderedHeights[1][i+1], orderedHeights[1][i], threshold)        
-                else:
-                    secondCrossing = orderedHeights[0][i]
-                    print("No valid paramters for interpolation (device not likely found by spiral search")
-                #print("")
-                #print("threshold crossed at: " + str(orderedHeights[1][i]))
-                #print("i = " + str(i))
-                #print("interpolating between {0} and {1}".format(orderedHeights[0][i-1], orderedHeights[0][i]))
-                #print("with heights: {0} and {1}".format(orderedHeights[1][i-1], orderedHeights[1][i]))
-                #print("secondCrossing = " + str(secondCrossing))
-                #print("")
-                break
+        if adaptive:
+            maxHeight = edges['maxHeight']
+            threshold = edges['threshold']
+            #Stay at the original home if no edges were found
+            if edges['firstCrossing'] is not None:
+                firstCrossing = edges['firstCrossing']
+                secondCrossing = edges['secondCrossing']
+        else:
+            for i in range(1, len(orderedHeights[1])-1, 1):
+                if orderedHeights[1][i] > threshold:   
+                    #We need to check that there is actually a solution to the problem, otherwise report an error
+                    if orderedHeights[1][i-1] < threshold:
+                        firstCrossing = linearInterpolation_2pT(orderedHeights[0][i-1], orderedHeights[0][i], orderedHeights[1][i-1], orderedHeights[1][i], threshold)
+                    else:
+                        firstCrossing = orderedHeights[0][i]
+                        print("No valid paramters for interpolation (device not likely found by spiral search")
+                    #print("")
+                    #print("threshold crossed at: " + str(orderedHeights[1][i]))
+                    #print("i = " + str(i))
+                    #print("interpolating between {0} and {1}".format(orderedHeights[0][i-1], orderedHeights[0][i]))
+                    #print("with heights: {0} and {1}".format(orderedHeights[1][i-1], orderedHeights[1][i]))
+                    #print("firstCrossing = " + str(firstCrossing))
+                    #print("")
+                    break
+
+            for i in range(len(orderedHeights[1])-2, 0, -1):
+                if orderedHeights[1][i] > threshold:
+                    if orderedHeights[1][i+1] < threshold:
+                        secondCrossing = linearInterpolation_2pT(orderedHeights[0][i+1], orderedHeights[0][i], orderedHeights[1][i+1], orderedHeights[1][i], threshold)        
+                    else:
+                        secondCrossing = orderedHeights[0][i]
+                        print("No valid paramters for interpolation (device not likely found by spiral search")
+                    #print("")
+                    #print("threshold crossed at: " + str(orderedHeights[1][i]))
+                    #print("i = " + str(i))
+                    #print("interpolating between {0} and {1}".format(orderedHeights[0][i-1], orderedHeights[0][i]))
+                    #print("with heights: {0} and {1}".format(orderedHeights[1][i-1], orderedHeights[1][i]))
+                    #print("secondCrossing = " + str(secondCrossing))
+                    #print("")
+                    break
  
         middle = round((secondCrossing + firstCrossing) / 2)
  
@@ -1568,7 +1525,11 @@ def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_fil
         print("threshold = " + str(threshold))
         print("firstCrossing = " + str(firstCrossing))
         print("secondCrossing = " + str(secondCrossing))
+        if adaptive:
+            print("firstCrossing uncertainty = +-" + str(edges['firstUncertainty']))
+            print("secondCrossing uncertainty = +-" + str(edges['secondUncertainty']))
         print("middle = " + str(middle))
+        print("acquisitions = " + str(engine.acquisitions))
         print("!!!!!")
         print("")
         
@@ -1610,7 +1571,7 @@ def jmFineSearch1D(XlC, myOSC, linked_folder, save_folder, scan_folder, scan_fil
     return status
     
     
-def jmBeamMonitoring(myOSC, linked_folder, save_folder, folder_name):
+def jmBeamMonitoring(myOSC, linked_folder, save_folder, folder_name, channels = None, archiveCSV = True):
     #So some assumptions for this test measurement:
     #We are assuming we have already hit the target in some way
     
@@ -1646,12 +1607,12 @@ def jmBeamMonitoring(myOSC, linked_folder, save_folder, folder_name):
         #But we are taking a measuremnt every so often (say 5 or 10 seconds) 
         #rather than every trigger
 
-        specific_folder = linked_folder + "\\" + folder_name
-        
-        myOSC.mkdir(specific_folder)
-        myOSC.mkdir(specific_folder + '\\Raw_Data\\')        
-
-        time.sleep(1) 
+        #The waveforms are now transferred directly rather than saved by the scope, so
+        #the folders are made locally. Raw waveforms are only kept if archiveCSV is set
+        #(they are written out in the background, in the same format the scope used)
+        if channels is None:
+            channels = myOSC.getDisplayedChannels()
+        os.makedirs(save_folder + "\\" + folder_name + "\\Raw_Data", exist_ok = True)
 
         runTime = 20 * 60
         waitTime = 5
@@ -1668,9 +1629,6 @@ def jmBeamMonitoring(myOSC, linked_folder, save_folder, folder_name):
         
             #time.sleep(0.25) #Need to allow the OSC to perform this action 
             
-            myOSC.singleMeasurement()  
-            time.sleep(0.25)  
-            
             timeSinceStart = int(round(fabs(time.time() - timeAtStart)))
             
             timeStr = str(timeSinceStart).zfill(6)
@@ -1681,79 +1639,25 @@ def jmBeamMonitoring(myOSC, linked_folder, save_folder, folder_name):
 
             print("SecondsSinceStart_" + str(timeStr) + " Captured   " + str(minutesLeft) + " minutes left")
             
-            fileName = linked_folder + "\\" + folder_name +  '\\Raw_Data\\SecondsSinceStart_' + str(timeStr)
             fileName_local = save_folder + "\\" + folder_name + '\\Raw_Data\\SecondsSinceStart_' + str(timeStr)
-            #print("Saving to: " + str(fileName))
-            myOSC.saveWaveformXY(fileName)
-            
-            time.sleep(1.0) #Need to allow the OSC to perform this action 
-            #time.sleep(1.0)
-            
-            ########## NOTE THAT THE INFINIIUM MUST BE ON DISPLAY FOR THIS TO WORK ##########
-            #fileName = save_folder + '\\Images\\Event_' + str(countStr)
-            #myOSC.saveScreenGrab(fileName) 
-                    
+            archivePath = fileName_local if archiveCSV else None
+
             #Perform some analysis here
-            startIndex = 24
-            success = False            
+            success = False
             while not success:
-                success, data = Read_XYFormat(fileName_local, ".csv", False, startIndex)
-            Time = data[:,0]
-            trigVolt = data[:,1]
-            Volt = data[:,2]
-            bmVolt = data[:,3]
-                    
-            #Firstly find the minimum
-            minVolt = min(Volt)
-            timeAtMin = 0
-            for i in range(len(Time)):
-                if Volt[i] == minVolt:
-                    timeAtMin = Time[i]
-                    break
-                    
-            #Then define an area around it to integrate (sufficiently large)
-            timeBefore = 20e-9
-            timeAfter = 20e-9
-            #We could be more refined, but I think it's fine to be coarse
-            timeStep = Time[1] - Time[0]
-            startTime = timeAtMin - timeBefore
-            endTime = timeAtMin + timeAfter
-            sigIntegral = 0
-            for i in range(len(Time)):
-                if Time[i] > startTime:
-                    if Time[i] < endTime:
-                        sigIntegral = sigIntegral + (timeStep * Volt[i])
-         
-         
-         
-            #Firstly find the minimum
-            minVolt = max(bmVolt)
-            timeAtMin = 0
-            for i in range(len(Time)):
-                if bmVolt[i] == minVolt:
-                    timeAtMin = Time[i]
-                    break
-                    
-            #Then define an area around it to integrate (sufficiently large)
-            timeBefore = 30e-9
-            timeAfter = 230e-9
-            #We could be more refined, but I think it's fine to be coarse
-            timeStep = Time[1] - Time[0]
-            startTime = timeAtMin - timeBefore
-            endTime = timeAtMin + timeAfter
-            bmIntegral = 0
-            for i in range(len(Time)):
-                if Time[i] > startTime:
-                    if Time[i] < endTime:
-                        bmIntegral = bmIntegral + (timeStep * bmVolt[i])
-         
-         
+                success, data = myOSC.acquireWaveforms(channels, archivePath)
+
+            #Signal (negative pulse) and beam monitor (positive pulse) in one pass
+            #Areas around each peak to integrate (sufficiently large). We could be more refined, but I think it's fine to be coarse
+            features = pulseFeatures(data[:,0], data[:,[2, 3]], [-1, 1], [20e-9, 30e-9], [20e-9, 230e-9])
+            sigIntegral, bmIntegral = features['integral']
+            sigHeight, bmHeight = features['height']
          
             times.append(timeSinceStart)
             bmIntegrals.append(bmIntegral) 
-            bmHeights.append(max(bmVolt))   
-            sigIntegrals.append(-sigIntegral) 
-            sigHeights.append(-min(Volt))              
+            bmHeights.append(bmHeight)   
+            sigIntegrals.append(sigIntegral) 
+            sigHeights.append(sigHeight)              
                     
             #Now check how long we have been running for                                            
             if secondsLeft < 0:
@@ -1792,7 +1696,7 @@ def jmBeamMonitoring(myOSC, linked_folder, save_folder, folder_name):
     return status
 
 
-def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime):
+def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime, eventStorePath = None, segments = None):
 #So some assumptions for this test measurement:
     #That the oscilloscope is setup auto triggering and all your settings are as you want them
     #All we need to do is set to single trigger mode
@@ -1815,19 +1719,43 @@ def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime):
     comment = ""
 
     errorThrown = False
+    eventStore = None
 
     try:
     
         fileName_local = linked_folder + "\\" + fileName
         fileName_summary = linked_folder + "\\Summary.txt"
         
-        #This will run on  continuous loop until you press Ctrl-C in the terminal to cancel it
-        myOSC.singleMeasurement() 
-                
+        #With eventStorePath every event is kept (in one binary event store) rather than overwriting fileName each time
+        if eventStorePath is not None or segments is not None:
+            channels = myOSC.getDisplayedChannels()
+        
+        threshold = 50e-3 #V (50mV)
+        
         timeAtStart = time.time()
         count = 0
         numOfCoinc = 0
-        while(True):
+        
+        #With segments = N the scope takes N triggers per transfer (segmented memory) and they are all checked at once
+        if segments is not None:
+            myOSC.setupSegmented(segments)
+        while(segments is not None):
+            eventStore, Time, volts = storeSegments(myOSC, channels, eventStore, eventStorePath, float('nan'), count)
+            secondsLeft = runTime - fabs(time.time() - timeAtStart)
+            if volts is not None:
+                heights = pulseFeatures(Time, volts[:, :, [0, 1]], 1)['height']
+                coincidences = int(np.sum((heights[:, 0] > threshold) & (heights[:, 1] > threshold)))
+                count = count + volts.shape[0]
+                numOfCoinc = numOfCoinc + coincidences
+                print(str(volts.shape[0]) + " triggers, " + str(coincidences) + " coincidences   " + str(round(secondsLeft)) + " s remaining")
+            if secondsLeft < 0:
+                break;
+        
+        #This will run on  continuous loop until you press Ctrl-C in the terminal to cancel it
+        if segments is None:
+            myOSC.singleMeasurement() 
+        
+        while(segments is None):
         
             #Cheeck if single measurement has been made
         
@@ -1840,11 +1768,14 @@ def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime):
                 secondsLeft = runTime - fabs(time.time() - timeAtStart)
                 minutesLeft = round(secondsLeft / 60)
                 
-                #fileName = specific_folder + '\\Data\\Event_' + str(countStr)
-                myOSC.saveWaveformXY(fileName_local)
-                
-                time.sleep(0.5) #Need to allow the OSC to perform this action 
-                #time.sleep(1.0)
+                if eventStorePath is None:
+                    #fileName = specific_folder + '\\Data\\Event_' + str(countStr)
+                    myOSC.saveWaveformXY(fileName_local)
+                    
+                    time.sleep(0.5) #Need to allow the OSC to perform this action 
+                    #time.sleep(1.0)
+                else:
+                    eventStore, data = storeEvent(myOSC, channels, eventStore, eventStorePath, float('nan'), count)
                 
                 message = "Triggered!   " + str(round(secondsLeft)) + " s remaining"                
                 
@@ -1861,18 +1792,18 @@ def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime):
                 time.sleep(0.2)  
                 
                 #While it sits and triggers, run the analysis *Should* simulate the real thing a little bit better
-                startIndex = 24
-                success = False            
-                while not success:
-                    success, data = Read_XYFormat(fileName_local, ".csv", False, startIndex)
-                Time = data[:,0]
-                botDUT = data[:,1]
-                topDUT = data[:,2]
-                
-                threshold = 50e-3 #V (50mV)
+                if eventStorePath is None:
+                    startIndex = 24
+                    success = False            
+                    while not success:
+                        success, data = Read_XYFormat(fileName_local, ".csv", False, startIndex)
+                elif data is None:
+                    continue
+                #Both DUTs at once
+                heights = pulseFeatures(data[:,0], data[:,[1, 2]], 1)['height']
                 
-                if max(botDUT) > threshold:
-                    if max(topDUT) > threshold:
+                if heights[0] > threshold:
+                    if heights[1] > threshold:
                         numOfCoinc = numOfCoinc + 1
                         message = message + "   <- Coincidence Found!!!"
                 
@@ -1938,6 +1869,9 @@ def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime):
         with open(fileName_summary, 'w') as f:
             f.write(txt)
      
+    except KeyboardInterrupt:
+        print("Keyboard Interrupt")
+        status=1
     except Exception as e:
         print(type(e))
         print(e.args)
@@ -1947,6 +1881,11 @@ def jmTimingEfficiency(myOSC, linked_folder, save_folder, fileName, runTime):
 
 
     
+    if eventStore is not None:
+        eventStore.close()
+    if segments is not None:
+        myOSC.setupRealTime()
+    
     print('Measurement finished at: {0}.'.format(time.strftime('%Y/%m/%d-%H:%M:%S')))
     
     return status
\ No newline at end of file
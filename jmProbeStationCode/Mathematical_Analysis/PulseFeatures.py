@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# PulseFeatures.py -- per-channel pulse features (height, timing, integral, noise) for whole waveforms or batches of them at once
+
+import numpy as np
+
+
+def perChannel(value, nChannels):
+    #Broadcast a scalar or a per-channel list to shape (nChannels,)
+    return np.broadcast_to(np.asarray(value, dtype = np.float64), (nChannels,))
+
+def crossingTime(Time, pulse, level, iPeak):
+    #Time at which the leading edge of each pulse crosses level, interpolated between the two samples either side.
+    #pulse is (n_events, n_samples, n_channels), level and iPeak are (n_events, n_channels)
+    nSamples = pulse.shape[1]
+    index = np.arange(nSamples)[None, :, None]
+    below = (pulse < level[:, None, :]) & (index <= iPeak[:, None, :])
+    #Last sample below the level before the peak (0 if the pulse starts above it)
+    iBelow = (nSamples - 1) - np.argmax(below[:, ::-1, :], axis = 1)
+    iBelow = np.where(below.any(axis = 1), iBelow, 0)
+    iAbove = np.minimum(iBelow + 1, nSamples - 1)
+
+    vBelow = np.take_along_axis(pulse, iBelow[:, None, :], axis = 1)[:, 0, :]
+    vAbove = np.take_along_axis(pulse, iAbove[:, None, :], axis = 1)[:, 0, :]
+    step = vAbove - vBelow
+    fraction = np.where(step != 0, (level - vBelow) / np.where(step != 0, step, 1), 0)
+    return Time[iBelow] + (fraction * (Time[iAbove] - Time[iBelow]))
+
+def pulseFeatures(Time, Volt, polarity = -1, timeBefore = 20e-9, timeAfter = 20e-9, baselineFraction = 0.1, cfdFraction = 0.5, riseLow = 0.1, riseHigh = 0.9):
+    ''' Features of the largest pulse in every channel, calculated in one pass with no Python loops over samples.
+
+        Time is the (n_samples,) time axis. Volt is (n_samples, n_channels) for one waveform or (n_events, n_samples, n_channels)
+        for a batch (a single (n_samples,) trace also works). polarity (-1 for the negative LGAD pulses, +1 for the beam monitor),
+        timeBefore and timeAfter can be a scalar or one value per channel.
+
+        Returns a dict of arrays with shape (n_channels,) or (n_events, n_channels):
+            height     - peak height (-min(V) for a negative pulse, max(V) for a positive one)
+            peakTime   - time of the peak
+            integral   - integral of the pulse over [peakTime - timeBefore, peakTime + timeAfter] (positive for either polarity)
+            baseline   - mean of the first baselineFraction of the trace
+            noise      - RMS about the baseline over the same samples
+            riseTime   - riseLow to riseHigh of the baseline subtracted amplitude
+            cfdTime    - time the leading edge crosses cfdFraction of the baseline subtracted amplitude
+            minVolt, maxVolt - the raw extremes (e.g. for overvoltage checks) '''
+
+    Time = np.asarray(Time, dtype = np.float64)
+    Volt = np.asarray(Volt)
+    inputDims = Volt.ndim
+    if inputDims == 1:
+        Volt = Volt[None, :, None]
+    elif inputDims == 2:
+        Volt = Volt[None, :, :]
+    nEvents, nSamples, nChannels = Volt.shape
+
+    sign = perChannel(polarity, nChannels)
+    before = perChannel(timeBefore, nChannels)
+    after = perChannel(timeAfter, nChannels)
+
+    #Flip negative channels so every pulse is positive going
+    pulse = Volt * sign
+
+    iPeak = np.argmax(pulse, axis = 1)
+    height = np.take_along_axis(pulse, iPeak[:, None, :], axis = 1)[:, 0, :]
+    peakTime = Time[iPeak]
+
+    timeStep = Time[1] - Time[0]
+    window = (Time[None, :, None] > (peakTime - before)[:, None, :]) & (Time[None, :, None] < (peakTime + after)[:, None, :])
+    integral = timeStep * np.sum(pulse * window, axis = 1)
+
+    nBaseline = max(1, int(nSamples * baselineFraction))
+    baselineRegion = pulse[:, :nBaseline, :]
+    baseline = np.mean(baselineRegion, axis = 1)
+    noise = np.sqrt(np.mean((baselineRegion - baseline[:, None, :])**2, axis = 1))
+
+    amplitude = height - baseline
+    subtracted = pulse - baseline[:, None, :]
+    riseTime = crossingTime(Time, subtracted, riseHigh * amplitude, iPeak) - crossingTime(Time, subtracted, riseLow * amplitude, iPeak)
+    cfdTime = crossingTime(Time, subtracted, cfdFraction * amplitude, iPeak)
+
+    features = {'height' : height,
+                'peakTime' : peakTime,
+                'integral' : integral,
+                'baseline' : baseline * sign,
+                'noise' : noise,
+                'riseTime' : riseTime,
+                'cfdTime' : cfdTime,
+                'minVolt' : np.min(Volt, axis = 1),
+                'maxVolt' : np.max(Volt, axis = 1)}
+
+    #Give the results back in the same layout as the input
+    for k in features:
+        if inputDims == 1:
+            features[k] = features[k][0, 0]
+        elif inputDims == 2:
+            features[k] = features[k][0]
+    return features
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# EventStore.py -- compact binary store for long triggered runs (one file for all events instead of one CSV per event)
+#
+# A store called <path> is three files:
+#   <path>.json  - header: channels, points, time axis (xInc, xOrg) and the metadata layout
+#   <path>.evt   - the waveforms as raw 16 bit scope codes, event after event, (points, channels) per event
+#   <path>.meta  - one fixed size record per event: timestamp, bias voltage, trigger count, temperature
+#                  and the yInc/yOrg of each channel (volts = code * yInc + yOrg)
+# Both binary files only ever get appended to, so an interrupted run loses at most the event being written,
+# and they can be memory mapped so a whole run can be read without parsing any text.
+
+import os, re, glob, json, time
+import numpy as np
+
+from Read_Write_Files.Read_FastOsc_Output import Read_XYFormatWithHeader
+
+codeType = np.dtype('<i2')
+codeMax = np.iinfo(codeType).max
+
+
+def metadataType(nChannels):
+    return np.dtype([('timestamp', '<f8'),
+                     ('biasVoltage', '<f8'),
+                     ('triggerCount', '<i8'),
+                     ('temperature', '<f8'),
+                     ('yInc', '<f8', (nChannels,)),
+                     ('yOrg', '<f8', (nChannels,))])
+
+def quantise(volts, yInc = None):
+    #Volts (points, channels) to 16 bit codes. Each channel is centred on its own range; yInc is the code step per
+    #channel (e.g. the scope YInc from a CSV header) and is only made coarser if the waveform would not fit in 16 bits
+    volts = np.asarray(volts, dtype = np.float64)
+    low = np.min(volts, axis = 0)
+    high = np.max(volts, axis = 0)
+    yOrg = (high + low) / 2
+    smallest = (high - low) / (2 * (codeMax - 1))
+    if yInc is None:
+        yInc = smallest
+    yInc = np.maximum(np.asarray(yInc, dtype = np.float64), smallest)
+    yInc = np.where(yInc > 0, yInc, 1.0)
+    codes = np.round((volts - yOrg) / yInc).astype(codeType)
+    return codes, yInc, yOrg
+
+
+class EventStoreWriter(object):
+    ''' Appends events to a store. Reopening an existing store carries on after its last complete event '''
+
+    __slots__ = ['path', 'channels', 'points', 'metaType', 'evtFile', 'metaFile', 'count']
+
+    def __init__(self, path, channels, points, xInc, xOrg):
+        super(EventStoreWriter, self).__init__()
+        self.path = path
+        self.channels = list(channels)
+        self.points = int(points)
+        self.metaType = metadataType(len(self.channels))
+
+        header = {'channels' : self.channels, 'points' : self.points, 'xInc' : float(xInc), 'xOrg' : float(xOrg),
+                  'codeType' : codeType.str, 'created' : time.strftime('%Y/%m/%d-%H:%M:%S')}
+        if os.path.exists(path + ".json"):
+            with open(path + ".json", 'r') as f:
+                existing = json.load(f)
+            if existing['channels'] != header['channels'] or existing['points'] != header['points']:
+                raise ValueError("Event store " + str(path) + " already exists with different channels or points")
+        else:
+            directory = os.path.dirname(path)
+            if directory != "" and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(path + ".json", 'w') as f:
+                json.dump(header, f, indent = 1)
+
+        #An interrupted append can leave a waveform without its metadata record or a partial record. Cut both
+        #files back to the whole events they have in common, otherwise every later event would be shifted
+        eventSize = self.points * len(self.channels) * codeType.itemsize
+        self.count = 0
+        if os.path.exists(path + ".evt") and os.path.exists(path + ".meta"):
+            self.count = min(os.path.getsize(path + ".evt") // eventSize,
+                             os.path.getsize(path + ".meta") // self.metaType.itemsize)
+        for fileName, size in ((path + ".evt", eventSize), (path + ".meta", self.metaType.itemsize)):
+            if os.path.exists(fileName) and os.path.getsize(fileName) != self.count * size:
+                print("WARNING :: truncating " + str(fileName) + " to " + str(self.count) + " complete events")
+                os.truncate(fileName, self.count * size)
+
+        self.evtFile = open(path + ".evt", 'ab')
+        self.metaFile = open(path + ".meta", 'ab')
+
+    def append(self, codes, yInc, yOrg, timestamp = None, biasVoltage = np.nan, triggerCount = -1, temperature = np.nan):
+        #codes is (points, channels) of 16 bit codes, yInc/yOrg one value per channel
+        codes = np.ascontiguousarray(codes, dtype = codeType)
+        if codes.shape != (self.points, len(self.channels)):
+            raise ValueError("Event has shape {0}, store expects {1}".format(codes.shape, (self.points, len(self.channels))))
+        meta = np.zeros(1, dtype = self.metaType)
+        meta['timestamp'] = time.time() if timestamp is None else timestamp
+        meta['biasVoltage'] = biasVoltage
+        meta['triggerCount'] = triggerCount
+        meta['temperature'] = temperature
+        meta['yInc'] = yInc
+        meta['yOrg'] = yOrg
+        #Waveform first, so a record in the metadata always has its waveform
+        self.evtFile.write(codes.tobytes())
+        self.evtFile.flush()
+        self.metaFile.write(meta.tobytes())
+        self.metaFile.flush()
+        self.count = self.count + 1
+        return self.count - 1
+
+    def appendVolts(self, volts, yInc = None, **metadata):
+        codes, yInc, yOrg = quantise(volts, yInc)
+        return self.append(codes, yInc, yOrg, **metadata)
+
+    def close(self):
+        self.evtFile.close()
+        self.metaFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class EventStore(object):
+    ''' Read access to a store. Nothing is loaded up front: the waveforms and the metadata are memory mapped,
+        so store.codes[i] / store.metadata[i] are views and store[i] only converts the one event to volts '''
+
+    __slots__ = ['path', 'channels', 'points', 'xInc', 'xOrg', 'codes', 'metadata']
+
+    def __init__(self, path):
+        super(EventStore, self).__init__()
+        self.path = path
+        with open(path + ".json", 'r') as f:
+            header = json.load(f)
+        self.channels = header['channels']
+        self.points = header['points']
+        self.xInc = header['xInc']
+        self.xOrg = header['xOrg']
+
+        metaType = metadataType(len(self.channels))
+        eventSize = self.points * len(self.channels) * codeType.itemsize
+        #Only whole events which have both a waveform and a metadata record (the last one may be half written)
+        nEvents = min(os.path.getsize(path + ".evt") // eventSize, os.path.getsize(path + ".meta") // metaType.itemsize)
+        if nEvents == 0:
+            self.codes = np.zeros((0, self.points, len(self.channels)), dtype = codeType)
+            self.metadata = np.zeros(0, dtype = metaType)
+        else:
+            self.codes = np.memmap(path + ".evt", dtype = codeType, mode = 'r', shape = (nEvents, self.points, len(self.channels)))
+            self.metadata = np.memmap(path + ".meta", dtype = metaType, mode = 'r', shape = (nEvents,))
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def getTimeAxis(self, dtype = np.float64):
+        return (self.xOrg + (np.arange(self.points) * self.xInc)).astype(dtype)
+
+    def __getitem__(self, index):
+        #Volts for one event (points, channels) or a slice of events (events, points, channels)
+        meta = self.metadata[index]
+        if np.ndim(meta) == 0:
+            return (self.codes[index] * meta['yInc']) + meta['yOrg']
+        return (self.codes[index] * meta['yInc'][:, None, :]) + meta['yOrg'][:, None, :]
+
+    def getXYFormat(self, index, dtype = np.float64):
+        #Same layout as Read_XYFormat: column 0 is time, then one column per channel
+        data = np.empty((self.points, len(self.channels) + 1), dtype = dtype)
+        data[:, 0] = self.getTimeAxis(dtype)
+        data[:, 1:] = self[index]
+        return data
+
+    def iterChunks(self, chunkSize = 1000):
+        #(first index, volts (events, points, channels)) in blocks, for analysing a whole run with bounded memory
+        for start in range(0, len(self), chunkSize):
+            yield start, self[start:start + chunkSize]
+
+
+def convertCSVFolder(folder, storePath, pattern = "Event_*.csv", biasVoltage = np.nan, temperature = np.nan, startIndex = 24):
+    ''' Packs a folder of scope CSVs (e.g. jmCollectHits Data folders) into an event store.
+        Each CSV's own YInc is kept as the code step where it fits, the event number in the file name becomes the
+        trigger count and the scope date/time in the header becomes the timestamp. Returns the number of events written '''
+
+    def eventNumber(fileName):
+        numbers = re.findall(r"\d+", os.path.basename(fileName))
+        return int(numbers[-1]) if len(numbers) > 0 else -1
+
+    files = sorted(glob.glob(os.path.join(folder, pattern)), key = eventNumber)
+    writer = None
+    written = 0
+    try:
+        for fileName in files:
+            success, header, data = Read_XYFormatWithHeader(fileName, "", False, startIndex)
+            if not success:
+                print("Skipping unreadable file: " + str(fileName))
+                continue
+            if writer is None:
+                #The header values are more precise than the time column, which only has 6 significant figures
+                xInc = header.xInc if header.xInc > 0 else data[1, 0] - data[0, 0]
+                xOrg = header.xOrg if header.xInc > 0 else data[0, 0]
+                writer = EventStoreWriter(storePath, header.channels, data.shape[0], xInc, xOrg)
+            if data.shape[0] != writer.points:
+                print("Skipping file with a different number of points: " + str(fileName))
+                continue
+
+            try:
+                timestamp = time.mktime(header.getDateTime().timetuple())
+            except (ValueError, AttributeError):
+                timestamp = os.path.getmtime(fileName)
+            yInc = header.yInc if len(header.yInc) == data.shape[1] - 1 else None
+            writer.appendVolts(data[:, 1:], yInc, timestamp = timestamp, biasVoltage = biasVoltage,
+                               triggerCount = eventNumber(fileName), temperature = temperature)
+            written = written + 1
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
@@ -8,6 +8,9 @@ Created on Thu Jul  8 14:37:49 2021
 
 import numpy as np
 import time
+import io
+import datetime
+import threading
 
 def getCurrentValue(line, lineSplitter, lineSplitIndex):
     split = line.split(lineSplitter)
@@ -17,6 +20,191 @@ def getCurrentValue(line, lineSplitter, lineSplitIndex):
     return float(split[lineSplitIndex])
 
 
+class FastOscHeader(object):
+    #Typed version of the metadata block the MSO9254A writes at the top of every XY CSV
+    #(the first 24 lines, hence startIndex = 24 everywhere).
+    #Per-channel values are lists in the same order as the data columns, so
+    #channels[0], yInc[0], yOrg[0] all belong to data column 1 (column 0 is time)
+
+    __slots__ = ['channels', 'points', 'count', 'xInc', 'xOrg', 'xUnits', 'yInc', 'yOrg', 'yUnits', 'frame', 'date', 'time']
+
+    def __init__(self):
+        super(FastOscHeader, self).__init__()
+        self.channels = []
+        self.points   = 0
+        self.count    = 0
+        self.xInc     = 0.
+        self.xOrg     = 0.
+        self.xUnits   = ""
+        self.yInc     = []
+        self.yOrg     = []
+        self.yUnits   = ""
+        self.frame    = ""
+        self.date     = ""
+        self.time     = ""
+
+    def parseLines(self, lines):
+        unitsFound = 0
+        for line in lines:
+            split = line.split(',')
+            key = split[0].strip()
+            values = [v.strip() for v in split[1:]]
+            if len(values) == 0:
+                continue
+
+            if key == "":
+                self.channels = values
+            elif key == "Points:":
+                self.points = int(values[0])
+            elif key == "Count:":
+                self.count = int(values[0])
+            elif key == "XInc:":
+                self.xInc = float(values[0])
+            elif key == "XOrg:":
+                self.xOrg = float(values[0])
+            elif key == "YInc:":
+                self.yInc = [float(v) for v in values]
+            elif key == "YOrg:":
+                self.yOrg = [float(v) for v in values]
+            elif key == "Units:":
+                #The first "Units:" line is for X, the second is for Y
+                if unitsFound == 0:
+                    self.xUnits = values[0]
+                else:
+                    self.yUnits = values[0]
+                unitsFound = unitsFound + 1
+            elif key == "Frame:":
+                self.frame = values[0]
+            elif key == "Date:":
+                self.date = values[0]
+            elif key == "Time:":
+                self.time = values[0]
+
+    def getDateTime(self):
+        #e.g. "12 NOV 2024" "10:30:44"
+        return datetime.datetime.strptime(self.date.title() + " " + self.time, "%d %b %Y %H:%M:%S")
+
+    def getTimeAxis(self, dtype = np.float64):
+        #Rebuild the time column from XOrg/XInc rather than reading it
+        return (self.xOrg + (self.xInc * np.arange(self.points))).astype(dtype)
+
+
+def Read_FastOscHeader(path, extention = "", headerLength = 24):
+    #Only reads the metadata block, not the (much larger) numeric block
+    header = FastOscHeader()
+    try:
+        lines = []
+        with open(path + extention, 'r') as file1:
+            for i in range(headerLength):
+                lines.append(file1.readline().rstrip('\r\n'))
+        header.parseLines(lines)
+    except Exception as e:
+        print("Issue reading header: " + str(path + extention))
+        print(e)
+        return False, None
+
+    return True, header
+
+
+def Write_XYFormat(path, extention, header, data):
+    #Writes a waveform out in the same layout as the scope's own XY .csv files
+    #(24 header lines then the data) so that Read_XYFormat(..., startIndex = 24) reads it back
+    nChannels = len(header.channels)
+
+    def headerLine(key, value):
+        if not isinstance(value, list):
+            value = [value] * nChannels
+        return (key + ":").ljust(20) + "," + ",".join([str(v) for v in value])
+
+    lines = []
+    lines.append("," + ",".join(header.channels))
+    lines.append(headerLine("Revision", 0))
+    lines.append(headerLine("Type", "interpolation"))
+    lines.append(headerLine("Start", 0))
+    lines.append(headerLine("Points", header.points))
+    lines.append(headerLine("Count", header.count))
+    lines.append(headerLine("XDispRange", 0))
+    lines.append(headerLine("XDispOrg", 0))
+    lines.append(headerLine("XInc", header.xInc))
+    lines.append(headerLine("XOrg", header.xOrg))
+    lines.append(headerLine("Units", header.xUnits))
+    lines.append(headerLine("XReference", 0))
+    lines.append(headerLine("YDispRange", 0))
+    lines.append(headerLine("YDispOrg", 0))
+    lines.append(headerLine("YInc", header.yInc))
+    lines.append(headerLine("YOrg", header.yOrg))
+    lines.append(headerLine("Units", header.yUnits))
+    lines.append(headerLine("YReference", 0))
+    lines.append(headerLine("Frame", header.frame))
+    lines.append(headerLine("Date", header.date))
+    lines.append(headerLine("Time", header.time))
+    lines.append(headerLine("Max Bandwidth", 0))
+    lines.append(headerLine("Min Bandwidth", 0))
+    lines.append("Time Tags (" + header.channels[0] + ")," + ",".join(header.channels))
+
+    np.savetxt(path + extention, data, fmt = "%.6E", delimiter = ", ", header = "\n".join(lines), comments = "")
+
+
+def Write_XYFormat_Background(path, extention, header, data):
+    #Archiving is not on the critical path of a scan, so do it on a separate thread.
+    #data is copied so the caller is free to reuse its array straight away
+    thread = threading.Thread(target = Write_XYFormat, args = (path, extention, header, np.array(data, copy = True)))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def Read_XYFormatWithHeader(path, extention = "", averageOtherColumns = False, startIndex = 0, dtype = np.float64):
+    #Same as Read_XYFormat but also returns the parsed metadata block, i.e. (success, header, data)
+    #Everything before startIndex is treated as header. The numeric block is parsed by numpy in
+    #one call instead of a python loop over every line and column.
+    #dtype can be np.float32 to halve the memory of the returned array
+
+    try:
+        with open(path + extention, 'r') as file1:
+            text = file1.read()
+
+        #Split off exactly startIndex lines, whatever is left is the numeric block
+        parts = text.split('\n', startIndex)
+        body = parts.pop()
+
+        header = FastOscHeader()
+        header.parseLines([line.rstrip('\r') for line in parts])
+
+        try:
+            DataOut = np.loadtxt(io.StringIO(body), delimiter = ',', dtype = dtype, ndmin = 2)
+            blanksFound = False
+        except ValueError:
+            #loadtxt cannot cope with blank cells, so drop to genfromtxt for these (rare) files.
+            #Blanks become NaN here and are set to 0 below, the same as the old reader did
+            DataOut = np.atleast_2d(np.genfromtxt(io.StringIO(body), delimiter = ',', dtype = dtype, filling_values = np.nan))
+            blanksFound = True
+
+        #The scope writes the header first, so a file that is still being copied over
+        #the network share can be shorter than it claims to be. Report this as a failed
+        #read so that the callers polling for the file simply try again
+        if header.points > 0 and len(DataOut) < header.points:
+            raise ValueError("Only " + str(len(DataOut)) + " of " + str(header.points) + " points found")
+
+        if averageOtherColumns:
+            if blanksFound:
+                DataOut[:, 2] = np.nanmean(DataOut[:, 1:], axis = 1)
+            else:
+                DataOut[:, 2] = np.mean(DataOut[:, 1:], axis = 1)
+
+        if blanksFound:
+            DataOut = np.nan_to_num(DataOut, copy = False)
+
+    except Exception as e:
+
+        print("Issue reading file: " + str(path + extention))
+        print(e)
+
+        return False, None, None
+
+    return True, header, DataOut
+
+
 
 
 #def Read_XYFormat(path):
@@ -30,7 +218,15 @@ def getCurrentValue(line, lineSplitter, lineSplitIndex):
 #    return Read_XYFormat(path, extention, False)
 
 
-def Read_XYFormat(path, extention = "", averageOtherColumns = False, startIndex = 0):
+def Read_XYFormat(path, extention = "", averageOtherColumns = False, startIndex = 0, dtype = np.float64):
+    #The output will be a 2D array. So to acces your data use DataOut[1,:] (or the other way round)
+    #This now uses the vectorised reader below. The old line-by-line loop is kept as
+    #Read_XYFormat_Loop so that the two can be benchmarked against each other
+    success, header, DataOut = Read_XYFormatWithHeader(path, extention, averageOtherColumns, startIndex, dtype)
+    return success, DataOut
+
+
+def Read_XYFormat_Loop(path, extention = "", averageOtherColumns = False, startIndex = 0):
     #DataOut = []    
     #The output will be a 2D array. So to acces your data use DataOut[1,:] (or the other way round)         
     
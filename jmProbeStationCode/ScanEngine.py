@@ -0,0 +1,311 @@
+#!/usr/bin/python
+# ScanEngine.py -- pipelined stage + oscilloscope scans (move to the next point while the last waveform is transferred and analysed)
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from Read_Write_Files.Write_Plt_Format import Write_StandardPltFormat
+from Read_Write_Files.Read_FastOsc_Output import Write_XYFormat_Background
+from Mathematical_Analysis.Interpolation import linearInterpolation_2pT
+
+
+# Scan point generators. A point is a tuple with one position (in um) per axis passed to the ScanEngine.
+# Anything that yields tuples can be used, these just cover the usual cases.
+
+def linearScanPoints(start, stop, step):
+    #1D scan from start towards stop (inclusive if it lands on it), works in either direction
+    step = abs(step) if stop >= start else -abs(step)
+    nSteps = int(round((stop - start) / step))
+    for i in range(nSteps + 1):
+        yield (start + (i * step),)
+
+def rasterScanPoints(xStart, xStop, xStep, yStart, yStop, yStep, snake = True):
+    #2D raster. With snake = True every other row is run backwards so the stage never has to fly back
+    xPoints = [p[0] for p in linearScanPoints(xStart, xStop, xStep)]
+    for row, yPoint in enumerate(linearScanPoints(yStart, yStop, yStep)):
+        rowPoints = xPoints if (not snake or row % 2 == 0) else xPoints[::-1]
+        for xPoint in rowPoints:
+            yield (xPoint, yPoint[0])
+
+def coordinateListPoints(coords):
+    #Arbitrary list of coordinates, e.g. [(x0, y0), (x1, y1), ...]
+    for c in coords:
+        yield tuple([float(v) for v in np.atleast_1d(c)])
+
+
+class ScanResults(object):
+    ''' Table of scan results which grows one row at a time.
+        Optionally every row is appended to a text file as soon as it arrives so nothing is lost if a scan is interrupted '''
+
+    def __init__(self, axisNames, streamPath = None):
+        self.axisNames = list(axisNames)
+        self.columns = None
+        self.rows = []
+        self.streamPath = streamPath
+
+    def append(self, point, values):
+        if self.columns is None:
+            self.columns = self.axisNames + list(values.keys())
+            if self.streamPath is not None:
+                with open(self.streamPath, 'w') as f:
+                    f.write(",".join(self.columns) + "\n")
+        row = list(point) + [values[k] for k in self.columns[len(self.axisNames):]]
+        self.rows.append(row)
+        if self.streamPath is not None:
+            with open(self.streamPath, 'a') as f:
+                f.write(",".join([str(r) for r in row]) + "\n")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def last(self, name):
+        #Value of a column in the most recent row
+        return self.rows[-1][self.columns.index(name)]
+
+    def column(self, name):
+        index = self.columns.index(name)
+        return np.array([r[index] for r in self.rows])
+
+    def sortedBy(self, name):
+        #Returns a new table with the rows in order of the given column
+        ordered = ScanResults(self.axisNames)
+        ordered.columns = self.columns
+        index = self.columns.index(name)
+        ordered.rows = sorted(self.rows, key = lambda r: r[index])
+        return ordered
+
+    def writePlt(self, folderPath, filename, xName, yName):
+        Write_StandardPltFormat(folderPath, filename, "x,y", [list(self.column(xName)), list(self.column(yName))])
+
+
+class ScanEngine(object):
+    ''' Runs a scan over the points from a generator with the stage move, the waveform transfer and the analysis overlapped.
+
+        At each point the stage is stopped and the scope is triggered (digitize). As soon as the acquisition is complete
+        the move to the next point is started and the waveform is transferred and analysed on a worker thread. The scope
+        is only triggered again once the previous transfer has finished, as it can only serve one request at a time.
+
+        analyse(data) is called on the worker thread with the waveform in the usual (time, channel, ...) layout. It returns
+        a dict of values for the results table, or None to reject the waveform (e.g. over voltage) in which case the point
+        is revisited at the end of the scan (up to maxRetries times). '''
+
+    def __init__(self, XlC, myOSC, axes, analyse, channels = None, axisNames = None, repeats = 1, maxRetries = 5, streamPath = None, archivePath = None):
+        self.XlC = XlC
+        self.myOSC = myOSC
+        self.axes = list(axes)
+        self.analyse = analyse
+        self.channels = channels
+        self.axisNames = axisNames if axisNames is not None else ['axis' + str(i) for i in range(len(self.axes))]
+        self.repeats = repeats
+        self.maxRetries = maxRetries
+        self.streamPath = streamPath
+        self.archivePath = archivePath
+        self.timings = {}
+        self.acquisitions = 0
+        self.lock = threading.Lock()
+
+    def addTiming(self, stage, elapsed):
+        with self.lock:
+            self.timings[stage] = self.timings.get(stage, 0.) + elapsed
+
+    def moveTo(self, point):
+        #Start every axis moving before waiting on any of them
+        for device_id, position in zip(self.axes, point):
+            self.XlC.move_to_microns(device_id, position)
+
+    def waitForStop(self):
+        #All axes are polled together, so this takes as long as the longest move
+        self.XlC.wait_for_stop_all(self.axes, 100)
+
+    def transferAndAnalyse(self, point, count):
+        #Runs on the worker thread
+        start = time.perf_counter()
+        success, header, data = self.myOSC.getWaveforms(self.channels)
+        self.addTiming('transfer', time.perf_counter() - start)
+        if not success:
+            return None
+        if self.archivePath is not None:
+            Write_XYFormat_Background(self.archivePath + "_" + str(count).zfill(6), ".csv", header, data)
+        start = time.perf_counter()
+        values = self.analyse(data)
+        self.addTiming('analyse', time.perf_counter() - start)
+        return values
+
+    def run(self, points, stopCondition = None):
+        ''' Scan over points and return a ScanResults table (one row per accepted waveform).
+            stopCondition(results) is checked each time a row is added; returning True ends the scan early.
+            (As the scan is pipelined the point after the one that triggered the stop may already have been measured) '''
+
+        if self.channels is None:
+            self.channels = self.myOSC.getDisplayedChannels()
+
+        results = ScanResults(self.axisNames, self.streamPath)
+        retries = []
+        pending = None
+        stopped = False
+        count = 0
+        timeAtStart = time.perf_counter()
+
+        def collect(job):
+            #Wait for a transfer/analysis to finish and put the result in the table
+            nonlocal stopped
+            jobPoint, jobFuture, jobAttempt = job
+            values = jobFuture.result()
+            if values is None:
+                if jobAttempt < self.maxRetries:
+                    print("Waveform rejected at {0}. Point will be retaken".format(jobPoint))
+                    retries.append((jobPoint, jobAttempt + 1))
+                return
+            results.append(jobPoint, values)
+            if stopCondition is not None and stopCondition(results):
+                stopped = True
+
+        def allPoints():
+            for p in points:
+                yield tuple([float(v) for v in np.atleast_1d(p)]), 0
+            while len(retries) > 0:
+                yield retries.pop(0)
+
+        with ThreadPoolExecutor(max_workers = 1) as worker:
+            for point, attempt in allPoints():
+                if stopped:
+                    break
+
+                start = time.perf_counter()
+                self.moveTo(point)
+                self.waitForStop()
+                self.addTiming('move', time.perf_counter() - start)
+
+                #A retaken point only needs the one rejected waveform again
+                nAcquisitions = self.repeats if attempt == 0 else 1
+                for r in range(nAcquisitions):
+                    #The scope must have finished sending the previous waveform before it is triggered again
+                    if pending is not None:
+                        start = time.perf_counter()
+                        collect(pending)
+                        pending = None
+                        self.addTiming('waiting', time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    self.myOSC.digitize()
+                    self.addTiming('acquire', time.perf_counter() - start)
+
+                    count += 1
+                    self.acquisitions += 1
+                    pending = (point, worker.submit(self.transferAndAnalyse, point, count), attempt)
+
+                    if stopped:
+                        break
+
+            if pending is not None:
+                collect(pending)
+                #A rejected final waveform is still retaken
+                while len(retries) > 0 and not stopped:
+                    point, attempt = retries.pop(0)
+                    self.moveTo(point)
+                    self.waitForStop()
+                    self.myOSC.digitize()
+                    count += 1
+                    self.acquisitions += 1
+                    collect((point, worker.submit(self.transferAndAnalyse, point, count), attempt))
+
+        self.addTiming('total', time.perf_counter() - timeAtStart)
+        return results
+
+    def measureAt(self, point, results = None):
+        ''' Move to a single point and measure it straight away (no pipelining), retaking rejected waveforms.
+            For scans where the next point depends on this measurement. Returns the analysis values '''
+        point = tuple([float(v) for v in np.atleast_1d(point)])
+        start = time.perf_counter()
+        self.moveTo(point)
+        self.waitForStop()
+        self.addTiming('move', time.perf_counter() - start)
+
+        if self.channels is None:
+            self.channels = self.myOSC.getDisplayedChannels()
+
+        for attempt in range(self.maxRetries + 1):
+            start = time.perf_counter()
+            self.myOSC.digitize()
+            self.addTiming('acquire', time.perf_counter() - start)
+            self.acquisitions += 1
+            values = self.transferAndAnalyse(point, self.acquisitions)
+            if values is not None:
+                if results is not None:
+                    results.append(point, values)
+                return values
+        raise Exception("No valid waveform at {0} after {1} attempts".format(point, self.maxRetries + 1))
+
+    def printTimings(self):
+        print("Scan timings [s]: " + ", ".join(["{0} = {1:.2f}".format(k, v) for k, v in self.timings.items()]))
+
+
+def bisectCrossing(measure, outside, inside, hOutside, hInside, threshold, tolerance):
+    #Shrink the bracket [outside, inside] around the threshold crossing until it is narrower than tolerance
+    #Returns the crossing (interpolated between the final bracket ends) and its uncertainty (half the bracket)
+    while abs(inside - outside) > tolerance:
+        middle = (outside + inside) / 2
+        hMiddle = measure(middle)
+        if hMiddle > threshold:
+            inside, hInside = middle, hMiddle
+        else:
+            outside, hOutside = middle, hMiddle
+    if hInside != hOutside:
+        crossing = linearInterpolation_2pT(outside, inside, hOutside, hInside, threshold)
+    else:
+        crossing = (outside + inside) / 2
+    return crossing, abs(inside - outside) / 2
+
+def adaptiveEdgeSearch(measure, start, stop, coarseStep, tolerance, factor = 0.75):
+    ''' Finds the two edges of a signal profile (e.g. the laser crossing a sensor) with far fewer points than a fine grid.
+        A coarse scan from start to stop brackets the sensor, then each threshold crossing (factor * max height) is
+        refined by bisection until the bracket is narrower than tolerance.
+
+        measure(position) returns the height at that position. Returns a dict with the crossings, their uncertainties,
+        the threshold and every measured (position, height). The crossings are None if no coarse point is above
+        the threshold '''
+
+    measured = {}
+    def measureOnce(position):
+        if position not in measured:
+            measured[position] = measure(position)
+        return measured[position]
+
+    coarse = [p[0] for p in linearScanPoints(start, stop, coarseStep)]
+    heights = [measureOnce(p) for p in coarse]
+
+    maxHeight = max(heights)
+    threshold = factor * maxHeight
+    above = [i for i in range(len(heights)) if heights[i] > threshold]
+
+    #No signal (or the wrong window): nothing to refine, the crossings are left as None
+    if len(above) == 0:
+        print("WARNING :: no coarse point above threshold, edges not found")
+        positions = sorted(measured.keys())
+        return {'firstCrossing' : None, 'firstUncertainty' : None,
+                'secondCrossing' : None, 'secondUncertainty' : None,
+                'maxHeight' : maxHeight, 'threshold' : threshold,
+                'positions' : positions, 'heights' : [measured[p] for p in positions]}
+
+    first, last = above[0], above[-1]
+
+    #If the signal is already above threshold at the end of the range there is nothing to refine
+    if first > 0:
+        firstCrossing, firstUncertainty = bisectCrossing(measureOnce, coarse[first-1], coarse[first], heights[first-1], heights[first], threshold, tolerance)
+    else:
+        print("No valid paramters for interpolation (device not likely found by spiral search")
+        firstCrossing, firstUncertainty = coarse[first], abs(coarseStep)
+    if last < len(coarse) - 1:
+        secondCrossing, secondUncertainty = bisectCrossing(measureOnce, coarse[last+1], coarse[last], heights[last+1], heights[last], threshold, tolerance)
+    else:
+        print("No valid paramters for interpolation (device not likely found by spiral search")
+        secondCrossing, secondUncertainty = coarse[last], abs(coarseStep)
+
+    positions = sorted(measured.keys())
+    return {'firstCrossing' : firstCrossing, 'firstUncertainty' : firstUncertainty,
+            'secondCrossing' : secondCrossing, 'secondUncertainty' : secondUncertainty,
+            'maxHeight' : maxHeight, 'threshold' : threshold,
+            'positions' : positions, 'heights' : [measured[p] for p in positions]}
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# benchmarkReadXYFormat.py -- times the vectorised Read_XYFormat against the old line-by-line loop
+# Usage: python benchmarkReadXYFormat.py ["path/to/folder/of/scope/csvs"]
+
+import sys, os, time, glob
+import numpy as np
+
+from Read_Write_Files.Read_FastOsc_Output import Read_XYFormat
+from Read_Write_Files.Read_FastOsc_Output import Read_XYFormat_Loop
+from Read_Write_Files.Read_FastOsc_Output import Read_FastOscHeader
+
+defaultFolder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Oscilloscope data", "LGAD beam measurements")
+
+
+def timeReader(reader, files, **kwargs):
+    timeAtStart = time.perf_counter()
+    for f in files:
+        success, data = reader(f, "", startIndex = 24, **kwargs)
+        if not success:
+            print("Failed to read: " + str(f))
+    return time.perf_counter() - timeAtStart
+
+
+if __name__ == '__main__':
+
+    folder = defaultFolder
+    if len(sys.argv) > 1:
+        folder = sys.argv[1]
+
+    files = sorted(glob.glob(os.path.join(folder, "*.csv")))
+    if len(files) == 0:
+        print("No .csv files found in " + str(folder))
+        sys.exit(1)
+
+    success, header = Read_FastOscHeader(files[0])
+    print("Folder: " + str(folder))
+    print("Files: " + str(len(files)) + ", Points per file: " + str(header.points) + ", Channels: " + str(header.channels))
+
+    #Check both readers agree before timing anything
+    success, fast = Read_XYFormat(files[0], "", False, 24)
+    success, loop = Read_XYFormat_Loop(files[0], "", False, 24)
+    print("Max difference between readers: " + str(np.max(np.abs(fast - loop))))
+
+    tLoop = timeReader(Read_XYFormat_Loop, files)
+    tFast64 = timeReader(Read_XYFormat, files)
+    tFast32 = timeReader(Read_XYFormat, files, dtype = np.float32)
+
+    print("")
+    print("Read_XYFormat_Loop:          {0:.3f} s total, {1:.1f} ms per file".format(tLoop, 1000 * tLoop / len(files)))
+    print("Read_XYFormat (float64):     {0:.3f} s total, {1:.1f} ms per file ({2:.1f}x)".format(tFast64, 1000 * tFast64 / len(files), tLoop / tFast64))
+    print("Read_XYFormat (float32):     {0:.3f} s total, {1:.1f} ms per file ({2:.1f}x)".format(tFast32, 1000 * tFast32 / len(files), tLoop / tFast32))
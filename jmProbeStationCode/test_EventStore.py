@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# test_EventStore.py -- checks that an event store survives an interrupted run
+# Usage: python -m pytest test_EventStore.py
+
+import os, shutil, tempfile, unittest
+import numpy as np
+
+from Read_Write_Files.EventStore import EventStore, EventStoreWriter
+
+
+class TestEventStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "run")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def writer(self):
+        return EventStoreWriter(self.path, ['CHAN1', 'CHAN2'], 100, 1e-10, -5e-9)
+
+    def test_interrupted_append(self):
+        rng = np.random.default_rng(1)
+        volts = [rng.normal(size = (100, 2)) for _ in range(3)]
+
+        with self.writer() as writer:
+            writer.appendVolts(volts[0], triggerCount = 1)
+        #Interrupted append: the waveform of event 2 is written, its metadata record only half
+        with self.writer() as writer:
+            writer.evtFile.write(np.zeros((100, 2), dtype = '<i2').tobytes())
+            writer.metaFile.write(b'\x00' * 10)
+
+        with self.writer() as writer:
+            self.assertEqual(writer.count, 1)
+            self.assertEqual(writer.appendVolts(volts[2], triggerCount = 3), 1)
+
+        store = EventStore(self.path)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(list(store.metadata['triggerCount']), [1, 3])
+        #Events keep their own waveforms (quantisation error below one code step)
+        for index, event in enumerate((volts[0], volts[2])):
+            yInc = store.metadata[index]['yInc']
+            self.assertTrue(np.all(np.abs(store[index] - event) <= yInc))
+
+
+if __name__ == '__main__':
+    unittest.main()